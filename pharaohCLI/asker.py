@@ -1,3 +1,10 @@
+from typing import Dict, Optional
+
+from threading import Lock
+
+from pharaohlib import AddSuggestion, RemoveSuggestion
+
+
 class Asker:
     """a class that asks y/n questions and remembers the previous answer"""
     def __init__(self):
@@ -36,3 +43,50 @@ class Asker:
             elif self.prev and response == '':
                 return self.prev == 'y'
             response = input(f'not recognized, {self.small_prompt()}: ')
+
+
+def parse_rules(rule_args) -> Dict[str, str]:
+    """parse the --rule arguments of a sync into a dict of the action of every category"""
+    rules = {'msg': 'show', 'add': 'ask', 'del': 'ask'}
+    if rule_args:
+        for cat, action in rule_args:
+            if cat in ('msg',):
+                if action not in ('show', 'hide'):
+                    raise Exception('msg actions must be either show or hide')
+            elif cat in ('add', 'del'):
+                if action not in ('y', 'n', 'ask'):
+                    raise Exception('add and del actions must be either y, n, or ask')
+            else:
+                raise Exception('rule category must be either msg, add, or del')
+            rules[cat] = action
+    return rules
+
+
+class Decider:
+    """decides on suggestions according to sync rules, asking the user if needed"""
+
+    def __init__(self, rules: Dict[str, str], asker: Asker, prefix: str = '', lock: Optional[Lock] = None):
+        """
+        :param rules: the sync rules, as returned by parse_rules
+        :param asker: the asker to ask the user with
+        :param prefix: a prefix for all prompts and messages
+        :param lock: if set, held while asking the user, so that prompts of concurrent syncs are not mixed
+        """
+        self.rules = rules
+        self.asker = asker
+        self.prefix = prefix
+        self.lock = lock or Lock()
+
+    def __call__(self, suggestion):
+        if isinstance(suggestion, AddSuggestion):
+            rule = self.rules['add']
+        elif isinstance(suggestion, RemoveSuggestion):
+            rule = self.rules['del']
+        else:
+            assert False, 'bad suggestion' + repr(suggestion)
+        with self.lock:
+            return self.asker.ask(rule, self.prefix + str(suggestion))
+
+    def on_message(self, message):
+        if self.rules['msg'] == 'show':
+            print(self.prefix + message)
@@ -0,0 +1,109 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import time
+
+from pharaohlib import Phar
+from pharaohlib import pipeline
+from pharaohlib.content_store import ContentStore
+from pharaohlib.downloads import DownloadScheduler, DownloadResult, TokenBucket
+from pharaohlib.instrumentation import Profiler, null_profiler
+from pharaohlib.metadata_cache import MetadataCache
+from pharaohlib.sources import Source
+
+from pharaohCLI.asker import Asker, Decider
+
+
+class ProjectReport(NamedTuple):
+    path: str
+    sync: Optional[pipeline.SyncReport]
+    downloads: List[DownloadResult]
+    error: Optional[BaseException]
+    duration: float
+
+    def __str__(self):
+        if self.error is not None:
+            return f'{self.path}: failed after {self.duration:.1f}s: {self.error!r}'
+        succeeded = sum(r.success for r in self.downloads)
+        ret = f'{self.path}: {self.sync.accepted} accepted, {self.sync.rejected} rejected, ' \
+            f'{succeeded}/{len(self.downloads)} downloaded in {self.duration:.1f}s'
+        for r in self.downloads:
+            if not r.success:
+                ret += f'\n\tfailed: {r.label}'
+        return ret
+
+
+def _sync_project(path: str, rules: Dict[str, str], full: bool, asker: Asker, prompt_lock: Lock,
+                  fetch_pool: ThreadPoolExecutor, scheduler: DownloadScheduler,
+                  cache: Optional[MetadataCache], store: Optional[ContentStore], source: Optional[Source],
+                  profiler: Profiler, project_limit: Optional[float], max_download_size: Optional[int],
+                  max_bitrate: Optional[float], placement: str, min_free_space: int) -> ProjectReport:
+    start = time.monotonic()
+    project_scheduler = scheduler.child(TokenBucket(project_limit) if project_limit is not None else None)
+    try:
+        phar = Phar.load(path)
+        try:
+            phar.fetch_executor = fetch_pool
+            phar.download_scheduler = project_scheduler
+            phar.metadata_cache = cache
+            phar.content_store = store
+            if source is not None:
+                phar.source = source
+            phar.profiler = profiler
+            phar.max_download_size = max_download_size
+            phar.max_bitrate = max_bitrate
+            phar.placement = placement
+            phar.min_free_space = min_free_space
+            decider = Decider(rules, asker, prefix=f'[{path}] ', lock=prompt_lock)
+            report = pipeline.sync(phar, decider, decider.on_message, full=full)
+            # the project must stay open until its downloads are recorded
+            downloads = project_scheduler.join()
+        finally:
+            phar.close()
+    except Exception as e:
+        return ProjectReport(path, None, project_scheduler.join(), e, time.monotonic() - start)
+    return ProjectReport(path, report, downloads, None, time.monotonic() - start)
+
+
+def batch(paths: Sequence[str], rules: Dict[str, str], *, full: bool = False, projects: int = 4,
+          fetch_workers: int = 16, download_workers: int = 4,
+          cache: Optional[MetadataCache] = None, store: Optional[ContentStore] = None, source: Optional[Source] = None,
+          profiler: Profiler = null_profiler, bandwidth: Optional[TokenBucket] = None,
+          project_limit: Optional[float] = None, order: str = 'submission', max_download_size: Optional[int] = None,
+          max_bitrate: Optional[float] = None, placement: str = 'most_free',
+          min_free_space: int = 1 << 30) -> List[ProjectReport]:
+    """
+    sync many projects at the same time, sharing one pool for fetching metadata and one pool for downloads
+    :param paths: the paths of the projects' files
+    :param rules: the sync rules, as returned by parse_rules
+    :param full: whether to check every video, rather than only the videos that changed since the last sync
+    :param projects: the number of projects to sync at the same time
+    :param fetch_workers: the number of playlist entries to resolve at the same time, across all projects
+    :param download_workers: the number of videos to download at the same time, across all projects
+    :param cache: a metadata cache for all the projects to share
+    :param store: a content store for all the projects to share, so videos in several playlists are downloaded once
+    :param source: the backend to fetch the playlists and videos from, defaults to every project's default
+    :param profiler: a profiler for all the projects to report to
+    :param bandwidth: the bandwidth limit of all the downloads, across all projects
+    :param project_limit: the bandwidth limit of the downloads of every project, in bytes per second
+    :param order: the order of the waiting downloads, one of downloads.ORDERS
+    :param max_download_size: the maximum size (in bytes) of downloaded streams, see Phar.choose_stream
+    :param max_bitrate: the maximum bitrate (in bits per second) of downloaded streams, see Phar.choose_stream
+    :param placement: how new files are spread between the destinations of every project, see
+     Phar.choose_destination
+    :param min_free_space: the free space (in bytes) to leave in every destination
+    :return: a report for every project, in the order of the paths
+    """
+    asker = Asker()
+    prompt_lock = Lock()
+    with ThreadPoolExecutor(fetch_workers, thread_name_prefix='pharaoh-fetch') as fetch_pool, \
+            DownloadScheduler(download_workers, order=order, bandwidth=bandwidth) as scheduler, \
+            ThreadPoolExecutor(projects, thread_name_prefix='pharaoh-project') as project_pool:
+        futures = [
+            project_pool.submit(_sync_project, path, rules, full, asker, prompt_lock, fetch_pool, scheduler, cache,
+                                store, source, profiler, project_limit, max_download_size, max_bitrate, placement,
+                                min_free_space)
+            for path in paths
+        ]
+        return [f.result() for f in futures]
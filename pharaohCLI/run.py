@@ -1,43 +1,206 @@
+from typing import List, Optional, Tuple
+
 import argparse
+import json
+import signal
+from functools import partial
+from pathlib import Path
 
 from pharaohlib import Phar, AddSuggestion, RemoveSuggestion
+from pharaohlib.phar import PLACEMENTS
+from pharaohlib import pipeline
+from pharaohlib.content_store import ContentStore
+from pharaohlib.downloads import DownloadScheduler, ORDERS, RateWindow, TokenBucket, parse_quantity
+from pharaohlib.instrumentation import Profiler, null_profiler
+from pharaohlib.metadata_cache import MetadataCache
+from pharaohlib.plan import Plan, PlanError, apply_plan, make_plan
+from pharaohlib.sources import SOURCES, JsonSource, PafySource, Source, source_named
 
-from pharaohCLI.asker import Asker
+from pharaohCLI.asker import Asker, Decider, parse_rules
+from pharaohCLI.batch import batch
 from pharaohCLI.__data__ import __version__
 
 
 def sync(phar: Phar, args: dict):
-    print(f'current destination is {phar.destination_root}')
-    rules = {'msg': 'show', 'add': 'ask', 'del': 'ask'}
-    if args['rule']:
-        for cat, action in args['rule']:
-            if cat in ('msg',):
-                if action not in ('show', 'hide'):
-                    raise Exception('msg actions must be either show or hide')
-            elif cat in ('add', 'del'):
-                if action not in ('y', 'n', 'ask'):
-                    raise Exception('add and del actions must be either y, n, or ask')
-            else:
-                raise Exception('rule category must be either msg, add, or del')
-            rules[cat] = action
-
-    asker = Asker()
-    for suggestion in phar.suggest_edits():
-        if isinstance(suggestion, str):
-            if rules['msg'] == 'show':
-                print(suggestion)
-        else:
-            if isinstance(suggestion, AddSuggestion):
-                rule = rules['add']
-            elif isinstance(suggestion, RemoveSuggestion):
-                rule = rules['del']
-            else:
-                assert False, 'bad suggestion' + repr(suggestion)
-            accept = asker.ask(rule, str(suggestion))
-            if accept:
-                suggestion.accept()
-            else:
-                suggestion.reject()
+    print(f'current destinations are {", ".join(map(str, phar.destination_roots))}')
+    rules = parse_rules(args['rule'])
+
+    set_download_options(phar, args)
+    bandwidth = make_bandwidth(args['limit'], args['window'])
+    if args['workers'] > 1 or bandwidth is not None or args['order'] != 'submission':
+        phar.download_scheduler = DownloadScheduler(args['workers'], order=args['order'], bandwidth=bandwidth)
+
+    # suggestions are discovered and accepted suggestions are performed while the user is prompted
+    decider = Decider(rules, Asker())
+    pipeline.sync(phar, decider, decider.on_message, full=args['full'])
+
+    if phar.download_scheduler is not None:
+        print(phar.download_scheduler.summary())
+        phar.download_scheduler.shutdown()
+        phar.download_scheduler = None
+
+
+def plan(phar: Phar, args: dict):
+    decider = Decider(parse_rules(args['rule']), Asker())
+    made = make_plan(phar, partial(pipeline.sync, phar, decider, decider.on_message, full=args['full']))
+    made.dump(args['plan_path'])
+    print(made)
+
+
+def apply(phar: Phar, args: dict):
+    try:
+        loaded = Plan.load(args['plan_path'])
+    except (OSError, PlanError) as e:
+        raise Exception(f'could not load plan: {e}') from e
+    set_download_options(phar, args)
+    bandwidth = make_bandwidth(args['limit'], args['window'])
+    with DownloadScheduler(args['workers'], bandwidth=bandwidth) as scheduler:
+        phar.download_scheduler = scheduler
+        try:
+            report = apply_plan(phar, loaded, scheduler)
+        except PlanError as e:
+            raise Exception(str(e)) from e
+        finally:
+            phar.download_scheduler = None
+    print(report)
+
+
+def daemon(phar: Phar, args: dict):
+    # the daemon's modules are only imported by the commands that use them
+    from pharaohlib.daemon import Daemon
+    rules = parse_rules(args['rule'])
+    actions = {AddSuggestion: rules['add'], RemoveSuggestion: rules['del']}
+
+    def decide(suggestion):
+        # the daemon cannot prompt, suggestions that would be asked about are left pending
+        action = actions[type(suggestion)]
+        return None if action == 'ask' else action == 'y'
+
+    def on_message(message):
+        if rules['msg'] == 'show':
+            print(message, flush=True)
+
+    set_download_options(phar, args)
+    phar.download_scheduler = DownloadScheduler(args['workers'], order=args['order'],
+                                                bandwidth=make_bandwidth(args['limit'], args['window']))
+    runner = Daemon(phar, decide, fetch_interval=args['fetch_interval'], scan_interval=args['scan_interval'],
+                    watch=args['watch'], on_message=on_message)
+    socket_path = Path(args['socket']) if args['socket'] else Daemon.socket_path_for(args['path'])
+    try:
+        server = runner.serve(socket_path)
+    except OSError as e:
+        raise Exception(f'could not listen on {socket_path}: {e}') from e
+    print(f'watching {", ".join(map(str, phar.destination_roots))}, query with {socket_path}', flush=True)
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: runner.stop())
+        runner.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(phar.download_scheduler.summary())
+        phar.download_scheduler.shutdown()
+        phar.download_scheduler = None
+
+
+def set_download_options(phar: Phar, args: dict):
+    if args['workers'] < 1:
+        raise Exception('the number of download workers must be positive')
+    phar.max_download_size, phar.max_bitrate, phar.min_free_space = make_budgets(args)
+    phar.placement = args['placement']
+
+
+def add_download_arguments(parser: argparse.ArgumentParser, order=True):
+    parser.add_argument('--limit', action='store', default=None,
+                        help='bandwidth limit of all the downloads, in bytes per second (like 500K or 2M)')
+    parser.add_argument('--window', action='append', default=[],
+                        help='a time of day with a different bandwidth limit, like 01:00-06:30=4M, without a limit '
+                             'the downloads are unlimited during the window, with a limit of 0 they are paused')
+    if order:
+        parser.add_argument('--order', action='store', choices=ORDERS, default='submission',
+                            help='the order in which waiting videos are downloaded')
+    parser.add_argument('--max-size', action='store', default=None, dest='max_size',
+                        help='download a smaller stream of videos whose best stream is larger than this (like 200M)')
+    parser.add_argument('--max-bitrate', action='store', default=None, dest='max_bitrate',
+                        help='download a lower quality stream of videos whose best stream has a higher bitrate, in '
+                             'bits per second (like 1.5M)')
+    parser.add_argument('--placement', action='store', choices=PLACEMENTS, default='most_free',
+                        help='how new videos are spread between the destinations: in the destination with the most '
+                             'free space, or in the first destination that has room for them')
+    parser.add_argument('--min-free', action='store', default='1G', dest='min_free',
+                        help='the free space to leave in every destination (like 500M)')
+
+
+def make_bandwidth(limit: Optional[str], windows: List[str]) -> Optional[TokenBucket]:
+    if limit is None and not windows:
+        return None
+    try:
+        return TokenBucket(parse_quantity(limit) if limit is not None else None, [RateWindow.parse(w) for w in windows])
+    except ValueError as e:
+        raise Exception(str(e)) from e
+
+
+def make_budgets(args: dict) -> Tuple[Optional[int], Optional[float], int]:
+    """get the maximum size and bitrate of downloaded streams, and the free space to leave in every destination"""
+    try:
+        max_size = int(parse_quantity(args['max_size'])) if args['max_size'] is not None else None
+        max_bitrate = parse_quantity(args['max_bitrate'], base=1000) if args['max_bitrate'] is not None else None
+        min_free = int(parse_quantity(args['min_free']))
+    except ValueError as e:
+        raise Exception(str(e)) from e
+    return max_size, max_bitrate, min_free
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='print a breakdown of where the time went')
+    parser.add_argument('--profile-json', action='store', dest='profile_json', default=None,
+                        help='write the breakdown to this file as json')
+
+
+def add_store_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--store', action='store_true', default=False,
+                        help='link videos that were already downloaded by any project from a shared store, instead '
+                             'of downloading them again (the store is at $PHARAOH_STORE, or in the user\'s data '
+                             'directory)')
+    parser.add_argument('--store-hash', action='store_true', default=False, dest='store_hash',
+                        help='also share the storage of identical files of different videos in the store')
+
+
+def make_store(args: dict) -> Optional[ContentStore]:
+    if args['store'] or args['store_hash']:
+        return ContentStore(ContentStore.default_path(), hash_content=args['store_hash'])
+    return None
+
+
+def add_source_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--backend', action='store', default='pafy', choices=SOURCES,
+                        help='how playlists are fetched, youtube-dl lists the titles of a whole playlist at once, '
+                             'pafy fetches the title of every video separately')
+    parser.add_argument('--playlists', action='store', default=None,
+                        help='list playlists from this json file instead, of the form '
+                             '{"playlists": {playlist id: [[video id, title], ...]}}')
+
+
+def make_source(args: dict) -> Source:
+    if args['playlists']:
+        # the videos are still downloaded from the remote source
+        return JsonSource(Path(args['playlists']), PafySource().load_video)
+    return source_named(args['backend'])
+
+
+def make_profiler(args: dict) -> Profiler:
+    if args['profile'] or args['profile_json']:
+        return Profiler()
+    return null_profiler
+
+
+def report_profile(profiler: Profiler, args: dict):
+    if args['profile']:
+        print(profiler)
+    if args['profile_json']:
+        with open(args['profile_json'], 'w') as w:
+            json.dump(profiler.report(), w, indent=2)
 
 
 def main(args=None):
@@ -53,17 +216,93 @@ def main(args=None):
     create_parser.add_argument('source', action='store')
     create_parser.add_argument('destinations', action='store', nargs='+')
     create_parser.add_argument('--fetch', action='store_true', dest='fetch', default=False)
+    add_source_arguments(create_parser)
     create_parser.set_defaults(create=True)
 
+    batch_parser = sub_parsers.add_parser('batch', help='sync many projects at the same time')
+    batch_parser.add_argument('paths', action='store', nargs='+')
+    batch_parser.add_argument('--rule', action='append', nargs=2)
+    batch_parser.add_argument('--full', action='store_true', default=False,
+                              help='check every video, not only the videos that changed since the last sync')
+    batch_parser.add_argument('--projects', action='store', type=int, default=4,
+                              help='number of projects to sync concurrently')
+    batch_parser.add_argument('--fetch-workers', action='store', type=int, default=16, dest='fetch_workers',
+                              help='number of playlist entries to fetch concurrently, across all projects')
+    batch_parser.add_argument('--workers', action='store', type=int, default=4,
+                              help='number of videos to download concurrently, across all projects')
+    batch_parser.add_argument('--project-limit', action='store', default=None, dest='project_limit',
+                              help='bandwidth limit of the downloads of every project, in bytes per second')
+    add_download_arguments(batch_parser)
+    batch_parser.add_argument('--cache-ttl', action='store', type=float, default=24 * 60 * 60, dest='cache_ttl',
+                              help='seconds before cached playlist metadata is fetched again')
+    batch_parser.add_argument('--no-cache', action='store_false', dest='cache', default=True,
+                              help='always fetch all the playlist metadata')
+    add_store_arguments(batch_parser)
+    add_source_arguments(batch_parser)
+    add_profile_arguments(batch_parser)
+    batch_parser.set_defaults(batch=True)
+
+    query_parser = sub_parsers.add_parser('query', help='query a running daemon')
+    query_parser.add_argument('path', action='store')
+    query_parser.add_argument('command', action='store', choices=('status', 'pending', 'sync', 'stop'))
+    query_parser.add_argument('--socket', action='store', default=None,
+                              help='the path of the control socket, defaults to the project\'s path with .sock')
+    query_parser.set_defaults(query=True)
+
     open_parser = sub_parsers.add_parser('open')
     open_parser.add_argument('path', action='store')
+    open_parser.add_argument('--cache-ttl', action='store', type=float, default=24 * 60 * 60, dest='cache_ttl',
+                             help='seconds before cached playlist metadata is fetched again')
+    open_parser.add_argument('--no-cache', action='store_false', dest='cache', default=True,
+                             help='always fetch all the playlist metadata')
+    add_store_arguments(open_parser)
+    add_source_arguments(open_parser)
+    add_profile_arguments(open_parser)
     open_parser.set_defaults(open=True)
     open_sub_parsers = open_parser.add_subparsers()
 
     sync_parser = open_sub_parsers.add_parser('sync')
     sync_parser.add_argument('--rule', action='append', nargs=2)
+    sync_parser.add_argument('--full', action='store_true', default=False,
+                             help='check every video, not only the videos that changed since the last sync')
+    sync_parser.add_argument('--workers', action='store', type=int, default=1,
+                             help='number of videos to download concurrently')
+    add_download_arguments(sync_parser)
     sync_parser.set_defaults(sync=True)
 
+    plan_parser = open_sub_parsers.add_parser('plan', help='decide on the suggestions of a sync, and write the '
+                                                           'decisions to a plan file instead of performing them')
+    plan_parser.add_argument('plan_path', action='store')
+    plan_parser.add_argument('--rule', action='append', nargs=2)
+    plan_parser.add_argument('--full', action='store_true', default=False,
+                             help='check every video, not only the videos that changed since the last sync')
+    plan_parser.set_defaults(plan=True)
+
+    apply_parser = open_sub_parsers.add_parser('apply', help='perform the decisions of a plan file')
+    apply_parser.add_argument('plan_path', action='store')
+    apply_parser.add_argument('--workers', action='store', type=int, default=4,
+                              help='number of videos to download concurrently')
+    add_download_arguments(apply_parser, order=False)
+    apply_parser.set_defaults(apply=True)
+
+    daemon_parser = open_sub_parsers.add_parser('daemon', help='keep the project loaded, and sync it whenever the '
+                                                               'playlist or the destinations change')
+    daemon_parser.add_argument('--rule', action='append', nargs=2,
+                               help='suggestions whose action is ask are left pending, see the query command')
+    daemon_parser.add_argument('--fetch-interval', action='store', type=float, default=10 * 60,
+                               dest='fetch_interval', help='seconds between fetches of the playlist')
+    daemon_parser.add_argument('--scan-interval', action='store', type=float, default=60, dest='scan_interval',
+                               help='seconds between scans of the destinations, that catch the changes that were '
+                                    'not noticed by watching them')
+    daemon_parser.add_argument('--no-watch', action='store_false', dest='watch', default=True,
+                               help='only find changes to the destinations by scanning them periodically')
+    daemon_parser.add_argument('--socket', action='store', default=None,
+                               help='the path of the control socket, defaults to the project\'s path with .sock')
+    daemon_parser.add_argument('--workers', action='store', type=int, default=4,
+                               help='number of videos to download concurrently')
+    add_download_arguments(daemon_parser)
+    daemon_parser.set_defaults(daemon=True)
+
     set_source_parser = open_sub_parsers.add_parser('set_source')
     set_source_parser.add_argument('source', action='store')
     set_source_parser.set_defaults(set_source=True)
@@ -87,25 +326,77 @@ def main(args=None):
 
     if args.get('create'):
         phar = Phar()
-        phar.destinations = args['destinations']
-        phar.source = args['source']
-        phar.write(open(args['path'], mode='x'))
+        phar.source_playlist_id = args['source']
+        phar.destination_roots = [Path(d) for d in args['destinations']]
+        phar.rules = []
+        phar.id_fname_assoc = {}
+        phar.source = make_source(args)
+        if args['fetch']:
+            # make sure the source is valid before writing the project
+            _ = phar.videos
+        phar.write(open(args['path'], mode='xb'))
+    elif args.get('batch'):
+        cache = MetadataCache(MetadataCache.default_path(), ttl=args['cache_ttl']) if args['cache'] else None
+        profiler = make_profiler(args)
+        max_size, max_bitrate, min_free = make_budgets(args)
+        try:
+            project_limit = parse_quantity(args['project_limit']) if args['project_limit'] is not None else None
+        except ValueError as e:
+            raise Exception(str(e)) from e
+        reports = batch(args['paths'], parse_rules(args['rule']), full=args['full'], projects=args['projects'],
+                        fetch_workers=args['fetch_workers'], download_workers=args['workers'], cache=cache,
+                        store=make_store(args), source=make_source(args), profiler=profiler,
+                        bandwidth=make_bandwidth(args['limit'], args['window']), project_limit=project_limit,
+                        order=args['order'], max_download_size=max_size, max_bitrate=max_bitrate,
+                        placement=args['placement'], min_free_space=min_free)
+        for report in reports:
+            print(report)
+        report_profile(profiler, args)
+        failed = sum(r.error is not None for r in reports)
+        if failed:
+            raise Exception(f'{failed}/{len(reports)} projects failed')
+    elif args.get('query'):
+        from pharaohlib.daemon import Daemon, query
+        socket_path = Path(args['socket']) if args['socket'] else Daemon.socket_path_for(args['path'])
+        try:
+            response = query(socket_path, args['command'])
+        except OSError as e:
+            raise Exception(f'could not reach a daemon on {socket_path}: {e}') from e
+        print(json.dumps(response, indent=2, ensure_ascii=False))
     elif args.get('open'):
-        phar = Phar.read(open(args['path'], mode='rb'))
+        # the project is loaded lazily, the playlist is only fetched by the commands that use it
+        # mutations are recorded in the project's journal as they happen, except when planning, which never changes
+        #  the project, and when applying a plan, which writes the project once, when it is closed
+        phar = Phar.load(args['path'], journal=not (args.get('plan') or args.get('apply')))
+        # loading the cache reads all of it, so only the commands that fetch the playlist load it
+        if args['cache'] and (args.get('sync') or args.get('plan') or args.get('daemon')):
+            phar.metadata_cache = MetadataCache(MetadataCache.default_path(), ttl=args['cache_ttl'])
+        phar.content_store = make_store(args)
+        phar.source = make_source(args)
+        phar.profiler = make_profiler(args)
         if args.get('sync'):
             sync(phar, args)
+        elif args.get('daemon'):
+            daemon(phar, args)
+        elif args.get('plan'):
+            plan(phar, args)
+        elif args.get('apply'):
+            apply(phar, args)
         elif args.get('set_source'):
-            phar.source = args['source']
+            phar.set_source(args['source'])
         elif args.get('add_destinations'):
-            phar.destinations.extend(args['paths'])
+            phar.add_destination_roots(args['paths'])
         elif args.get('set_destinations'):
-            phar.destinations = args['path']
-        elif args.get('clean'):
-            phar.rules.clear()
+            phar.set_destination_roots(args['paths'])
+        elif args.get('clean_list'):
+            phar.clear_rules()
         elif args.get('update'):
-            pass
+            # rewrite the project in the newest format, along with its journal
+            phar.save()
         else:
             raise Exception('unhandled args state')
-        phar.write(open(args['path'], mode='wb'))
+        if not args.get('plan'):
+            phar.close()
+        report_profile(phar.profiler, args)
     else:
-        raise Exception('must specify either create or open, run with -h to see help')
+        raise Exception('must specify either create, batch, open or query, run with -h to see help')
@@ -1,3 +1,8 @@
+from typing import Dict, Iterable, List
+
+import re
+
+
 def normalize_RTL(src: str):
     """
     check if a string contains any non-english letters, and if so, return it appended by itself backwards
@@ -11,8 +16,64 @@ def normalize_RTL(src: str):
 _safe_chars = frozenset(" ._,-'")
 
 
+class _SafeTable(dict):
+    """a translation table for str.translate, that computes the replacement of every character on its first use"""
+
+    def __init__(self, keep=()):
+        """
+        :param keep: characters to keep as they are, even if they are not safe
+        """
+        super().__init__((ord(c), ord(c)) for c in keep)
+
+    def __missing__(self, key):
+        c = chr(key)
+        ret = self[key] = key if (c.isalnum() or c in _safe_chars) else ' '
+        return ret
+
+
+# the separator of the titles that are scrubbed together
+_batch_separator = '\0'
+
+# translating ascii strings is fastest, but non-ascii strings are translated one character at a time, so those are
+#  scrubbed with a regular expression instead (\w matches exactly the alphanumeric characters and the underscore)
+_safe_table = _SafeTable()
+_batch_table = _SafeTable(_batch_separator)
+_unsafe_pattern = re.compile(r"[^\w .,'\-]")
+_batch_unsafe_pattern = re.compile(r"[^\w\0 .,'\-]")
+
+# scrubbed titles by their original, there are few distinct titles so the memo is only cleared once it grows large
+_memo: Dict[str, str] = {}
+_memo_size = 1 << 17
+
+
 def safe_filename(src: str):
     """scrub a filename, replace every non alphanumeric character with a whitespace"""
-    return "".join(
-        (c if (c.isalnum() or c in _safe_chars) else ' ')
-        for c in src).strip()
+    ret = _memo.get(src)
+    if ret is None:
+        ret = (src.translate(_safe_table) if src.isascii() else _unsafe_pattern.sub(' ', src)).strip()
+        if len(_memo) >= _memo_size:
+            _memo.clear()
+        _memo[src] = ret
+    return ret
+
+
+def safe_filenames(src: Iterable[str]) -> List[str]:
+    """scrub many filenames at once, see safe_filename"""
+    src = list(src)
+    missing = list({s: None for s in src if s not in _memo})
+    if any(_batch_separator in s for s in missing):
+        return [safe_filename(s) for s in src]
+    if missing:
+        # scrubbing all the titles in one call is much faster than a call for every title
+        joined = _batch_separator.join(missing)
+        if joined.isascii():
+            joined = joined.translate(_batch_table)
+        else:
+            joined = _batch_unsafe_pattern.sub(' ', joined)
+        scrubbed = joined.split(_batch_separator)
+        if len(_memo) + len(missing) > _memo_size:
+            _memo.clear()
+        for s, ret in zip(missing, scrubbed):
+            _memo[s] = ret.strip()
+    # the memo might have been cleared by a concurrent call
+    return [_memo.get(s) or safe_filename(s) for s in src]
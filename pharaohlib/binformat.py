@@ -0,0 +1,308 @@
+"""
+A compact binary encoding for pharaoh projects: a magic number and a schema version, a table of all the strings in
+the project, and sections of fixed-width integer columns, that refer to strings by their index in the table.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Iterable
+
+from array import array
+from itertools import islice
+from pathlib import Path
+import sys
+
+from pharaohlib.dest_index import DestinationIndex, DestinationSet, DirRecord, FileRecord
+from pharaohlib.downloads import PartialDownload
+from pharaohlib.rules import Behaviour, FilenameTrigger, IdTrigger
+from pharaohlib.snapshot import SyncSnapshot
+
+if TYPE_CHECKING:
+    from pharaohlib.phar import Phar
+
+MAGIC = b'PHR\x02'
+# 1: initial version
+# 2: added the sync snapshot
+# 3: multiple destinations, each with its own index
+SCHEMA_VERSION = 3
+
+_TRIGGER_ID = 0
+_TRIGGER_FILENAME = 1
+
+# tri-state booleans
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+
+
+_big_endian = sys.byteorder == 'big'
+
+
+class FormatError(ValueError):
+    """the data is not a valid encoded project"""
+    pass
+
+
+def _tri(value: Optional[bool]) -> int:
+    if value is None:
+        return _NONE
+    return _TRUE if value else _FALSE
+
+
+def _untri(value: int) -> Optional[bool]:
+    if value == _NONE:
+        return None
+    if value == _FALSE:
+        return False
+    if value == _TRUE:
+        return True
+    raise FormatError(f'bad boolean value {value}')
+
+
+class _Writer:
+    def __init__(self):
+        self.body = bytearray()
+        self.strings: Dict[str, int] = {}
+
+    def uint(self, value: int):
+        # LEB128
+        if value < 0:
+            raise ValueError('value must be non-negative')
+        while value >= 0x80:
+            self.body.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self.body.append(value)
+
+    def ref(self, value: Optional[str]) -> int:
+        """get the reference to a string in the table, or 0 for None"""
+        if value is None:
+            return 0
+        index = self.strings.get(value)
+        if index is None:
+            if '\0' in value:
+                raise ValueError(f'cannot encode string {value!r}')
+            index = self.strings[value] = len(self.strings)
+        return index + 1
+
+    def column(self, typecode: str, values: Iterable[int]):
+        """write an array of fixed-width little-endian integers"""
+        arr = array(typecode, values)
+        if _big_endian:
+            arr.byteswap()
+        self.body += arr.tobytes()
+
+    def refs(self, values: Iterable[Optional[str]]):
+        self.column('I', (self.ref(v) for v in values))
+
+    def getvalue(self) -> bytes:
+        header = _Writer()
+        header.body += MAGIC
+        header.body += SCHEMA_VERSION.to_bytes(2, 'little')
+        # dicts preserve insertion order, which is the order of the indices
+        table = '\0'.join(self.strings).encode('utf-8', 'surrogatepass')
+        header.uint(len(self.strings))
+        header.uint(len(table))
+        header.body += table
+        return bytes(header.body + self.body)
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.strings: List[Optional[str]] = [None]
+
+    def uint(self) -> int:
+        ret = 0
+        shift = 0
+        data = self.data
+        try:
+            while True:
+                b = data[self.pos]
+                self.pos += 1
+                ret |= (b & 0x7f) << shift
+                if b < 0x80:
+                    return ret
+                shift += 7
+        except IndexError as e:
+            raise FormatError('unexpected end of data') from e
+
+    def raw(self, length: int) -> memoryview:
+        end = self.pos + length
+        if end > len(self.data):
+            raise FormatError('unexpected end of data')
+        ret = self.data[self.pos:end]
+        self.pos = end
+        return ret
+
+    def column(self, typecode: str, length: int) -> array:
+        ret = array(typecode)
+        ret.frombytes(self.raw(ret.itemsize * length))
+        if _big_endian:
+            ret.byteswap()
+        return ret
+
+    def refs(self, length: int) -> List[Optional[str]]:
+        strings = self.strings
+        try:
+            return [strings[i] for i in self.column('I', length)]
+        except IndexError as e:
+            raise FormatError('bad string reference') from e
+
+    def header(self) -> int:
+        if bytes(self.raw(len(MAGIC))) != MAGIC:
+            raise FormatError('bad magic number')
+        version = int.from_bytes(self.raw(2), 'little')
+        if version > SCHEMA_VERSION:
+            raise FormatError(f'unsupported schema version {version}')
+        count = self.uint()
+        table = self.raw(self.uint())
+        if count:
+            try:
+                self.strings.extend(str(table, 'utf-8', 'surrogatepass').split('\0'))
+            except UnicodeDecodeError as e:
+                raise FormatError('bad string table') from e
+            if len(self.strings) != count + 1:
+                raise FormatError('bad string table')
+        return version
+
+
+_NO_MTIME = -(1 << 63)
+
+
+def dump(phar: Phar) -> bytes:
+    """encode a project"""
+    w = _Writer()
+    w.refs((phar.source_playlist_id,))
+    w.uint(len(phar.destination_roots))
+    w.refs(str(root) for root in phar.destination_roots)
+
+    w.uint(len(phar.id_fname_assoc))
+    w.refs(phar.id_fname_assoc.keys())
+    w.refs(phar.id_fname_assoc.values())
+
+    kinds = []
+    args = []
+    behaviours = []
+    for trigger, behaviour in phar.rules:
+        if type(trigger) is IdTrigger:
+            kinds.append(_TRIGGER_ID)
+            args.append(trigger.id)
+        elif type(trigger) is FilenameTrigger:
+            kinds.append(_TRIGGER_FILENAME)
+            args.append(trigger.pattern)
+        else:
+            raise TypeError(f'cannot encode trigger {trigger!r}')
+        behaviours.append(_tri(behaviour.add) | (_tri(behaviour.remove) << 2))
+    w.uint(len(kinds))
+    w.column('B', kinds)
+    w.refs(args)
+    w.column('B', behaviours)
+
+    partials = phar.partial_downloads
+    w.uint(len(partials))
+    w.refs(partials.keys())
+    w.refs(p.file_name for p in partials.values())
+    w.refs(p.itag for p in partials.values())
+
+    indexes = phar.destination_index.indexes if phar.destination_index is not None else []
+    w.uint(len(indexes))
+    for index in indexes:
+        w.refs((str(index.root),))
+        # a refresh replaces the records, rather than changing them
+        dirs = index.dirs
+        records = dirs.values()
+        w.uint(len(dirs))
+        w.refs(dirs.keys())
+        w.column('q', (_NO_MTIME if r.mtime_ns is None else r.mtime_ns for r in records))
+        w.column('I', (len(r.files) for r in records))
+        w.column('I', (len(r.subdirs) for r in records))
+        files = [(name, f) for r in records for name, f in r.files.items()]
+        w.refs(name for name, _ in files)
+        w.column('Q', (f.size for _, f in files))
+        w.column('q', (f.mtime_ns for _, f in files))
+        w.column('Q', (f.ino for _, f in files))
+        w.refs(name for r in records for name in r.subdirs)
+
+    snapshot = phar.sync_snapshot
+    if snapshot is None:
+        w.uint(0)
+    else:
+        w.uint(1)
+        w.uint(len(snapshot.ids))
+        w.refs(snapshot.ids)
+        w.uint(len(snapshot.pending))
+        w.refs(snapshot.pending)
+
+    return w.getvalue()
+
+
+def load(data: bytes, phar: Phar):
+    """decode a project into an empty Phar"""
+    r = _Reader(data)
+    version = r.header()
+    if version >= 3:
+        phar.source_playlist_id, = r.refs(1)
+        phar.destination_roots = [Path(root) for root in r.refs(r.uint())]
+    else:
+        phar.source_playlist_id, root = r.refs(2)
+        phar.destination_root = None if root is None else Path(root)
+
+    count = r.uint()
+    ids = r.refs(count)
+    phar.id_fname_assoc = dict(zip(ids, r.refs(count)))
+
+    count = r.uint()
+    kinds = r.column('B', count)
+    args = r.refs(count)
+    behaviour_codes = r.column('B', count)
+    behaviours: Dict[int, Behaviour] = {}
+    rules = []
+    for kind, arg, code in zip(kinds, args, behaviour_codes):
+        if kind == _TRIGGER_ID:
+            trigger = IdTrigger(arg)
+        elif kind == _TRIGGER_FILENAME:
+            trigger = FilenameTrigger(arg)
+        else:
+            raise FormatError(f'unknown trigger kind {kind}')
+        behaviour = behaviours.get(code)
+        if behaviour is None:
+            behaviour = behaviours[code] = Behaviour(add=_untri(code & 0b11), remove=_untri(code >> 2))
+        rules.append((trigger, behaviour))
+    phar.rules = rules
+
+    count = r.uint()
+    ids = r.refs(count)
+    file_names = r.refs(count)
+    itags = r.refs(count)
+    phar.partial_downloads = {id_: PartialDownload(f, i) for id_, f, i in zip(ids, file_names, itags)}
+
+    # before version 3, there was at most one index
+    index_count = r.uint()
+    phar.destination_index = DestinationSet() if index_count else None
+    for _ in range(index_count):
+        root, = r.refs(1)
+        index = DestinationIndex(Path(root))
+        count = r.uint()
+        rels = r.refs(count)
+        mtimes = r.column('q', count)
+        file_counts = r.column('I', count)
+        subdir_counts = r.column('I', count)
+        total = sum(file_counts)
+        names = iter(r.refs(total))
+        files = map(FileRecord, r.column('Q', total), r.column('q', total), r.column('Q', total))
+        subdirs = iter(r.refs(sum(subdir_counts)))
+        for rel, mtime_ns, file_count, subdir_count in zip(rels, mtimes, file_counts, subdir_counts):
+            index.dirs[rel] = DirRecord(
+                None if mtime_ns == _NO_MTIME else mtime_ns,
+                dict(zip(islice(names, file_count), islice(files, file_count))),
+                list(islice(subdirs, subdir_count))
+            )
+        phar.destination_index.indexes.append(index)
+
+    phar.sync_snapshot = None
+    if version >= 2 and r.uint():
+        ids = r.refs(r.uint())
+        phar.sync_snapshot = SyncSnapshot.of(ids, r.refs(r.uint()))
+
+    if r.pos != len(r.data):
+        raise FormatError('unexpected data after the end of the project')
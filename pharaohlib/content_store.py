@@ -0,0 +1,158 @@
+from typing import Dict, Optional
+
+import hashlib
+import os
+import shutil
+from contextlib import suppress
+from pathlib import Path
+from threading import Lock
+
+from pharaohlib.downloads import partial_path
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
+# the linux ioctl that clones a file's extents into another file (copy on write)
+_FICLONE = 0x40049409
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    """clone a file, if the file system supports it, return whether it did"""
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as r, open(dst, 'wb') as w:
+            fcntl.ioctl(w.fileno(), _FICLONE, r.fileno())
+    except OSError:
+        with suppress(FileNotFoundError):
+            os.remove(dst)
+        return False
+    return True
+
+
+def link_file(src: Path, dst: Path, reflink=False):
+    """
+    make dst a copy of src that shares its storage if possible.
+    The copy is a hardlink, or a reflink (which can be modified without modifying the source) if reflinks are
+     preferred and supported. If neither is possible, like when the files are on different file systems, the file is
+     copied.
+    :param reflink: whether to prefer reflinks over hardlinks
+    """
+    temp_path = partial_path(dst)
+    with suppress(FileNotFoundError):
+        os.remove(temp_path)
+    if not (reflink and _reflink(src, temp_path)):
+        try:
+            os.link(src, temp_path)
+        except OSError:
+            if reflink or not _reflink(src, temp_path):
+                shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dst)
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as r:
+        while True:
+            chunk = r.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ContentStore:
+    """
+    A directory of downloaded videos that is shared between destinations and projects, so every video is only
+     downloaded once.
+    Videos are stored by their id, as links to the files in the destinations. Optionally, videos are also stored by
+     the hash of their content, so identical files of different videos share their storage.
+    """
+
+    def __init__(self, root: Path, hash_content=False, reflink=False):
+        """
+        :param root: the directory of the store, links can only be made within a single file system
+        :param hash_content: whether to also store videos by the hash of their content
+        :param reflink: whether to prefer reflinks over hardlinks
+        """
+        self.root = Path(root)
+        self.hash_content = hash_content
+        self.reflink = reflink
+        self._by_id: Optional[Dict[str, str]] = None  # the file name of every video in the store
+        self._lock = Lock()
+
+    @staticmethod
+    def default_path() -> Path:
+        """the store path to use, unless specified otherwise"""
+        env = os.environ.get('PHARAOH_STORE')
+        if env:
+            return Path(env)
+        data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+        return Path(data_home, 'pharaoh', 'store')
+
+    @property
+    def _ids_dir(self) -> Path:
+        return self.root / 'ids'
+
+    @property
+    def _blobs_dir(self) -> Path:
+        return self.root / 'sha256'
+
+    def _load(self):
+        self._by_id = {}
+        try:
+            it = os.scandir(self._ids_dir)
+        except FileNotFoundError:
+            return
+        with it:
+            for entry in it:
+                # partial files start with a dot
+                if not entry.name.startswith('.'):
+                    self._by_id[entry.name.partition('.')[0]] = entry.name
+
+    def find(self, videoid: str) -> Optional[Path]:
+        """get the stored file of a video, if there is one"""
+        with self._lock:
+            if self._by_id is None:
+                self._load()
+            name = self._by_id.get(videoid)
+            if name is None:
+                return None
+            ret = self._ids_dir / name
+            if not ret.exists():
+                # removed by someone else
+                del self._by_id[videoid]
+                return None
+            return ret
+
+    def put(self, videoid: str, path: Path):
+        """
+        store a downloaded video
+        :param path: the video's file, if the store already has a file with the same content, the file is replaced by
+         a link to it
+        """
+        dst = self._ids_dir / (videoid + path.suffix)
+        self._ids_dir.mkdir(parents=True, exist_ok=True)
+        if self.hash_content:
+            self._blobs_dir.mkdir(parents=True, exist_ok=True)
+            blob = self._blobs_dir / file_digest(path)
+            if blob.exists():
+                link_file(blob, path, self.reflink)
+            else:
+                link_file(path, blob, self.reflink)
+        link_file(path, dst, self.reflink)
+        with self._lock:
+            if self._by_id is not None:
+                old = self._by_id.get(videoid)
+                if old is not None and old != dst.name:
+                    # the video was stored with a different extension
+                    with suppress(FileNotFoundError):
+                        os.remove(self._ids_dir / old)
+                self._by_id[videoid] = dst.name
+
+    def materialize(self, stored: Path, dst: Path):
+        """create a file in a destination from a stored file"""
+        link_file(stored, dst, self.reflink)
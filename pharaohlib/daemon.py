@@ -0,0 +1,238 @@
+from typing import Callable, Dict, List, Optional
+
+import json
+import os
+import socket
+import socketserver
+import time
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+from pharaohlib.phar import Phar, ChangeSuggestion
+from pharaohlib.watch import make_watcher
+
+
+class Daemon:
+    """
+    Keeps a project loaded and in sync: the playlist is fetched again on a schedule, the destinations are scanned again
+     whenever they change, and the suggestions are decided on as soon as they are made.
+    Suggestions that are not decided automatically stay pending, and can be queried along with the daemon's status.
+    """
+
+    def __init__(self, phar: Phar, decide: Callable[[ChangeSuggestion], Optional[bool]], *,
+                 fetch_interval: float = 10 * 60, scan_interval: float = 60, watch: bool = True,
+                 on_message: Callable[[str], None] = print):
+        """
+        :param phar: the project, its accepted downloads are performed in the background if it has a download
+         scheduler
+        :param decide: called for every suggestion that has no automatic response, returns whether to accept it, or
+         None to leave it pending
+        :param fetch_interval: the seconds between fetches of the playlist
+        :param scan_interval: the seconds between scans of the destinations, if they are watched for changes, this is
+         only a safety net for changes the watcher missed
+        :param watch: whether to watch the destinations for changes, if the platform supports it
+        :param on_message: called with every message of the syncs
+        """
+        self.phar = phar
+        self.decide = decide
+        self.fetch_interval = fetch_interval
+        self.scan_interval = scan_interval
+        self.on_message = on_message
+        self.watcher = make_watcher(self._on_change) if watch else None
+
+        self.pending: Dict[str, ChangeSuggestion] = {}
+        self.cycles = 0
+        self.last_fetch: Optional[float] = None
+        self.last_sync: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.accepted = 0
+        self.rejected = 0
+
+        self._wake = Event()
+        self._changed = True
+        self._fetch_requested = True
+        self._stopped = False
+        self._lock = Lock()
+
+    @staticmethod
+    def socket_path_for(project_path) -> Path:
+        return Path(str(project_path) + '.sock')
+
+    def _on_change(self):
+        self._changed = True
+        self._wake.set()
+
+    def request_sync(self):
+        """fetch the playlist and sync as soon as possible"""
+        self._fetch_requested = True
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def run(self):
+        """sync the project until stop is called"""
+        next_fetch = next_scan = time.monotonic()
+        try:
+            while not self._stopped:
+                now = time.monotonic()
+                fetch = self._fetch_requested or now >= next_fetch
+                # only a change of the destinations requires checking every video, a new fetch only requires checking
+                #  the videos that changed since the last sync
+                full = self._changed or now >= next_scan
+                if fetch or full:
+                    self._fetch_requested = self._changed = False
+                    self._cycle(fetch, full)
+                    now = time.monotonic()
+                    if fetch:
+                        next_fetch = now + self.fetch_interval
+                    if full:
+                        next_scan = now + self.scan_interval
+                self._wake.wait(max(0.0, min(next_fetch, next_scan) - now))
+                self._wake.clear()
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
+
+    def _cycle(self, fetch: bool, full: bool):
+        phar = self.phar
+        try:
+            if fetch:
+                phar.refetch()
+                self.last_fetch = time.time()
+            pending = {}
+            for item in phar.suggest_edits(full=full):
+                if isinstance(item, str):
+                    self.on_message(item)
+                    continue
+                decision = self.decide(item)
+                if decision is None:
+                    pending[str(item)] = item
+                elif decision:
+                    item.accept()
+                    self.accepted += 1
+                else:
+                    item.reject()
+                    self.rejected += 1
+            phar.mark_synced()
+            phar.checkpoint()
+            with self._lock:
+                if full:
+                    self.pending = pending
+                else:
+                    # the pending suggestions of videos that did not change are not made again
+                    self.pending.update(pending)
+            if self.watcher is not None and phar.destination_index is not None:
+                self.watcher.update(
+                    os.path.join(index.root, rel) for index in phar.destination_index.indexes for rel in index.dirs
+                )
+        except Exception as e:
+            # the daemon keeps running, and tries again on the next cycle
+            self.last_error = f'{type(e).__name__}: {e}'
+            self.on_message(f'sync failed: {self.last_error}')
+            return
+        self.last_error = None
+        self.last_sync = time.time()
+        self.cycles += 1
+
+    def status(self) -> dict:
+        phar = self.phar
+        scheduler = phar.download_scheduler
+        results = scheduler.results() if scheduler is not None else []
+        with self._lock:
+            pending = len(self.pending)
+        with phar._lock:
+            downloading = len(phar._downloading)
+        return {
+            'source': phar.source_playlist_id,
+            'destinations': [str(root) for root in phar.destination_roots],
+            'videos': len(phar.videos) if phar.fetched else None,
+            'watching': self.watcher is not None,
+            'cycles': self.cycles,
+            'last_fetch': self.last_fetch,
+            'last_sync': self.last_sync,
+            'last_error': self.last_error,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'pending': pending,
+            'downloading': downloading,
+            'downloaded': sum(r.success for r in results),
+            'failed_downloads': [r.label for r in results if not r.success],
+        }
+
+    def pending_suggestions(self) -> List[str]:
+        with self._lock:
+            return list(self.pending)
+
+    def handle(self, command: str) -> dict:
+        """answer a query of the control socket"""
+        if command == 'status':
+            return self.status()
+        if command == 'pending':
+            return {'pending': self.pending_suggestions()}
+        if command == 'sync':
+            self.request_sync()
+            return {'ok': True}
+        if command == 'stop':
+            self.stop()
+            return {'ok': True}
+        return {'error': f'unknown command {command!r}, expected status, pending, sync or stop'}
+
+    def serve(self, path: Path) -> 'ControlServer':
+        """answer queries on a unix socket in the background, see query"""
+        return ControlServer(self, path)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode('utf-8').strip()
+            if not command:
+                continue
+            response = self.server.daemon_.handle(command)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class ControlServer:
+    """a unix socket that answers queries about a daemon, one json line for every command line"""
+
+    def __init__(self, daemon: Daemon, path: Path):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError('unix sockets are not supported on this platform')
+        self.path = Path(path)
+        if self.path.exists():
+            try:
+                query(self.path, 'status')
+            except OSError:
+                # left over by a daemon that did not shut down cleanly
+                self.path.unlink()
+            else:
+                raise OSError(f'a daemon is already running on {self.path}')
+        self._server = socketserver.ThreadingUnixStreamServer(str(self.path), _Handler)
+        self._server.daemon_threads = True
+        self._server.daemon_ = daemon
+        self._thread = Thread(target=self._server.serve_forever, name='pharaoh-control', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def query(path: Path, command: str, timeout: float = 10) -> dict:
+    """send a command to a daemon's control socket, and return its response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(str(path))
+        s.sendall(command.encode('utf-8') + b'\n')
+        with s.makefile('rb') as r:
+            line = r.readline()
+    if not line:
+        raise OSError('the daemon closed the connection')
+    return json.loads(line.decode('utf-8'))
@@ -0,0 +1,381 @@
+from typing import Dict, Optional, NamedTuple, List, Iterator, Iterable, Tuple, Sequence, Set
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import os
+import time
+from pathlib import Path
+from threading import Lock
+
+
+class FileRecord(NamedTuple):
+    size: int
+    mtime_ns: int
+    ino: int
+
+
+class DirRecord(NamedTuple):
+    # None if the directory's mtime cannot be trusted, and it must be listed again on the next refresh
+    mtime_ns: Optional[int]
+    files: Dict[str, FileRecord]
+    subdirs: List[str]
+
+
+# a directory modified this recently might still be modified within the same mtime tick after we list it
+_racy_window_ns = 2_000_000_000
+
+
+class DestinationIndex:
+    """
+    An index of all the files under a destination directory.
+    The index remembers the mtime of every directory it listed, so that refreshing it only lists the directories
+    that changed since the previous refresh.
+    The index can be queried and refreshed while files are added to it and removed from it by other threads.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.dirs: Dict[str, DirRecord] = {}  # keyed by the directory's path, relative to root
+
+        # the directory of a file by its name, and the directory and name of a file by every stem of its name
+        self._by_name: Optional[Dict[str, str]] = None
+        self._by_stem: Optional[Dict[str, Tuple[str, str]]] = None
+        # the names and stems that more than one file had when the lookups were built, if the file of one of them is
+        #  removed, another file takes its place
+        self._shared: Set[str] = set()
+        # the files that were renamed since the previous refresh, the new name by the old name
+        self.moved: Dict[str, str] = {}
+        # whether the index changed since it was loaded or last stored, the index is not journaled, so a project must
+        #  be saved to keep the changes
+        self.modified = False
+        # guards the records of the files and the lookups
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return self.root, self.dirs
+
+    def __setstate__(self, state):
+        self.root, self.dirs = state
+        self._by_name = self._by_stem = None
+        self._shared = set()
+        self.moved = {}
+        self.modified = False
+        self._lock = Lock()
+
+    def refresh(self) -> int:
+        """
+        bring the index up to date with the destination tree, and find the files that were renamed, see moved
+        :return: the number of directories that had to be listed
+        """
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        listed = 0
+        now = time.time_ns()
+        dirs = {}
+        # the files that are no longer in the directories that were listed again, and the files that are new in them,
+        #  by their inode, a file that was moved is in both
+        gone: Dict[int, Tuple[str, FileRecord]] = {}
+        appeared: Dict[int, Tuple[str, FileRecord]] = {}
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.root, rel)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            record = self.dirs.get(rel)
+            if record is None or record.mtime_ns is None or record.mtime_ns != st.st_mtime_ns:
+                old_files = record.files if record is not None else {}
+                record = self._list_dir(path, st, now)
+                listed += 1
+                if self.dirs:
+                    self._diff(old_files, record.files, gone, appeared)
+            dirs[rel] = record
+            stack.extend(os.path.join(rel, d) for d in reversed(record.subdirs))
+        for rel, record in self.dirs.items():
+            if rel not in dirs:
+                # the directory was removed, or moved
+                self._diff(record.files, {}, gone, appeared)
+        if listed or len(dirs) != len(self.dirs):
+            self.modified = True
+        self.dirs = dirs
+        self._by_name = self._by_stem = None
+        self.moved = {
+            name: appeared[ino][0] for ino, (name, f) in gone.items()
+            # inodes are not available on every platform
+            if ino and ino in appeared and appeared[ino][1].size == f.size and appeared[ino][0] != name
+        }
+        return listed
+
+    @staticmethod
+    def _diff(old_files: Dict[str, FileRecord], new_files: Dict[str, FileRecord],
+              gone: Dict[int, Tuple[str, FileRecord]], appeared: Dict[int, Tuple[str, FileRecord]]):
+        for name, f in old_files.items():
+            if name not in new_files:
+                gone[f.ino] = (name, f)
+        for name, f in new_files.items():
+            if name not in old_files:
+                appeared[f.ino] = (name, f)
+
+    @staticmethod
+    def _list_dir(path, st, now) -> DirRecord:
+        files = {}
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        f_st = entry.stat()
+                        files[entry.name] = FileRecord(f_st.st_size, f_st.st_mtime_ns, f_st.st_ino)
+                except OSError:
+                    continue
+        mtime_ns = st.st_mtime_ns
+        if now - mtime_ns < _racy_window_ns:
+            mtime_ns = None
+        return DirRecord(mtime_ns, files, subdirs)
+
+    def files(self) -> Iterator[Path]:
+        """iterate over the paths of all the files in the index, as they were when the iteration started"""
+        with self._lock:
+            listing = [(rel, list(record.files)) for rel, record in self.dirs.items()]
+        for rel, names in listing:
+            dir_path = self.root / rel
+            for name in names:
+                yield dir_path / name
+
+    def _build_lookups(self):
+        # paths are only created for the files that are found, creating a path for every file is slow
+        self._by_name = {}
+        self._by_stem = {}
+        self._shared = set()
+        for rel, record in self.dirs.items():
+            for name in record.files:
+                self._add_lookups(rel, name)
+
+    def _add_lookups(self, rel: str, name: str):
+        # the first file found for every name is the one kept
+        if self._by_name.setdefault(name, rel) != rel:
+            self._shared.add(name)
+        # a title stem matches every name that continues with a dot, like the glob "<stem>.*"
+        dot_index = name.find('.')
+        while dot_index >= 0:
+            stem = name[:dot_index]
+            if self._by_stem.setdefault(stem, (rel, name)) != (rel, name):
+                self._shared.add(stem)
+            dot_index = name.find('.', dot_index + 1)
+
+    def _discard_lookups(self, rel: str, name: str):
+        # only the entries of the file are removed, unless another file might take the place of one of them
+        if self._by_name.get(name) == rel:
+            if name in self._shared:
+                self._by_name = self._by_stem = None
+                return
+            del self._by_name[name]
+        dot_index = name.find('.')
+        while dot_index >= 0:
+            stem = name[:dot_index]
+            if self._by_stem.get(stem) == (rel, name):
+                if stem in self._shared:
+                    self._by_name = self._by_stem = None
+                    return
+                del self._by_stem[stem]
+            dot_index = name.find('.', dot_index + 1)
+
+    def _path(self, rel: str, name: str) -> Path:
+        return self.root / rel / name
+
+    def _rel(self, path: Path) -> Optional[str]:
+        """the key of the directory of a file in dirs"""
+        try:
+            rel = path.parent.relative_to(self.root)
+        except ValueError:
+            return None
+        rel = str(rel)
+        if rel == '.':
+            rel = ''
+        return rel
+
+    def add(self, path: Path):
+        """add a single new file to the index"""
+        rel = self._rel(path)
+        if rel is None:
+            return
+        st = os.stat(path)
+        with self._lock:
+            record = self.dirs.get(rel)
+            if record is None:
+                # the file is in a directory we haven't listed, the next refresh will find it
+                return
+            record.files[path.name] = FileRecord(st.st_size, st.st_mtime_ns, st.st_ino)
+            self.modified = True
+            if self._by_name is not None:
+                self._add_lookups(rel, path.name)
+
+    def discard(self, path: Path):
+        """remove a single file from the index, if it is there"""
+        rel = self._rel(path)
+        if rel is None:
+            return
+        with self._lock:
+            record = self.dirs.get(rel)
+            if record is None or record.files.pop(path.name, None) is None:
+                return
+            self.modified = True
+            if self._by_name is not None:
+                self._discard_lookups(rel, path.name)
+
+    def find(self, file_name: str) -> Optional[Path]:
+        """get the path of a file by its exact name"""
+        with self._lock:
+            if self._by_name is None:
+                self._build_lookups()
+            rel = self._by_name.get(file_name)
+        if rel is None:
+            return None
+        return self._path(rel, file_name)
+
+    def find_stem(self, stem: str) -> Optional[Path]:
+        """get the path of a file whose name is the stem, followed by any extension"""
+        with self._lock:
+            if self._by_stem is None:
+                self._build_lookups()
+            found = self._by_stem.get(stem)
+        if found is None:
+            return None
+        return self._path(*found)
+
+    def find_stem_names(self, stems: Iterable[str]) -> List[Optional[str]]:
+        """
+        like find_stem for many stems at once, but only get the names of the files, which is much faster than
+         creating their paths
+        :return: the name of the file found for every stem, in the order of the stems
+        """
+        with self._lock:
+            if self._by_stem is None:
+                self._build_lookups()
+            get = self._by_stem.get
+            return [None if found is None else found[1] for found in map(get, stems)]
+
+
+def _refresh_all(indexes: List[DestinationIndex]) -> int:
+    return sum(index.refresh() for index in indexes)
+
+
+class DestinationSet:
+    """
+    The indexes of all the destination directories of a project, that are queried as one.
+    A file name is looked up in the destinations in order, the first destination that has the file wins.
+    """
+
+    def __init__(self, indexes: Sequence[DestinationIndex] = ()):
+        self.indexes = list(indexes)
+        # the files that were renamed within a destination since the previous refresh, the new name by the old name
+        self.moved: Dict[str, str] = {}
+
+    @classmethod
+    def of(cls, roots: Iterable[Path], previous: Optional['DestinationSet'] = None) -> 'DestinationSet':
+        """create the indexes of destination directories, reusing the indexes of the previous set"""
+        reusable = {index.root: index for index in previous.indexes} if previous is not None else {}
+        return cls([reusable.get(root) or DestinationIndex(root) for root in roots])
+
+    @property
+    def roots(self) -> List[Path]:
+        return [index.root for index in self.indexes]
+
+    @property
+    def modified(self) -> bool:
+        """whether any of the indexes changed since they were loaded or last stored"""
+        return any(index.modified for index in self.indexes)
+
+    def mark_stored(self):
+        for index in self.indexes:
+            index.modified = False
+
+    def __getstate__(self):
+        return self.indexes
+
+    def __setstate__(self, state):
+        self.indexes = state
+        self.moved = {}
+
+    def refresh(self) -> int:
+        """
+        refresh the indexes of all the destinations, see DestinationIndex.refresh.
+        Every volume is listed by its own thread, and the destinations on the same volume are listed one after the
+         other, so listing many disks takes as long as listing the slowest of them, without contending for any of them.
+        :return: the number of directories that had to be listed
+        """
+        volumes: Dict[Optional[int], List[DestinationIndex]] = {}
+        for index in self.indexes:
+            try:
+                device = os.stat(index.root).st_dev
+            except OSError:
+                # the destination is missing, refreshing it only empties it
+                device = None
+            volumes.setdefault(device, []).append(index)
+        if len(volumes) <= 1:
+            listed = _refresh_all(self.indexes)
+        else:
+            with ThreadPoolExecutor(len(volumes), thread_name_prefix='pharaoh-scan') as executor:
+                listed = sum(executor.map(_refresh_all, volumes.values()))
+        self.moved = {}
+        for index in self.indexes:
+            for old, new in index.moved.items():
+                self.moved.setdefault(old, new)
+        return listed
+
+    def files(self) -> Iterator[Path]:
+        """iterate over the paths of all the files in all the destinations"""
+        return chain.from_iterable(index.files() for index in self.indexes)
+
+    def _owner(self, path: Path) -> Optional[DestinationIndex]:
+        """the index of the destination that contains a path"""
+        for index in self.indexes:
+            if index._rel(path) is not None:
+                return index
+        return None
+
+    def add(self, path: Path):
+        """add a single new file to the index of its destination"""
+        index = self._owner(path)
+        if index is not None:
+            index.add(path)
+
+    def discard(self, path: Path):
+        """remove a single file from the index of its destination, if it is there"""
+        index = self._owner(path)
+        if index is not None:
+            index.discard(path)
+
+    def find(self, file_name: str) -> Optional[Path]:
+        for index in self.indexes:
+            ret = index.find(file_name)
+            if ret is not None:
+                return ret
+        return None
+
+    def find_stem(self, stem: str) -> Optional[Path]:
+        for index in self.indexes:
+            ret = index.find_stem(stem)
+            if ret is not None:
+                return ret
+        return None
+
+    def find_stem_names(self, stems: Iterable[str]) -> List[Optional[str]]:
+        """see DestinationIndex.find_stem_names, every destination is only asked for the stems that are still missing"""
+        stems = list(stems)
+        if not self.indexes:
+            return [None] * len(stems)
+        ret = self.indexes[0].find_stem_names(stems)
+        for index in self.indexes[1:]:
+            missing = [i for i, name in enumerate(ret) if name is None]
+            if not missing:
+                break
+            for i, name in zip(missing, index.find_stem_names([stems[i] for i in missing])):
+                ret[i] = name
+        return ret
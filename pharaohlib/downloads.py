@@ -0,0 +1,363 @@
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Union
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from copy import copy
+from datetime import datetime, time as time_of_day
+from heapq import heappush, heappop
+from itertools import count
+from threading import BoundedSemaphore, Condition, Lock
+from pathlib import Path
+import os
+import re
+import time
+
+
+class PartialDownload(NamedTuple):
+    """a download that was started but did not finish"""
+    file_name: str
+    itag: Optional[str]  # the stream that was being downloaded, so we can resume from the same stream
+
+
+def partial_path(path: Path) -> Path:
+    """the path an unfinished download of a file is written to"""
+    # the leading dot ensures the partial file is never mistaken for the file itself
+    return path.with_name('.' + path.name + '.part')
+
+
+def fetch_resumable(url: str, path: Path, chunk_size: int = 1 << 16,
+                    throttle: Optional[Callable[[int], None]] = None) -> int:
+    """
+    download a url to a file, writing it to a partial file first and moving it into place once done.
+    If the partial file already exists, the download is resumed from its end.
+    :param throttle: called with the size of every chunk once it is read, and can block to limit the bandwidth
+    :return: the number of bytes transferred
+    """
+    # urllib.request imports the http and email packages, which most commands never need
+    from http.client import HTTPException
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+    temp_path = partial_path(path)
+    try:
+        offset = os.stat(temp_path).st_size
+    except FileNotFoundError:
+        offset = 0
+
+    request = Request(url, headers={'User-Agent': 'pharaoh'})
+    if offset:
+        request.add_header('Range', f'bytes={offset}-')
+    try:
+        response = urlopen(request)
+    except HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # the partial file is already complete
+        os.replace(temp_path, path)
+        return 0
+
+    transferred = 0
+    with response:
+        if offset and response.status != 206:
+            # the server ignored the range, start over
+            offset = 0
+        expected = response.headers.get('Content-Length')
+        with open(temp_path, 'ab' if offset else 'wb') as w:
+            try:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    if throttle is not None:
+                        # only the bytes that were actually transferred are charged, the next read waits for them
+                        throttle(len(chunk))
+                    w.write(chunk)
+                    transferred += len(chunk)
+            except HTTPException as e:
+                raise OSError(f'transfer of {url} was interrupted') from e
+    if expected is not None and transferred != int(expected):
+        # keep the partial file, so the download can be resumed
+        raise OSError(f'transfer of {url} ended after {transferred} out of {expected} bytes')
+    os.replace(temp_path, path)
+    return transferred
+
+
+_quantity_pattern = re.compile(r'(?i)\s*(\d+(?:\.\d*)?)\s*([kmg]?)\s*')
+
+
+def parse_quantity(text: str, base: int = 1024) -> float:
+    """
+    parse a number with an optional K, M or G suffix, like "1.5M"
+    :param base: the multiplier of every suffix, 1024 for bytes and 1000 for bits
+    """
+    match = _quantity_pattern.fullmatch(text)
+    if not match:
+        raise ValueError(f'invalid quantity {text!r}')
+    number, suffix = match.groups()
+    return float(number) * base ** ' kmg'.index(suffix.lower() or ' ')
+
+
+class RateWindow(NamedTuple):
+    """a time of day in which downloads are limited to a different rate"""
+    start: time_of_day
+    end: time_of_day  # can be before start, for windows that cross midnight
+    rate: Optional[float]  # bytes per second, None for no limit, 0 to pause downloads
+
+    def __contains__(self, t: time_of_day):
+        if self.start <= self.end:
+            return self.start <= t < self.end
+        return t >= self.start or t < self.end
+
+    @classmethod
+    def parse(cls, text: str) -> 'RateWindow':
+        """parse a window like "01:00-06:30=2M", without a rate the window has no limit"""
+        span, _, rate = text.partition('=')
+        try:
+            start, end = span.split('-')
+            return cls(time_of_day.fromisoformat(start.strip()), time_of_day.fromisoformat(end.strip()),
+                       parse_quantity(rate) if rate else None)
+        except ValueError as e:
+            raise ValueError(f'invalid time window {text!r}') from e
+
+
+class TokenBucket:
+    """
+    A bandwidth limit. Transferred bytes are taken out of the bucket, which refills at the rate of the limit, and
+     transfers wait while the bucket is empty.
+    The rate can be different in different times of the day.
+    """
+    # how long to wait before checking again whether paused downloads can continue
+    pause_interval = 1.0
+
+    def __init__(self, rate: Optional[float], windows: Sequence[RateWindow] = (), burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 now: Callable[[], datetime] = datetime.now):
+        """
+        :param rate: the limit in bytes per second, None for no limit, 0 to pause downloads
+        :param windows: times of day in which the rate is different, the first window that contains the time is used
+        :param burst: the capacity of the bucket, defaults to a second's worth of bytes
+        :param clock: the monotonic clock of the bucket, sleep: waits for a number of seconds, now: the time of day
+        """
+        self.rate = rate
+        self.windows = list(windows)
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._now = now
+        self._tokens = 0.0
+        self._last = clock()
+        self._lock = Lock()
+
+    def current_rate(self) -> Optional[float]:
+        if self.windows:
+            t = self._now().time()
+            for window in self.windows:
+                if t in window:
+                    return window.rate
+        return self.rate
+
+    def consume(self, amount: int):
+        """take bytes out of the bucket, waiting until the limit allows it"""
+        while True:
+            with self._lock:
+                rate = self.current_rate()
+                now = self._clock()
+                elapsed = now - self._last
+                self._last = now
+                if rate is None:
+                    return
+                if rate > 0:
+                    capacity = self.burst if self.burst is not None else rate
+                    self._tokens = min(capacity, self._tokens + elapsed * rate)
+                    # less than a byte of debt is a rounding error of the refill, waiting for it could take less
+                    #  time than the clock can tell
+                    if self._tokens > -1:
+                        # the bucket can go into debt, which the next transfers wait for
+                        self._tokens -= amount
+                        return
+                    wait = -self._tokens / rate
+                else:
+                    wait = self.pause_interval
+            self._sleep(wait)
+
+
+class _PriorityGate:
+    """lets a limited number of threads in at a time, the waiting thread with the lowest priority goes in first"""
+
+    def __init__(self, slots: int):
+        self._free = slots
+        self._waiting = []
+        self._order = count()
+        self._cond = Condition()
+
+    @contextmanager
+    def __call__(self, priority):
+        with self._cond:
+            entry = (priority, next(self._order))
+            heappush(self._waiting, entry)
+            while not (self._free and self._waiting[0] is entry):
+                self._cond.wait()
+            heappop(self._waiting)
+            self._free -= 1
+            # the next thread might be able to go in as well
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._free += 1
+                self._cond.notify_all()
+
+
+# the orders in which the scheduler can perform the downloads that wait for a worker
+ORDERS = ('submission', 'position', 'smallest', 'newest')
+
+
+class DownloadResult(NamedTuple):
+    label: str
+    success: bool
+    duration: float
+
+
+class DownloadScheduler:
+    """
+    A pool of worker threads that performs downloads in the background.
+    The number of downloads that are waiting or running is bounded, submitting a download when the queue is full
+    blocks until a download finishes.
+    Waiting downloads are started in the order of their priorities, and the bandwidth of all the downloads can be
+     limited.
+    """
+
+    def __init__(self, workers: int = 4, queue_size: Optional[int] = None, order: str = 'submission',
+                 bandwidth: Optional[TokenBucket] = None):
+        """
+        :param workers: the number of downloads that can run at the same time
+        :param queue_size: the number of downloads that can wait for a worker, defaults to the number of workers
+        :param order: the order of the waiting downloads, one of ORDERS, the priorities of the downloads are given
+         by the submitters according to the order
+        :param bandwidth: the bandwidth limit of all the downloads
+        """
+        if workers < 1:
+            raise ValueError('there must be at least one worker')
+        if order not in ORDERS:
+            raise ValueError(f'order must be one of {", ".join(ORDERS)}')
+        if queue_size is None:
+            queue_size = workers
+        self.workers = workers
+        self.order = order
+        # waiting downloads are prepared (and prioritized) by their own threads, that wait at the gate for a worker
+        self._executor = ThreadPoolExecutor(workers + queue_size, thread_name_prefix='pharaoh-download')
+        self._gate = _PriorityGate(workers)
+        self._buckets: List[TokenBucket] = [bandwidth] if bandwidth is not None else []
+        self._slots = BoundedSemaphore(workers + queue_size)
+        self._futures: List[Future] = []
+        self._results: List[DownloadResult] = []
+        self._results_lock = Lock()
+        self._start = None
+        self._parent: Optional[DownloadScheduler] = None
+
+    def child(self, bandwidth: Optional[TokenBucket] = None) -> 'DownloadScheduler':
+        """
+        create a scheduler that shares this scheduler's workers, queue and bandwidth limit, but can be joined and
+        summarized separately. Downloads submitted to the child are also part of this scheduler's results.
+        :param bandwidth: an additional bandwidth limit, for the downloads of the child only
+        """
+        ret = copy(self)
+        ret._buckets = ([bandwidth] if bandwidth is not None else []) + self._buckets
+        ret._futures = []
+        ret._results = []
+        ret._results_lock = Lock()
+        ret._start = None
+        ret._parent = self
+        return ret
+
+    def _track(self, future: Future):
+        self._futures.append(future)
+        if self._parent is not None:
+            self._parent._track(future)
+
+    def _record(self, result: DownloadResult):
+        with self._results_lock:
+            self._results.append(result)
+        if self._parent is not None:
+            self._parent._record(result)
+
+    def throttle(self, amount: int):
+        """wait until the bandwidth limits allow transferring an amount of bytes, see fetch_resumable"""
+        for bucket in self._buckets:
+            bucket.consume(amount)
+
+    def submit(self, label: str, func: Callable[..., bool], *args,
+               priority: Union[Any, Callable[[], Any]] = None, **kwargs) -> Future:
+        """
+        enqueue a download
+        :param label: a name for the download, to be shown in the summary
+        :param func: the download function, that returns whether the download succeeded
+        :param priority: downloads with lower priorities start first, downloads with equal priorities start in the
+         order they were submitted. If callable, it is called to get the priority while the download waits, so it can
+         load the data the priority depends on.
+        :return: a future for the return value of func
+        """
+        if self._start is None:
+            self._start = time.monotonic()
+            if self._parent is not None and self._parent._start is None:
+                self._parent._start = self._start
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, label, func, args, kwargs, priority)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._track(future)
+        return future
+
+    def _run(self, label, func, args, kwargs, priority):
+        start = time.monotonic()
+        success = False
+        try:
+            if callable(priority):
+                priority = priority()
+            if priority is None:
+                priority = 0
+            with self._gate(priority):
+                # the time the download waited for a worker is not part of its duration
+                start = time.monotonic()
+                success = bool(func(*args, **kwargs))
+            return success
+        finally:
+            self._record(DownloadResult(label, success, time.monotonic() - start))
+            self._slots.release()
+
+    def join(self) -> List[DownloadResult]:
+        """wait for all the enqueued downloads to finish, and return the results of all downloads so far"""
+        for future in self._futures:
+            # exceptions raised by a download count as failures, and are already stored in the results
+            future.exception()
+        self._futures.clear()
+        with self._results_lock:
+            return list(self._results)
+
+    def results(self) -> List[DownloadResult]:
+        """the results of the downloads that finished so far, without waiting for the rest"""
+        with self._results_lock:
+            return list(self._results)
+
+    def shutdown(self):
+        self.join()
+        if self._parent is None:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def summary(self) -> str:
+        """a human-readable summary of all the downloads so far"""
+        results = self.join()
+        elapsed = (time.monotonic() - self._start) if self._start is not None else 0
+        succeeded = sum(r.success for r in results)
+        lines = [f'downloaded {succeeded}/{len(results)} videos in {elapsed:.1f}s using {self.workers} workers']
+        lines.extend(f'\tfailed: {r.label}' for r in results if not r.success)
+        return '\n'.join(lines)
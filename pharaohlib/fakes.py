@@ -0,0 +1,51 @@
+from typing import Sequence
+
+import os
+import time
+from pathlib import Path
+
+
+class FakeStream:
+    """a stream of a fake video, its data is read from a local file"""
+
+    def __init__(self, path: Path, itag: str = '18', extension: str = 'mp4', latency: float = 0):
+        self.path = path
+        self.itag = itag
+        self.extension = extension
+        self.latency = latency
+
+    @property
+    def url(self):
+        # resolving a stream's url is what takes time in pafy
+        time.sleep(self.latency)
+        return self.path.as_uri()
+
+    def get_filesize(self):
+        return os.stat(self.path).st_size
+
+
+class FakeVideo:
+    """
+    a fake video, like a pafy object: it can be listed as a playlist entry, whose title takes time to resolve, and it
+     has the full data that a download needs
+    """
+
+    def __init__(self, videoid: str, title: str, streams: Sequence[FakeStream] = (),
+                 published: str = '2020-01-01 00:00:00', length: int = 180, latency: float = 0):
+        self.videoid = videoid
+        self.streams = list(streams)
+        self.published = published
+        self.length = length  # seconds
+        self._title = title
+        self._latency = latency
+        self._resolved = False
+
+    @property
+    def title(self):
+        if not self._resolved:
+            time.sleep(self._latency)
+            self._resolved = True
+        return self._title
+
+    def getbest(self):
+        return self.streams[0]
@@ -7,7 +7,10 @@ class Frozen:
     """
     A base class to allow for easy copying of simple types
     NOTE: this should only be used with immutable types
+    Subclasses can declare __slots__ for their own members, an instance is entirely restored from its arguments when
+     copied or unpickled
     """
+    __slots__ = ('__args', '__repr', '__hash')
 
     def __new__(cls, *args, **kwargs):
         if len(args) == 1 and isinstance(args[0], cls):
@@ -47,7 +50,9 @@ class Frozen:
             parent_params = {}
 
         cls.__new_params = {}
-        for i, p in enumerate(signature(cls.__new__).parameters.values()):
+        # the first parameter of __new__ is the class itself
+        params = list(signature(cls.__new__).parameters.values())[1:]
+        for i, p in enumerate(params):
             if p.kind == Parameter.VAR_POSITIONAL:
                 for n, j in parent_params.items():
                     cls.__new_params[n] = j + i
@@ -60,6 +65,14 @@ class Frozen:
     def __getnewargs_ex__(self):
         return self.__args
 
+    def __getstate__(self):
+        # everything is restored by __new__, from the arguments
+        return None
+
+    def __setstate__(self, state):
+        # instances pickled before Frozen used slots also stored their dict, which is redundant
+        pass
+
     # all the other methods here are rudimentary but they're useful to have
     def __repr__(self):
         if self.__repr is None:
@@ -71,8 +84,7 @@ class Frozen:
         return self.__repr
 
     def __eq__(self, other):
-        return super().__eq__(self, other) or (isinstance(other, type(self))
-                                               and self.__args == other.__args)
+        return self is other or (isinstance(other, type(self)) and self.__args == other.__args)
 
     def __hash__(self):
         if self.__hash is None:
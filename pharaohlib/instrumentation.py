@@ -0,0 +1,126 @@
+from typing import Dict, List
+
+from collections import Counter
+from threading import Lock
+import time
+
+
+class _Timer:
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+class Profiler:
+    """
+    A registry of counters, timers and tallies, that a project reports its work to.
+    Counters are totals, timers are the number of times an operation ran and the total time it took, and tallies count
+    how many times every key was seen (like which rule was triggered).
+    The registry can be shared between threads and between projects.
+    """
+    # whether the profiler records anything, hot paths can check this to avoid measuring in the first place
+    enabled = True
+
+    def __init__(self):
+        self.counters: Dict[str, int] = Counter()
+        self.timers: Dict[str, List[float]] = {}  # name: [count, total seconds, longest seconds]
+        self.tallies: Dict[str, Dict[str, int]] = {}
+        self._lock = Lock()
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def timer(self, name: str):
+        """a context manager that adds the time spent inside it to a timer"""
+        return _Timer(self, name)
+
+    def tally(self, name: str, key: str):
+        with self._lock:
+            tally = self.tallies.get(name)
+            if tally is None:
+                tally = self.tallies[name] = Counter()
+            tally[key] += 1
+
+    def report(self, top: int = 10) -> dict:
+        """
+        a json-serializable summary of everything recorded so far
+        :param top: the number of most common keys to include of every tally
+        """
+        with self._lock:
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'timers': {
+                    name: {'count': count, 'total': total, 'mean': total / count, 'max': longest}
+                    for name, (count, total, longest) in sorted(self.timers.items())
+                },
+                'tallies': {name: dict(tally.most_common(top)) for name, tally in sorted(self.tallies.items())},
+            }
+
+    def __str__(self):
+        report = self.report()
+        lines = []
+        if report['timers']:
+            width = max(map(len, report['timers']))
+            lines.append('timers:')
+            for name, timer in report['timers'].items():
+                lines.append(f'\t{name:<{width}} {timer["total"]:9.3f}s total, {timer["count"]:7} calls, '
+                             f'{timer["mean"] * 1000:9.3f}ms mean, {timer["max"] * 1000:9.3f}ms max')
+        if report['counters']:
+            width = max(map(len, report['counters']))
+            lines.append('counters:')
+            lines.extend(f'\t{name:<{width}} {value}' for name, value in report['counters'].items())
+        for name, tally in report['tallies'].items():
+            lines.append(f'most common {name}:')
+            lines.extend(f'\t{value:7} {key}' for key, value in tally.items())
+        return '\n'.join(lines)
+
+
+class NullProfiler(Profiler):
+    """a profiler that records nothing, the default for every project"""
+    enabled = False
+
+    def count(self, name, value=1):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    def timer(self, name):
+        return _null_timer
+
+    def tally(self, name, key):
+        pass
+
+
+null_profiler = NullProfiler()
@@ -0,0 +1,103 @@
+from typing import List, Optional
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import Lock
+
+
+def digest(data: bytes) -> str:
+    """a digest of a project's base file, used to tell which base file a journal belongs to"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class Journal:
+    """
+    An append-only log of mutations to a project, stored next to the project's file.
+    Every record is a single line of json, the first line holds the digest of the base file the journal applies to.
+    """
+
+    def __init__(self, path: Path, base_digest: str, sync=True):
+        """
+        open a journal for appending, if the journal belongs to a different base file, it is discarded
+        :param path: the path of the journal file
+        :param base_digest: the digest of the base file
+        :param sync: whether to flush every record to the disk before returning
+        """
+        self.path = path
+        self.sync = sync
+        # the records already in the journal, that should be replayed onto the base file
+        self.records = self.read_records(path, base_digest)
+        self.count = len(self.records)
+        self._lock = Lock()
+        if self.count:
+            with open(path, 'rb') as r:
+                r.seek(-1, os.SEEK_END)
+                cut_off = r.read(1) != b'\n'
+            self._file = open(path, 'a', encoding='utf-8')
+            if cut_off:
+                # end a record that was cut off by a crash, so it won't swallow the next record
+                self._file.write('\n')
+        else:
+            self._file = None
+            self.reset(base_digest)
+
+    @staticmethod
+    def path_for(project_path) -> Path:
+        return Path(str(project_path) + '.journal')
+
+    @staticmethod
+    def read_records(path: Path, base_digest: str) -> List[list]:
+        """read all the records of a journal, if it belongs to the base file"""
+        try:
+            with open(path, encoding='utf-8') as r:
+                lines = r.read().split('\n')
+        except FileNotFoundError:
+            return []
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return []
+        if header.get('base') != base_digest:
+            # the journal was already compacted into a newer base file
+            return []
+        ret = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                ret.append(json.loads(line))
+            except ValueError:
+                # a record that was cut off by a crash
+                continue
+        return ret
+
+    def append(self, *record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self.count += 1
+
+    def reset(self, base_digest: str):
+        """empty the journal, for a new base file"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            temp_path = self.path.with_name(self.path.name + '.temp')
+            with open(temp_path, 'w', encoding='utf-8') as w:
+                w.write(json.dumps({'base': base_digest}) + '\n')
+                w.flush()
+                os.fsync(w.fileno())
+            os.replace(temp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self.count = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
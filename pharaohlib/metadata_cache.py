@@ -0,0 +1,135 @@
+from typing import Callable, Dict, List, Optional, Any
+
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+
+
+class CachedEntry:
+    """
+    A stand-in for a playlist entry, built from cached metadata.
+    The full entry is only loaded once an attribute that is not cached is accessed.
+    """
+
+    def __init__(self, videoid: str, title: str, load: Callable[[], Any]):
+        self.videoid = videoid
+        self.title = title
+        self._load = load
+        self._entry = None
+
+    def __getattr__(self, item):
+        # only called for attributes that are not cached
+        if item.startswith('_'):
+            raise AttributeError(item)
+        if self._entry is None:
+            self._entry = self._load()
+        return getattr(self._entry, item)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.videoid!r}, {self.title!r})'
+
+
+class MetadataCache:
+    """
+    A local cache of playlist and video metadata, that can be shared between projects.
+    Entries older than the time-to-live are considered stale and must be fetched again.
+    When the cache holds too many entries, the least recently used ones are evicted.
+    """
+    format_version = 1
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = 24 * 60 * 60,
+                 max_videos: int = 100_000, max_playlists: int = 1_000):
+        """
+        :param path: the file to store the cache in, or None to keep the cache in memory only
+        :param ttl: the number of seconds a cached entry is considered fresh
+        :param max_videos: the maximum number of videos to keep when storing the cache
+        :param max_playlists: the maximum number of playlists to keep when storing the cache
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_videos = max_videos
+        self.max_playlists = max_playlists
+        # all entries are lists of [*data, fetch timestamp, last use timestamp]
+        self.videos: Dict[str, list] = {}
+        self.playlists: Dict[str, list] = {}
+        self._lock = Lock()
+        if path is not None:
+            self.load()
+
+    @staticmethod
+    def default_path() -> Path:
+        """the cache path to use, unless specified otherwise"""
+        env = os.environ.get('PHARAOH_CACHE')
+        if env:
+            return Path(env)
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return Path(cache_home, 'pharaoh', 'metadata.json')
+
+    def load(self):
+        """load the cache from its file, an unreadable cache is treated as empty"""
+        try:
+            with open(self.path, encoding='utf-8') as r:
+                inner = json.load(r)
+        except (OSError, ValueError):
+            return
+        if inner.get('version') != self.format_version:
+            return
+        with self._lock:
+            self.videos = inner['videos']
+            self.playlists = inner['playlists']
+
+    def save(self):
+        """evict old entries, and write the cache to its file"""
+        if self.path is None:
+            return
+        with self._lock:
+            self._evict()
+            inner = {'version': self.format_version, 'videos': self.videos, 'playlists': self.playlists}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(self.path.name + '.temp')
+            with open(temp_path, 'w', encoding='utf-8') as w:
+                json.dump(inner, w, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+
+    def _evict(self):
+        for entries, limit in ((self.videos, self.max_videos), (self.playlists, self.max_playlists)):
+            if len(entries) <= limit:
+                continue
+            by_use = sorted(entries, key=lambda k: entries[k][-1], reverse=True)
+            for key in by_use[limit:]:
+                del entries[key]
+
+    def _fresh(self, entry, now):
+        return now - entry[-2] <= self.ttl
+
+    def get_title(self, video_id: str, allow_stale=False) -> Optional[str]:
+        """get the cached title of a video, or None if it is not cached (or stale, unless allow_stale)"""
+        now = time.time()
+        with self._lock:
+            entry = self.videos.get(video_id)
+            if entry is None or not (allow_stale or self._fresh(entry, now)):
+                return None
+            entry[-1] = now
+            return entry[0]
+
+    def set_title(self, video_id: str, title: str):
+        now = time.time()
+        with self._lock:
+            self.videos[video_id] = [title, now, now]
+
+    def get_playlist(self, playlist_id: str, allow_stale=False) -> Optional[List[str]]:
+        """get the cached video ids of a playlist, or None if it is not cached (or stale, unless allow_stale)"""
+        now = time.time()
+        with self._lock:
+            entry = self.playlists.get(playlist_id)
+            if entry is None or not (allow_stale or self._fresh(entry, now)):
+                return None
+            entry[-1] = now
+            return list(entry[0])
+
+    def set_playlist(self, playlist_id: str, video_ids: List[str]):
+        now = time.time()
+        with self._lock:
+            self.playlists[playlist_id] = [list(video_ids), now, now]
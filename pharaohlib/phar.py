@@ -1,25 +1,41 @@
 from __future__ import annotations
 
 import re
-from typing import Iterable, Union, Tuple, List, MutableMapping, TextIO, BinaryIO
+from typing import TYPE_CHECKING, Iterable, Union, Tuple, List, MutableMapping, TextIO, BinaryIO, Dict, Optional, Set
 
 from abc import ABC, abstractmethod
 
 from dataclasses import dataclass
-from itertools import count
-from io import BytesIO, StringIO
+from datetime import datetime
+from io import BytesIO, StringIO, TextIOBase, TextIOWrapper
 import json
 import os
+import shutil
 import warnings
 from pathlib import Path
 import pickle
+import time
+from threading import RLock
+from concurrent.futures import ThreadPoolExecutor, Executor
+from functools import partial
+from contextlib import suppress
 
-import pafy
-
-from pharaohlib._utility import normalize_RTL
-from pharaohlib.rules import Behaviour, Trigger, FilenameTrigger, IdTrigger
+from pharaohlib import binformat
+from pharaohlib._utility import normalize_RTL, safe_filenames
+from pharaohlib.content_store import ContentStore
+from pharaohlib.dest_index import DestinationIndex, DestinationSet
+from pharaohlib.downloads import DownloadScheduler, PartialDownload, fetch_resumable, partial_path
+from pharaohlib.instrumentation import Profiler, null_profiler
+from pharaohlib.journal import Journal, digest
+from pharaohlib.metadata_cache import MetadataCache, CachedEntry
+from pharaohlib.snapshot import SyncSnapshot
+from pharaohlib.sources import Source, PafySource
+from pharaohlib.rules import Behaviour, Trigger, FilenameTrigger, IdTrigger, RuleList, rule_record, rule_from_record
 from pharaohlib.video import Video
 
+if TYPE_CHECKING:
+    from pharaohlib.plan import Plan
+
 
 class ChangeSuggestion(ABC):
     """A suggestion that the user chan choose to accept or reject"""
@@ -37,6 +53,10 @@ class ChangeSuggestion(ABC):
         pass
 
     def suggest(self, auto_response):
+        """
+        yield the suggestion, or perform the automatic response to it and yield a message
+        :param auto_response: the response of the rule that applies to the suggestion, or None if no rule does
+        """
         if auto_response is None:
             yield self
         else:
@@ -44,7 +64,8 @@ class ChangeSuggestion(ABC):
                 self.accept()
                 yield str(self)+' [automatically accepted]'
             else:
-                self.reject()
+                # the response comes from a rule of the project, rejecting would append the same rule again on every
+                #  sync
                 yield str(self) + ' [automatically rejected]'
 
 
@@ -56,13 +77,30 @@ class AddSuggestion(ChangeSuggestion):
     phar: Phar
 
     def accept(self):
-        self.phar.download_callback(self.video.paf, self.fname)
+        """
+        download the video
+        :return: whether the download succeeded, or a future of it if the download was scheduled, or None if the
+         download was planned
+        """
+        if self.phar.plan is not None:
+            self.phar.plan.add_download(self.video, self.fname)
+            return None
+        scheduler = self.phar.download_scheduler
+        if scheduler is None:
+            return self.phar.download_video(self.video, self.fname)
+        download = _ScheduledDownload(self.phar, self.video, self.fname, scheduler.order)
+        videoid = self.video.videoid
+        with self.phar._lock:
+            self.phar._downloading.add(videoid)
+        ret = scheduler.submit(normalize_RTL(self.video.title), download, priority=download.priority)
+        ret.add_done_callback(lambda _: self.phar._download_finished(videoid))
+        return ret
 
     def reject(self):
-        self.phar.rules.append((IdTrigger(self.video.paf.videoid), Behaviour.black))
+        self.phar.add_rule(IdTrigger(self.video.videoid), Behaviour.black)
 
     def __str__(self):
-        return f'download {normalize_RTL(self.video.paf.title)}'
+        return f'download {normalize_RTL(self.video.title)}'
 
 
 @dataclass(frozen=True)
@@ -72,15 +110,102 @@ class RemoveSuggestion(ChangeSuggestion):
     phar: Phar
 
     def accept(self):
+        if self.phar.plan is not None:
+            self.phar.plan.add_removal(self.file)
+            return
         self.phar.remove_callback(self.file)
 
     def reject(self):
-        self.phar.rules.append((FilenameTrigger(re.escape(str(self.file))), Behaviour.white))
+        self.phar.add_rule(FilenameTrigger(re.escape(self.file.name)), Behaviour.white)
 
     def __str__(self):
         return f'remove {normalize_RTL(str(self.file))}'
 
 
+class _ScheduledDownload:
+    """a download that waits for a worker of the download scheduler, the video is loaded while it waits if needed"""
+
+    def __init__(self, phar: Phar, video: Video, fname: str, order: str):
+        self.phar = phar
+        self.video = video
+        self.fname = fname
+        self.order = order
+        self.paf = None
+
+    def priority(self):
+        """the priority of the download in the scheduler's order"""
+        phar = self.phar
+        if phar.content_store is not None and phar.content_store.find(self.video.videoid) is not None:
+            # linking a stored video takes no bandwidth
+            return float('-inf')
+        if self.order == 'position':
+            position = phar.position(self.video.videoid)
+            return float('inf') if position is None else position
+        if self.order in ('smallest', 'newest'):
+            try:
+                self.paf = phar.load_paf(self.video.videoid)
+            except (OSError, ValueError):
+                # the error is reported by the download
+                return None
+            if self.order == 'smallest':
+                size = _stream_size(phar.choose_stream(self.paf))
+                return float('inf') if size is None else size
+            return -_published_timestamp(self.paf)
+        return None
+
+    def __call__(self):
+        return self.phar.download_video(self.video, self.fname, self.paf)
+
+
+def _stream_size(stream) -> Optional[int]:
+    try:
+        return stream.get_filesize()
+    except (OSError, AttributeError):
+        return None
+
+
+def _stream_bitrate(stream, paf) -> Optional[float]:
+    """the bitrate of a stream in bits per second, estimated from its size if it is not known"""
+    ret = getattr(stream, 'rawbitrate', None)
+    if ret:
+        return ret
+    size = _stream_size(stream)
+    length = getattr(paf, 'length', None)
+    if size is None or not length:
+        return None
+    return size * 8 / length
+
+
+def _published_timestamp(paf) -> float:
+    try:
+        return datetime.strptime(paf.published, '%Y-%m-%d %H:%M:%S').timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+# the policies for choosing the destination of a new file, see Phar.choose_destination
+PLACEMENTS = ('most_free', 'first_fit')
+
+
+def _identity(x):
+    return x
+
+
+def _with_extension(filename: str, extension: str) -> str:
+    """replace the extension of a file name, like the '*' of a suggested name, or add it if there is none"""
+    ext_index = filename.rfind('.')
+    # the extensions of streams are up to four characters long, like webm
+    if ext_index >= 0 and (len(filename) - ext_index) <= 5:
+        return filename[:ext_index+1] + extension
+    return filename + '.' + extension
+
+
+def _resolve_entry(paf):
+    """make sure a lazily-loaded playlist entry has fetched the metadata pharaoh uses"""
+    _ = paf.videoid, paf.title
+    return paf
+
+
 class Phar:
     """A pharaoh project"""
 
@@ -90,49 +215,349 @@ class Phar:
 
     def __init__(self):
         self.source_playlist_id = None
-        self.destination_root: Path = None
-        self.rules: List[Tuple[Trigger, Behaviour]] = None
+        self.destination_roots: List[Path] = []
+        self._rules: RuleList = None
         self.id_fname_assoc: MutableMapping[str, str] = None  # file names only
+        self.destination_index: DestinationSet = None
+        self.partial_downloads: MutableMapping[str, PartialDownload] = {}  # keyed by video id
+        # the playlist as of the last sync, so the next sync only needs to check what changed
+        self.sync_snapshot: SyncSnapshot = None
+
+        self._init_runtime()
+
+    def _init_runtime(self):
+        """initialize the members that are not stored in the project file_name"""
+        # the remote data is only fetched once it is first accessed, see the videos property
+        self._videos: List[Video] = None
+        # lookups into the fetched videos, kept in sync by _associate
+        self._videos_by_id: Dict[str, Video] = None
+        self._videos_by_fname: Dict[str, Video] = None
+        self._positions: Dict[str, int] = None  # built on first use, see position
+        # the backend that the playlist and the videos are fetched from
+        self.source: Source = PafySource()
+        # the maximum number of playlist entries to resolve at the same time
+        self.fetch_workers = 8
+        # if set, playlist entries are resolved in this executor instead of a new one, and fetch_workers is ignored
+        self.fetch_executor: Executor = None
+        # if set, only entries that are new or stale in the cache have their metadata fetched
+        self.metadata_cache: MetadataCache = None
+        # if set, accepted downloads are performed in the background by the scheduler
+        self.download_scheduler: DownloadScheduler = None
+        # if set, the best stream of a video that is smaller than the size (in bytes) or the bitrate (in bits per
+        #  second) is downloaded, see choose_stream
+        self.max_download_size: Optional[int] = None
+        self.max_bitrate: Optional[float] = None
+        # if set, videos that were already downloaded by any project are linked from the store instead of downloaded
+        self.content_store: ContentStore = None
+        # how new files are spread between the destinations, one of PLACEMENTS, see choose_destination
+        self.placement = 'most_free'
+        # the free space (in bytes) to leave in every destination
+        self.min_free_space = 1 << 30
+        # the sizes of the downloads in progress, by destination, that are not yet taken from its free space
+        self._reserved: Dict[Path, int] = {}
+        # guards mutations that can be made by background downloads
+        self._lock = RLock()
+        # the videos whose suggestions were made by the last call to suggest_edits
+        self._sync_candidates: List[Video] = None
+        # the ids of the videos whose downloads are scheduled, so they are not suggested again until they finish
+        self._downloading: Set[str] = set()
+        # the file the project was loaded from, and the journal its mutations are recorded to, see load
+        self.path: Path = None
+        self.journal: Journal = None
+        # the number of journal records after which the journal is compacted into the project's file on close
+        self.compact_threshold = 1000
+        # receives the counters and timings of the project's work, records nothing by default
+        self.profiler: Profiler = null_profiler
+        # if set, accepted suggestions are recorded in the plan instead of performed, and so are new rules
+        self.plan: Plan = None
+
+    @property
+    def rules(self) -> List[Tuple[Trigger, Behaviour]]:
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules: List[Tuple[Trigger, Behaviour]]):
+        # the rules are stored in a list that keeps their compiled form up to date
+        self._rules = None if rules is None else RuleList(rules)
 
-        self.pafy_list: pafy.playlist = None
-        self.videos: List[Video] = None
+    @property
+    def destination_root(self) -> Optional[Path]:
+        """the first destination of the project"""
+        return self.destination_roots[0] if self.destination_roots else None
+
+    @destination_root.setter
+    def destination_root(self, root: Optional[Path]):
+        self.destination_roots = [] if root is None else [Path(root)]
+
+    @property
+    def fetched(self) -> bool:
+        """whether the playlist's data was already fetched"""
+        return self._videos is not None
+
+    @property
+    def videos(self) -> List[Video]:
+        if self._videos is None:
+            self._fetch()
+        return self._videos
 
     def get_video(self, id_: str = object(), file: str = object()):
-        for v in self.videos:
-            if isinstance(v.paf, str):
-                vid = v.paf
-            else:
-                vid = v.paf.videoid
-            if (vid == id_) \
-                    or (v.file_name == file):
-                return v
-        return None
+        if self._videos is None:
+            self._fetch()
+        ret = self._videos_by_id.get(id_)
+        if ret is None:
+            ret = self._videos_by_fname.get(file)
+        return ret
+
+    def position(self, videoid: str) -> Optional[int]:
+        """the position of a video in the playlist, or None if it is not in the playlist"""
+        videos = self.videos
+        with self._lock:
+            if self._positions is None:
+                self._positions = {}
+                for i, v in enumerate(videos):
+                    if v.exists_in_source:
+                        self._positions.setdefault(v.videoid, i)
+            return self._positions.get(videoid)
+
+    def _add_video(self, video: Video):
+        self._videos.append(video)
+        self._videos_by_id.setdefault(video.videoid, video)
+        if video.file_name is not None:
+            self._videos_by_fname.setdefault(video.file_name, video)
+
+    def _associate(self, video: Video, file_name: str):
+        """set the file name of a video, and store it in the project"""
+        with self._lock:
+            if video.file_name is not None and self._videos_by_fname.get(video.file_name) is video:
+                del self._videos_by_fname[video.file_name]
+            video.file_name = file_name
+            self._videos_by_fname.setdefault(file_name, video)
+            self._set_assoc(video.videoid, file_name)
+
+    def _record(self, *record):
+        if self.journal is not None:
+            self.journal.append(*record)
+
+    def _set_assoc(self, id_: str, file_name: str):
+        with self._lock:
+            self.id_fname_assoc[id_] = file_name
+            self._record('assoc', id_, file_name)
+
+    def add_rule(self, trigger: Trigger, behaviour: Behaviour):
+        """append a rule to the project"""
+        record = rule_record(trigger, behaviour)
+        with self._lock:
+            self.rules.append((trigger, behaviour))
+            self._record('rule', *record)
+            if self.plan is not None:
+                self.plan.add_rule(record)
+
+    def clear_rules(self):
+        with self._lock:
+            self.rules.clear()
+            self._record('clear_rules')
+
+    def set_source(self, playlist_id: str):
+        with self._lock:
+            self.source_playlist_id = playlist_id
+            # the fetched data belongs to the previous playlist
+            self._videos = self._videos_by_id = self._videos_by_fname = self._positions = None
+            self.sync_snapshot = None
+            self._record('source', playlist_id)
+
+    def set_destination_root(self, root: Path):
+        self.set_destination_roots([root])
+
+    def set_destination_roots(self, roots: Iterable[Path]):
+        with self._lock:
+            self.destination_roots = [Path(root) for root in roots]
+            self._record('destinations', [str(root) for root in self.destination_roots])
+
+    def add_destination_roots(self, roots: Iterable[Path]):
+        """add destinations after the existing ones, destinations that are already in the project are ignored"""
+        with self._lock:
+            new = [Path(root) for root in roots]
+            self.set_destination_roots(self.destination_roots + [r for r in new if r not in self.destination_roots])
+
+    def _set_partial(self, id_: str, partial: PartialDownload):
+        with self._lock:
+            self.partial_downloads[id_] = partial
+            self._record('partial', id_, partial.file_name, partial.itag)
+
+    def _pop_partial(self, id_: str):
+        with self._lock:
+            del self.partial_downloads[id_]
+            self._record('partial_done', id_)
+
+    def _set_snapshot(self, snapshot: SyncSnapshot):
+        with self._lock:
+            self.sync_snapshot = snapshot
+            self._record('snapshot', snapshot.ids, snapshot.pending)
+
+    def _replay(self, record):
+        """apply a journal record, without recording it again"""
+        op, *args = record
+        if op == 'assoc':
+            id_, file_name = args
+            self.id_fname_assoc[id_] = file_name
+        elif op == 'rule':
+            self.rules.append(rule_from_record(*args))
+        elif op == 'clear_rules':
+            self.rules.clear()
+        elif op == 'source':
+            self.source_playlist_id, = args
+            self.sync_snapshot = None
+        elif op == 'snapshot':
+            ids, pending = args
+            self.sync_snapshot = SyncSnapshot.of(ids, pending)
+        elif op == 'destination':
+            self.destination_root = Path(*args)
+        elif op == 'destinations':
+            roots, = args
+            self.destination_roots = [Path(root) for root in roots]
+        elif op == 'partial':
+            id_, file_name, itag = args
+            self.partial_downloads[id_] = PartialDownload(file_name, itag)
+        elif op == 'partial_done':
+            self.partial_downloads.pop(*args, None)
+        else:
+            raise self.ProtocolException(f'unknown journal record {op!r}')
 
     def __getstate__(self):
         return (
-            1,
+            5,
             self.source_playlist_id,
-            self.destination_root,
-            self.rules,
-            self.id_fname_assoc
+            self.destination_roots,
+            list(self.rules),
+            self.id_fname_assoc,
+            self.destination_index,
+            self.partial_downloads,
+            self.sync_snapshot
         )
 
     def __setstate__(self, state):
+        self._init_runtime()
         num = state[0]
         if num == 1:
             _, self.source_playlist_id, self.destination_root, self.rules, self.id_fname_assoc = state
-            self._fetch()
+            self.destination_index = None
+            self.partial_downloads = {}
+            self.sync_snapshot = None
+        elif num == 2:
+            _, self.source_playlist_id, self.destination_root, self.rules, self.id_fname_assoc, \
+                self.destination_index = state
+            self.partial_downloads = {}
+            self.sync_snapshot = None
+        elif num == 3:
+            _, self.source_playlist_id, self.destination_root, self.rules, self.id_fname_assoc, \
+                self.destination_index, self.partial_downloads = state
+            self.sync_snapshot = None
+        elif num == 4:
+            _, self.source_playlist_id, self.destination_root, self.rules, self.id_fname_assoc, \
+                self.destination_index, self.partial_downloads, self.sync_snapshot = state
+        elif num == 5:
+            _, self.source_playlist_id, self.destination_roots, self.rules, self.id_fname_assoc, \
+                self.destination_index, self.partial_downloads, self.sync_snapshot = state
         else:
             raise self.ProtocolException
+        if isinstance(self.destination_index, DestinationIndex):
+            # before version 5, projects had a single destination
+            self.destination_index = DestinationSet([self.destination_index])
 
-    def write(self, buffer=...):
+    def write(self, buffer=..., protocol=2):
         """write the project to a file_name"""
         if buffer is ...:
             buffer = BytesIO()
-            self.write(buffer)
+            self.write(buffer, protocol)
             return buffer.getvalue()
 
-        pickle.dump(self, buffer)
+        if protocol == 1:
+            pickle.dump(self, buffer)
+        elif protocol == 2:
+            buffer.write(binformat.dump(self))
+        else:
+            raise ValueError(f'cannot write protocol {protocol}')
+
+    # the first bytes of every protocol's files
+    _protocol_magics = (
+        (b'phr0', 0),
+        (b'\x80', 1),  # the pickle PROTO opcode
+        (binformat.MAGIC, 2),
+    )
+
+    @classmethod
+    def detect_protocol(cls, buffer) -> int:
+        """detect the protocol of a project from its first bytes, and reset the reader"""
+        head = buffer.read(len(binformat.MAGIC))
+        buffer.seek(0)
+        if isinstance(head, str):
+            head = head.encode('utf-8')
+        for magic, protocol in cls._protocol_magics:
+            if head.startswith(magic):
+                return protocol
+        raise cls.ProtocolException('no valid protocol found')
+
+    @classmethod
+    def load(cls, path, journal=True) -> 'Phar':
+        """
+        read the project from a file_name, along with the mutations recorded in its journal
+        :param path: the path of the project's file
+        :param journal: whether to record future mutations of the project in the journal
+        """
+        path = Path(path)
+        with open(path, 'rb') as r:
+            data = r.read()
+        ret = cls.read(data)
+        ret.path = path
+        base_digest = digest(data)
+        journal_path = Journal.path_for(path)
+        if journal:
+            ret.journal = Journal(journal_path, base_digest)
+            records = ret.journal.records
+            ret.journal.records = None
+        else:
+            records = Journal.read_records(journal_path, base_digest)
+        for record in records:
+            ret._replay(record)
+        return ret
+
+    def save(self, path=None):
+        """write the entire project to its file, and empty the journal"""
+        if path is not None:
+            self.path = Path(path)
+        with self._lock:
+            data = self.write()
+            temp_path = self.path.with_name(self.path.name + '.temp')
+            with open(temp_path, 'wb') as w:
+                w.write(data)
+                w.flush()
+                os.fsync(w.fileno())
+            os.replace(temp_path, self.path)
+            if self.journal is not None:
+                self.journal.reset(digest(data))
+            if self.destination_index is not None:
+                self.destination_index.mark_stored()
+
+    def checkpoint(self):
+        """compact the journal into the project's file, if it grew large"""
+        if self.journal is not None and self.journal.count >= self.compact_threshold:
+            self.save()
+
+    def close(self):
+        """
+        finish working with a project that was loaded from a file.
+        If mutations are not recorded in a journal, the project is saved, otherwise, the journal is compacted into the
+         project's file once it grows large, or once the destination index changed, since it is not journaled.
+        """
+        if self.journal is None:
+            self.save()
+            return
+        if self.destination_index is not None and self.destination_index.modified:
+            self.save()
+        else:
+            self.checkpoint()
+        self.journal.close()
+        self.journal = None
 
     @classmethod
     def read(cls, buffer, protocol=...) -> 'Phar':
@@ -143,21 +568,14 @@ class Phar:
             buffer = BytesIO(buffer)
 
         if protocol is ...:
-            for prot in count():
-                try:
-                    read = getattr(cls, '_read_' + str(prot))
-                    return read(buffer)
-                except cls.ProtocolException:
-                    buffer.seek(0)  # reset the reader before trying another one
-                    continue
-                except AttributeError:
-                    raise cls.ProtocolException('no valid protocol found')
-        else:
-            read = getattr(cls, '_read_' + str(protocol))
-            return read(buffer)
+            protocol = cls.detect_protocol(buffer)
+        read = getattr(cls, '_read_' + str(protocol))
+        return read(buffer)
 
     @classmethod
     def _read_0(cls, buffer: TextIO):
+        if not isinstance(buffer, TextIOBase):
+            buffer = TextIOWrapper(buffer, encoding='utf-8')
         header = buffer.readline(10)
         if header.rstrip() != 'phr0':
             raise cls.ProtocolException
@@ -180,12 +598,10 @@ class Phar:
         for file_name in inner['whitelist']:
             ret.rules.append((FilenameTrigger(file_name), Behaviour.white))
 
-        if len(inner['destinations']) > 1:
-            warnings.warn('multiple destinations are not supported, using first one')
-        ret.destination_root = Path(inner['destinations'][0])
+        ret.destination_roots = [Path(d) for d in inner['destinations']]
 
         ret.id_fname_assoc = {}
-        ret._fetch()
+        ret.destination_index = None
         return ret
 
     @classmethod
@@ -195,39 +611,192 @@ class Phar:
         except pickle.UnpicklingError as e:
             raise cls.ProtocolException from e
 
+    @classmethod
+    def _read_2(cls, buffer: BinaryIO):
+        ret = cls()
+        try:
+            binformat.load(buffer.read(), ret)
+        except binformat.FormatError as e:
+            raise cls.ProtocolException from e
+        return ret
+
+    def _resolve_all(self, entries):
+        # entries may resolve their metadata lazily, resolve them concurrently (map preserves the playlist's order)
+        if self.fetch_executor is not None:
+            return list(self.fetch_executor.map(_resolve_entry, entries))
+        with ThreadPoolExecutor(self.fetch_workers, thread_name_prefix='pharaoh-fetch') as pool:
+            return list(pool.map(_resolve_entry, entries))
+
+    def _fetch_entries(self):
+        """get the resolved entries of the playlist, using the metadata cache if there is one"""
+        source = self.source
+        cache = self.metadata_cache
+        profiler = self.profiler
+        if cache is None:
+            with profiler.timer('fetch.playlist'):
+                listing = source.list_playlist(self.source_playlist_id)
+            if source.flat:
+                return list(listing)
+            with profiler.timer('fetch.resolve'):
+                entries = self._resolve_all(listing)
+            profiler.count('fetch.resolved', len(entries))
+            return entries
+
+        try:
+            with profiler.timer('fetch.playlist'):
+                # only the ids of the entries are read here, unless the source is flat
+                listing = list(source.list_playlist(self.source_playlist_id))
+        except OSError:
+            ids = cache.get_playlist(self.source_playlist_id, allow_stale=True)
+            if ids is None:
+                raise
+            warnings.warn('could not fetch the playlist, using the cached playlist instead')
+            profiler.count('fetch.offline')
+            entries = [CachedEntry(id_, cache.get_title(id_, allow_stale=True) or id_, partial(source.load_video, id_))
+                       for id_ in ids]
+            return entries
+
+        if source.flat:
+            # the listing already holds the titles, they are only cached for when the source is unreachable
+            entries = resolved = listing
+        else:
+            entries = []
+            stale = []
+            for entry in listing:
+                title = cache.get_title(entry.videoid)
+                if title is None:
+                    stale.append(entry)
+                    entries.append(entry)
+                else:
+                    entries.append(CachedEntry(entry.videoid, title, partial(_identity, entry)))
+            with profiler.timer('fetch.resolve'):
+                resolved = self._resolve_all(stale)
+            profiler.count('fetch.resolved', len(resolved))
+            profiler.count('fetch.cache_hits', len(entries) - len(stale))
+        with profiler.timer('fetch.cache'):
+            for paf in resolved:
+                cache.set_title(paf.videoid, paf.title)
+            cache.set_playlist(self.source_playlist_id, [e.videoid for e in entries])
+            cache.save()
+        return entries
+
     def _fetch(self):
         """load data from the environment. loads a home directory and the playlist's info"""
-        self.pafy_list = pafy.get_playlist2(self.source_playlist_id)
-        self.videos = []
+        with self.profiler.timer('fetch'):
+            entries = self._fetch_entries()
+            # background downloads can associate videos while they are rebuilt
+            with self._lock, self.profiler.timer('fetch.build'):
+                self._build_videos(entries)
+        self.profiler.count('fetch.entries', len(entries))
+
+    def refetch(self):
+        """fetch the playlist again, for projects that stay loaded while the playlist changes"""
+        self._fetch()
+
+    def _build_videos(self, entries):
+        # only the data of the entries that pharaoh uses is kept, the entries themselves can be discarded
+        self._positions = None
+        self._videos = []
+        self._videos_by_id = {}
+        self._videos_by_fname = {}
         assoc = dict(self.id_fname_assoc)
-        for paf in self.pafy_list:
+        for paf in entries:
             rel_path = assoc.pop(paf.videoid, None)
-            video = Video(paf, rel_path)
-            self.videos.append(video)
+            self._add_video(Video.from_entry(paf, rel_path))
         for id_, rel_path in assoc.items():
-            v = self.get_video(id_=id_)
+            v = self._videos_by_id.get(id_)
             if v:
                 assert v.file_name is None
                 v.file_name = rel_path
+                self._videos_by_fname.setdefault(rel_path, v)
             else:
-                video = Video(id_, rel_path)
-                self.videos.append(video)
+                self._add_video(Video(id_, file_name=rel_path))
+
+    def scan_destination(self) -> DestinationSet:
+        """
+        refresh the indexes of the destination directories, only listing directories that changed since last scan,
+         see DestinationSet.refresh
+        """
+        if self.destination_index is None or self.destination_index.roots != self.destination_roots:
+            self.destination_index = DestinationSet.of(self.destination_roots, self.destination_index)
+        with self.profiler.timer('scan'):
+            listed = self.destination_index.refresh()
+        self.profiler.count('scan.listed_dirs', listed)
+        if self.destination_index.moved:
+            self._follow_moves(self.destination_index.moved)
+        return self.destination_index
+
+    def _follow_moves(self, moved: Dict[str, str]):
+        """associate the videos whose files were renamed with their new names"""
+        with self._lock:
+            renamed = [(id_, moved[name]) for id_, name in self.id_fname_assoc.items() if name in moved]
+            for id_, name in renamed:
+                video = self._videos_by_id.get(id_) if self._videos is not None else None
+                if video is not None:
+                    self._associate(video, name)
+                else:
+                    self._set_assoc(id_, name)
+        self.profiler.count('scan.renamed', len(renamed))
 
     def get_behaviour(self, video: Video)->Behaviour:
-        for trigger, behaviour in self.rules:
-            if trigger(video):
-                return behaviour
-        return Behaviour()
+        """get the behaviour of the first rule that is triggered by the video"""
+        compiled = self.rules.compiled()
+        profiler = self.profiler
+        if not profiler.enabled:
+            return compiled(video)
+        start = time.perf_counter()
+        index = compiled.find(video)
+        profiler.add_time('rules.evaluate', time.perf_counter() - start)
+        if index is None:
+            profiler.count('rules.misses')
+            return Behaviour()
+        profiler.tally('rules.hits', f'#{index} {compiled.triggers[index]!r}')
+        return compiled.behaviours[index]
+
+    def _changed_videos(self) -> List[Video]:
+        """get the videos that might have changed since the last sync"""
+        ids = tuple(v.videoid for v in self.videos if v.exists_in_source)
+        changed = self.sync_snapshot.changed_ids(ids)
+        changed.update(self.partial_downloads)
+        ret = []
+        for id_ in changed:
+            v = self._videos_by_id.get(id_)
+            if v is not None:
+                ret.append(v)
+        # keep the playlist's order
+        order = {id_: i for i, id_ in enumerate(ids)} if ret else {}
+        ret.sort(key=lambda v: order.get(v.videoid, -1))
+        return ret
 
-    def suggest_edits(self) \
+    def suggest_edits(self, full=False) \
             -> Iterable[Union[ChangeSuggestion, str]]:
-        """yields messages and edits suggested"""
+        """
+        yields messages and edits suggested
+        :param full: whether to check every video, rather than only the videos that changed since the last sync
+        """
+        if full or self.sync_snapshot is None:
+            candidates = self.videos
+        else:
+            candidates = self._changed_videos()
+        self._sync_candidates = candidates
+        profiler = self.profiler
+        profiler.count('sync.candidates', len(candidates))
+        if not candidates:
+            return
+        index = self.scan_destination()
+        # the matching is timed separately from the rest of the generator, which includes the time of the consumer
+        timed = profiler.enabled
         # make all remove suggestions
-        for v in self.videos:
+        for v in candidates:
             if v.exists_in_source:
                 # video still exists in playlist
                 continue
-            match = next(self.destination_root.rglob('**/'+v.file_name), None)
+            if timed:
+                start = time.perf_counter()
+                match = index.find(v.file_name)
+                profiler.add_time('sync.match', time.perf_counter() - start)
+            else:
+                match = index.find(v.file_name)
             if not match:
                 continue
             b = self.get_behaviour(v)
@@ -235,37 +804,250 @@ class Phar:
             yield from (s.suggest(b.remove))
 
         # make all download suggestions
-        for v in self.videos:
-            if not v.exists_in_source:
-                continue
-            dest_fname = v.file_name or (v.suggest_fname()+'.*')
-            match = next(self.destination_root.rglob('**/' + dest_fname), None)
+        in_source = [(v, v.file_name) for v in candidates if v.exists_in_source]
+        # the videos that have no file yet are matched by their titles, all at once
+        with profiler.timer('sync.match_titles'):
+            stems = safe_filenames([v.title for v, file_name in in_source if not file_name])
+            title_matches = iter(zip(stems, index.find_stem_names(stems)))
+        with self._lock:
+            downloading = set(self._downloading)
+        for v, file_name in in_source:
+            if not file_name:
+                stem, match = next(title_matches)
+                dest_fname = stem + '.*'
+            elif timed:
+                start = time.perf_counter()
+                dest_fname = file_name
+                match = index.find(dest_fname)
+                profiler.add_time('sync.match', time.perf_counter() - start)
+            else:
+                dest_fname = file_name
+                match = index.find(dest_fname)
             if match:
-                if v.file_name is None:
-                    v.file_name = match.name
-                    self.id_fname_assoc.setdefault(v.paf.videoid, match.name)
+                if not file_name and v.file_name is None:
+                    # the file was found by the video's title
+                    self._associate(v, match)
+                continue
+            if v.videoid in downloading:
                 continue
             b = self.get_behaviour(v)
             s = AddSuggestion(v, dest_fname, self)
             yield from (s.suggest(b.add))
 
+    def mark_synced(self):
+        """
+        store a snapshot of the playlist after all the suggestions of suggest_edits were handled, so the next sync
+         only checks the videos that changed
+        """
+        pending = [
+            v.videoid for v in (self._sync_candidates or ())
+            # a video that was neither downloaded nor blacklisted must be suggested again
+            if v.exists_in_source and v.file_name is None and self.get_behaviour(v).add is not False
+        ]
+        self._set_snapshot(SyncSnapshot.of((v.videoid for v in self.videos if v.exists_in_source), pending))
+        self._sync_candidates = None
+
+    def load_paf(self, videoid: str):
+        """get the full pafy object of a video, from the project's source"""
+        return self.source.load_video(videoid)
+
+    def _download_finished(self, videoid: str):
+        # called from the scheduler's threads
+        with self._lock:
+            self._downloading.discard(videoid)
+
+    def download_video(self, video: Video, filename: str, paf=None) -> bool:
+        """
+        load the full data of a video, and download it, unless it is already in the content store
+        :param paf: the full pafy object of the video, if it was already loaded
+        """
+        if self.content_store is not None and self._link_stored(video.videoid, filename):
+            return True
+        if paf is None:
+            try:
+                paf = self.load_paf(video.videoid)
+            except (OSError, ValueError) as e:
+                print(f'error loading {normalize_RTL(video.title or video.videoid)}: {e!r}')
+                self.profiler.count('download.failed')
+                return False
+        return self.download_callback(paf, filename)
+
+    def choose_stream(self, paf):
+        """
+        get the stream of a video to download: the best stream, unless it is larger than the size or bitrate budgets,
+         in which case the largest stream within the budgets, or the smallest stream if none is within the budgets
+        """
+        best = paf.getbest()
+        if self.max_download_size is None and self.max_bitrate is None:
+            return best
+
+        def fits(stream):
+            if self.max_download_size is not None:
+                size = _stream_size(stream)
+                if size is None or size > self.max_download_size:
+                    return False
+            if self.max_bitrate is not None:
+                bitrate = _stream_bitrate(stream, paf)
+                if bitrate is None or bitrate > self.max_bitrate:
+                    return False
+            return True
+
+        if fits(best):
+            return best
+        self.profiler.count('download.fallback')
+        streams = [s for s in paf.streams if s is not best]
+        fitting = [s for s in streams if fits(s)]
+        if fitting:
+            return max(fitting, key=lambda s: _stream_size(s) or 0)
+        sized = [s for s in [best, *streams] if _stream_size(s) is not None]
+        if not sized:
+            return best
+        return min(sized, key=_stream_size)
+
     def download_callback(self, paf, filename):
-        """download a video"""
+        """download a video, resuming a previous partial download of it if there is one"""
+        with self.profiler.timer('download'):
+            ret = self._download(paf, filename)
+        self.profiler.count('download.succeeded' if ret else 'download.failed')
+        return ret
+
+    def _download(self, paf, filename):
+        root = size = None
         try:
-            stream = paf.getbest()
-            ext_index = filename.rfind('.')
-            if ext_index >= 0 and (len(filename) - ext_index) < 4:
-                filename = filename[:ext_index+1] + stream.extension
-            else:
-                filename += '.' + stream.extension
-            fpath = self.destination_root / filename
-            stream.download(filepath=fpath)
-            self.id_fname_assoc[paf.videoid] = filename
+            with self._lock:
+                partial = self.partial_downloads.get(paf.videoid)
+            stream = None
+            if partial is not None:
+                stream = next((s for s in paf.streams if getattr(s, 'itag', None) == partial.itag), None)
+                partial_root = self._partial_root(partial.file_name)
+                if stream is None:
+                    # the stream we were downloading is no longer available, start over
+                    if partial_root is not None:
+                        with suppress(FileNotFoundError):
+                            os.remove(partial_path(partial_root / partial.file_name))
+                else:
+                    filename = partial.file_name
+                    root = partial_root
+                    self.profiler.count('download.resumed')
+            if stream is None:
+                stream = self.choose_stream(paf)
+                filename = _with_extension(filename, stream.extension)
+            if root is None:
+                size = _stream_size(stream)
+                root = self._place(size)
+            fpath = root / filename
+            self._set_partial(paf.videoid, PartialDownload(filename, getattr(stream, 'itag', None)))
+            url = stream.url
+            throttle = self.download_scheduler.throttle if self.download_scheduler is not None else None
+            with self.profiler.timer('download.transfer'):
+                transferred = fetch_resumable(url, fpath, throttle=throttle)
+            self.profiler.count('download.bytes', transferred)
+            with self._lock:
+                self._pop_partial(paf.videoid)
+            if self.content_store is not None:
+                try:
+                    self.content_store.put(paf.videoid, fpath)
+                except OSError as e:
+                    print(f'error storing {filename}: {e!r}')
+            self._add_file(paf.videoid, fpath)
             return True
         except OSError as e:
             print(f'error downloading {filename}: {e!r}')
             return False
+        finally:
+            if root is not None and size is not None:
+                self._unreserve(root, size)
+
+    def _partial_root(self, file_name: str) -> Optional[Path]:
+        """the destination that has the partial file of a download, if any"""
+        for root in self.destination_roots:
+            if partial_path(root / file_name).exists():
+                return root
+        return None
+
+    def choose_destination(self, size: Optional[int] = None) -> Path:
+        """
+        get the destination to place a new file in, according to the placement policy:
+         most_free: the destination with the most free space
+         first_fit: the first destination with room for the file, so the destinations are filled one after the other
+        Destinations are considered to have room for a file if they have min_free_space left after it, and the
+         downloads in progress are taken out of their free space.
+        If no destination has room for the file, the destination with the most free space is chosen.
+        :param size: the size of the file in bytes, if it is known
+        """
+        roots = self.destination_roots
+        if not roots:
+            raise ValueError('the project has no destination')
+        if len(roots) == 1:
+            return roots[0]
+        if self.placement not in PLACEMENTS:
+            raise ValueError(f'placement must be one of {", ".join(PLACEMENTS)}')
+        best = None
+        best_free = None
+        for root in roots:
+            try:
+                free = shutil.disk_usage(root).free
+            except OSError:
+                continue
+            free -= self._reserved.get(root, 0)
+            if self.placement == 'first_fit' and free - (size or 0) >= self.min_free_space:
+                return root
+            if best_free is None or free > best_free:
+                best, best_free = root, free
+        if best is None:
+            # no destination is available, writing to the first will report the error
+            return roots[0]
+        return best
+
+    def _place(self, size: Optional[int]) -> Path:
+        """choose the destination of a new file, and reserve its size there until _unreserve is called"""
+        with self._lock:
+            ret = self.choose_destination(size)
+            if size is not None:
+                self._reserved[ret] = self._reserved.get(ret, 0) + size
+        self.profiler.tally('download.destinations', str(ret))
+        return ret
+
+    def _unreserve(self, root: Path, size: int):
+        with self._lock:
+            remaining = self._reserved.pop(root) - size
+            if remaining:
+                self._reserved[root] = remaining
+
+    def _link_stored(self, videoid: str, filename: str) -> bool:
+        """create the file of a video from the content store, return whether it was in the store"""
+        stored = self.content_store.find(videoid)
+        if stored is None:
+            return False
+        filename = _with_extension(filename, stored.suffix[1:])
+        try:
+            path = self.choose_destination(stored.stat().st_size) / filename
+            self.content_store.materialize(stored, path)
+        except OSError as e:
+            print(f'error linking {filename} from the store, downloading it instead: {e!r}')
+            return False
+        self.profiler.count('download.reused')
+        self._add_file(videoid, path)
+        return True
+
+    def _add_file(self, videoid: str, path: Path):
+        """record a new file of a video in a destination"""
+        with self._lock:
+            if self.destination_index is not None:
+                self.destination_index.add(path)
+            video = self._videos_by_id.get(videoid) if self._videos is not None else None
+            if video is not None:
+                self._associate(video, path.name)
+            else:
+                self._set_assoc(videoid, path.name)
 
     def remove_callback(self, file):
-        """delete a video"""
-        os.remove(self.destination_root / file)
+        """
+        delete a video
+        :param file: the path of the video's file, as found in the destination index
+        """
+        path = Path(file)
+        os.remove(path)
+        with self._lock:
+            if self.destination_index is not None:
+                self.destination_index.discard(path)
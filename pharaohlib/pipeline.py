@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Callable, Optional, TYPE_CHECKING
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Event
+
+if TYPE_CHECKING:
+    from pharaohlib.phar import Phar, ChangeSuggestion
+
+
+@dataclass
+class SyncReport:
+    """the outcome of a sync"""
+    accepted: int = 0
+    rejected: int = 0
+    messages: int = 0
+
+
+async def sync_pipeline(phar: Phar, decide: Callable[[ChangeSuggestion], bool],
+                        on_message: Callable[[str], None] = print, *,
+                        full: bool = False, action_workers: Optional[int] = None, queue_size: int = 64) -> SyncReport:
+    """
+    sync a project, with discovery, decisions and actions all running at the same time.
+    Suggestions are discovered in the background while earlier ones are decided, and accepted suggestions are
+    performed in the background while later ones are decided.
+    :param phar: the project to sync
+    :param decide: called for every suggestion that has no automatic response, returns whether to accept it.
+     calls to decide are never concurrent, and are performed outside the event loop, so decide can block.
+    :param on_message: called with every message from the sync
+    :param full: whether to check every video, rather than only the videos that changed since the last sync
+    :param action_workers: the number of accepted suggestions that can be performed at the same time, defaults to
+     the workers of the project's download scheduler, or to performing them one at a time if it has none
+    :param queue_size: the number of discovered suggestions that can wait for a decision
+    :return: a report of the sync
+    """
+    # asyncio is only imported by the commands that sync
+    import asyncio
+
+    if action_workers is None:
+        scheduler = phar.download_scheduler
+        action_workers = scheduler.workers if scheduler is not None else 1
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(queue_size)
+    done = object()
+    stop = Event()
+    report = SyncReport()
+
+    def produce():
+        try:
+            for item in phar.suggest_edits(full):
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+                if stop.is_set():
+                    break
+        finally:
+            asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+    with ThreadPoolExecutor(1, thread_name_prefix='pharaoh-discover') as discover_pool, \
+            ThreadPoolExecutor(1, thread_name_prefix='pharaoh-decide') as decide_pool, \
+            ThreadPoolExecutor(action_workers, thread_name_prefix='pharaoh-action') as action_pool:
+        producer = loop.run_in_executor(discover_pool, produce)
+        actions = []
+        finished = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    finished = True
+                    break
+                if isinstance(item, str):
+                    on_message(item)
+                    report.messages += 1
+                    continue
+                with phar.profiler.timer('sync.decide'):
+                    accept = await loop.run_in_executor(decide_pool, decide, item)
+                if accept:
+                    actions.append(loop.run_in_executor(action_pool, item.accept))
+                    report.accepted += 1
+                else:
+                    item.reject()
+                    report.rejected += 1
+        finally:
+            if not finished:
+                # let the producer stop
+                stop.set()
+                while await queue.get() is not done:
+                    pass
+            # the pools can only shut down once their work is done, and the event loop must keep running until then
+            await asyncio.wait([producer, *actions])
+        producer.result()
+        for action in actions:
+            action.result()
+    phar.mark_synced()
+    return report
+
+
+def sync(phar: Phar, decide: Callable[[ChangeSuggestion], bool], on_message: Callable[[str], None] = print,
+         **kwargs) -> SyncReport:
+    """run sync_pipeline in a new event loop"""
+    import asyncio
+    return asyncio.run(sync_pipeline(phar, decide, on_message, **kwargs))
@@ -0,0 +1,199 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from concurrent.futures import Future
+import json
+import os
+import time
+import warnings
+from pathlib import Path
+from threading import Lock
+
+from pharaohlib._utility import normalize_RTL
+from pharaohlib.downloads import DownloadScheduler
+from pharaohlib.journal import digest
+from pharaohlib.phar import Phar, AddSuggestion
+from pharaohlib.rules import rule_from_record
+from pharaohlib.snapshot import SyncSnapshot
+from pharaohlib.video import Video
+
+
+class PlanError(Exception):
+    """the plan is invalid, or cannot be applied to the project"""
+    pass
+
+
+class PlannedDownload(NamedTuple):
+    videoid: str
+    title: str
+    file_name: str  # the name to download the video to, its extension is replaced by the stream's
+
+
+class Plan:
+    """
+    The decisions of a sync, that can be stored, reviewed, and applied later without fetching the playlist or scanning
+     the destinations again, see make_plan and apply_plan.
+    """
+    format_version = 1
+
+    def __init__(self, source_playlist_id: str, destination_roots: List[str], base_digest: Optional[str] = None,
+                 created: Optional[float] = None):
+        """
+        :param base_digest: the digest of the project the plan was made for, to warn if it changed since
+        """
+        self.source_playlist_id = source_playlist_id
+        self.destination_roots = destination_roots
+        self.base_digest = base_digest
+        self.created = created if created is not None else time.time()
+        self.downloads: List[PlannedDownload] = []
+        self.removals: List[str] = []  # the paths of the files to remove
+        self.rules: List[list] = []  # new rules, as rule records
+        # the file names that the sync found for videos, by their ids
+        self.associations: Dict[str, str] = {}
+        # the snapshot to store once the plan is applied
+        self.snapshot: Optional[SyncSnapshot] = None
+        # suggestions are accepted concurrently
+        self._lock = Lock()
+
+    def add_download(self, video: Video, file_name: str):
+        with self._lock:
+            self.downloads.append(PlannedDownload(video.videoid, video.title, file_name))
+
+    def add_removal(self, path: Path):
+        with self._lock:
+            self.removals.append(str(path))
+
+    def add_rule(self, record: list):
+        with self._lock:
+            self.rules.append(list(record))
+
+    def dump(self, path):
+        inner = {
+            'version': self.format_version,
+            'source': self.source_playlist_id,
+            'destinations': self.destination_roots,
+            'base': self.base_digest,
+            'created': self.created,
+            'downloads': [list(d) for d in self.downloads],
+            'removals': self.removals,
+            'rules': self.rules,
+            'associations': self.associations,
+            'snapshot': None if self.snapshot is None else [self.snapshot.ids, self.snapshot.pending],
+        }
+        with open(path, 'w', encoding='utf-8') as w:
+            json.dump(inner, w, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path) -> 'Plan':
+        try:
+            with open(path, encoding='utf-8') as r:
+                inner = json.load(r)
+        except ValueError as e:
+            raise PlanError(f'{path} is not a plan') from e
+        if not isinstance(inner, dict) or inner.get('version') != cls.format_version:
+            raise PlanError(f'{path} is not a plan of a supported version')
+        try:
+            ret = cls(inner['source'], inner['destinations'], inner['base'], inner['created'])
+            ret.downloads = [PlannedDownload(*d) for d in inner['downloads']]
+            ret.removals = list(inner['removals'])
+            ret.rules = [list(r) for r in inner['rules']]
+            ret.associations = dict(inner['associations'])
+            if inner['snapshot'] is not None:
+                ret.snapshot = SyncSnapshot.of(*inner['snapshot'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise PlanError(f'{path} is not a valid plan') from e
+        return ret
+
+    def __str__(self):
+        lines = [f'{len(self.downloads)} downloads, {len(self.removals)} removals, {len(self.rules)} new rules']
+        lines.extend(f'\tdownload {normalize_RTL(d.title)} as {normalize_RTL(d.file_name)}' for d in self.downloads)
+        lines.extend(f'\tremove {normalize_RTL(p)}' for p in self.removals)
+        return '\n'.join(lines)
+
+
+def make_plan(phar: Phar, sync: Callable[[], Any]) -> Plan:
+    """
+    record the decisions of a sync in a new plan, instead of performing them
+    :param phar: the project, it is modified by the sync, so it should be loaded without a journal, and not be saved
+    :param sync: syncs the project, like a partial of pipeline.sync
+    """
+    ret = Plan(phar.source_playlist_id, [str(root) for root in phar.destination_roots], digest(phar.write()))
+    assoc = dict(phar.id_fname_assoc)
+    phar.plan = ret
+    try:
+        sync()
+    finally:
+        phar.plan = None
+    ret.associations = {id_: name for id_, name in phar.id_fname_assoc.items() if assoc.get(id_) != name}
+    ret.snapshot = phar.sync_snapshot
+    return ret
+
+
+class PlanReport(NamedTuple):
+    removed: int
+    downloaded: int
+    failed: List[str]  # the actions that failed
+
+    def __str__(self):
+        ret = f'removed {self.removed} files, downloaded {self.downloaded} videos'
+        for action in self.failed:
+            ret += f'\n\tfailed: {action}'
+        return ret
+
+
+def _within(path: Path, root: Path) -> bool:
+    try:
+        Path(os.path.abspath(path)).relative_to(os.path.abspath(root))
+    except ValueError:
+        return False
+    return True
+
+
+def apply_plan(phar: Phar, plan: Plan, scheduler: Optional[DownloadScheduler] = None) -> PlanReport:
+    """
+    perform the decisions of a plan.
+    The removals are performed together, directory by directory, and then the downloads are all enqueued at once.
+    The project should be loaded without a journal, so it is written once, when it is closed.
+    :param scheduler: if set, the downloads are performed concurrently by the scheduler
+    """
+    if plan.source_playlist_id != phar.source_playlist_id:
+        raise PlanError('the plan was made for a different playlist')
+    if plan.base_digest is not None and plan.base_digest != digest(phar.write()):
+        warnings.warn('the project changed since the plan was made')
+    failed = []
+
+    for id_, file_name in plan.associations.items():
+        phar._set_assoc(id_, file_name)
+    for record in plan.rules:
+        phar.add_rule(*rule_from_record(*record))
+
+    removed = 0
+    roots = phar.destination_roots
+    for path in sorted(map(Path, plan.removals), key=lambda p: (str(p.parent), p.name)):
+        if not any(_within(path, root) for root in roots):
+            # plans can be edited, never remove a file that the project does not manage
+            failed.append(f'remove {path}: not in a destination of the project')
+            continue
+        try:
+            phar.remove_callback(path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            failed.append(f'remove {path}: {e!r}')
+            continue
+        removed += 1
+
+    results = [AddSuggestion(Video(d.videoid, d.title), d.file_name, phar).accept() for d in plan.downloads]
+    downloaded = set()
+    for d, result in zip(plan.downloads, results):
+        if isinstance(result, Future):
+            result = result.exception() is None and result.result()
+        if result:
+            downloaded.add(d.videoid)
+        else:
+            failed.append(f'download {normalize_RTL(d.title)}')
+
+    if plan.snapshot is not None:
+        # the videos that were not downloaded must be suggested again by the next sync
+        pending = [id_ for id_ in plan.snapshot.pending if id_ not in downloaded]
+        phar._set_snapshot(SyncSnapshot.of(plan.snapshot.ids, pending))
+    return PlanReport(removed, len(downloaded), failed)
@@ -1,46 +1,71 @@
 from __future__ import annotations
 
+from typing import Dict, List, Tuple, Optional, Iterable
+
 from abc import ABC, abstractmethod
 
 import re
 from pathlib import Path
+from threading import RLock
 
 from pharaohlib.video import Video
 from pharaohlib.frozen import Frozen
 
 
 class Trigger(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def __call__(self, video: Video) -> bool:
         return True
 
 
 class FilenameTrigger(Frozen, Trigger):
+    __slots__ = ('pattern', '_file_pattern')
+
     def __new__(cls, pattern):
         ret = super().__new__(cls, pattern)
-        ret.file_pattern = re.compile(pattern)
+        ret.pattern = pattern
+        ret._file_pattern = None
         return ret
 
+    @property
+    def file_pattern(self):
+        # compiled on first use, most patterns are never compiled since the rule engine looks up literal patterns
+        if self._file_pattern is None:
+            self._file_pattern = re.compile(self.pattern)
+        return self._file_pattern
+
     def __call__(self, video):
         return super().__call__(video) and video.file_name and self.file_pattern.fullmatch(video.file_name)
 
 
 class IdTrigger(Frozen, Trigger):
+    __slots__ = ('id',)
+
     def __new__(cls, id_: str):
         ret = super().__new__(cls, id_)
         ret.id = id_
         return ret
 
     def __call__(self, video):
-        return super().__call__(video)\
-               and (self.id == video.paf or self.id == video.paf.videoid)
+        return super().__call__(video) and self.id == video.videoid
 
 
 class Behaviour(Frozen):
+    __slots__ = ('add', 'remove')
+
+    # there are only a few distinct behaviours, every one of them is only created once and shared by all the rules
+    _interned: Dict[Tuple[type, Optional[bool], Optional[bool]], Behaviour] = {}
+
     def __new__(cls, *, add: bool = None, remove: bool = None):
-        self = super().__new__(cls, add=add, remove=remove)
-        self.add = add
-        self.remove = remove
+        key = (cls, add, remove)
+        self = cls._interned.get(key)
+        if self is None:
+            self = super().__new__(cls, add=add, remove=remove)
+            self.add = add
+            self.remove = remove
+            self = cls._interned.setdefault(key, self)
         return self
 
     black: Behaviour
@@ -49,3 +74,159 @@ class Behaviour(Frozen):
 
 Behaviour.black = Behaviour(add=False)
 Behaviour.white = Behaviour(remove=False)
+
+
+Rule = Tuple[Trigger, Behaviour]
+
+
+def rule_record(trigger: Trigger, behaviour: Behaviour) -> list:
+    """the json-serializable record a rule is stored as, in journals and plans"""
+    if type(trigger) is IdTrigger:
+        return ['id', trigger.id, behaviour.add, behaviour.remove]
+    if type(trigger) is FilenameTrigger:
+        return ['file', trigger.pattern, behaviour.add, behaviour.remove]
+    raise TypeError(f'cannot store trigger {trigger!r}')
+
+
+def rule_from_record(kind: str, arg: str, add: Optional[bool], remove: Optional[bool]) -> Rule:
+    trigger = IdTrigger(arg) if kind == 'id' else FilenameTrigger(arg)
+    return trigger, Behaviour(add=add, remove=remove)
+
+
+def _as_literal(pattern: str) -> Optional[str]:
+    """
+    if the pattern only matches a single string (like the patterns created by re.escape), return that string
+    """
+    candidate = re.sub(r'\\(.)', r'\1', pattern, flags=re.DOTALL)
+    if re.escape(candidate) == pattern:
+        return candidate
+    return None
+
+
+class CompiledRules:
+    """
+    A dispatch structure for a list of rules, that finds the first rule that is triggered by a video without
+    evaluating all the rules.
+    IdTriggers and literal FilenameTriggers are looked up in dicts, and all other FilenameTriggers are
+    combined into one regular expression.
+    """
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.triggers: List[Trigger] = []
+        self.behaviours: List[Behaviour] = []
+        self.ids: Dict[str, int] = {}  # the index of the first rule for every trigger
+        self.literals: Dict[str, int] = {}
+        self.regex_indices: Dict[str, int] = {}  # the index of the rule for every group in the combined pattern
+        self.others: List[Tuple[int, Trigger]] = []  # triggers that must be called in order
+
+        patterns = []
+        for i, (trigger, behaviour) in enumerate(rules):
+            self.triggers.append(trigger)
+            self.behaviours.append(behaviour)
+            if type(trigger) is IdTrigger:
+                self.ids.setdefault(trigger.id, i)
+            elif type(trigger) is FilenameTrigger:
+                literal = _as_literal(trigger.pattern)
+                if literal is not None:
+                    self.literals.setdefault(literal, i)
+                    continue
+                group = f'_{i}'
+                # patterns with their own groups or global flags cannot be safely wrapped in a group
+                if trigger.file_pattern.groups == 0:
+                    try:
+                        re.compile(f'(?P<{group}>{trigger.pattern})')
+                    except re.error:
+                        pass
+                    else:
+                        patterns.append(f'(?P<{group}>{trigger.pattern})')
+                        self.regex_indices[group] = i
+                        continue
+                self.others.append((i, trigger))
+            else:
+                self.others.append((i, trigger))
+
+        # the regex engine tries alternatives in order, so the first group to fully match is the earliest rule
+        self.regex = re.compile('|'.join(patterns)) if patterns else None
+        self.first_regex_index = min(self.regex_indices.values(), default=len(self.behaviours))
+
+    def find(self, video: Video) -> Optional[int]:
+        """get the index of the first rule that is triggered by the video, or None if no rule is triggered"""
+        best = len(self.behaviours)
+
+        index = self.ids.get(video.videoid)
+        if index is not None:
+            best = index
+
+        file_name = video.file_name
+        if file_name:
+            index = self.literals.get(file_name)
+            if index is not None and index < best:
+                best = index
+            if self.regex is not None and self.first_regex_index < best:
+                match = self.regex.fullmatch(file_name)
+                if match:
+                    best = min(best, self.regex_indices[match.lastgroup])
+
+        for index, trigger in self.others:
+            if index >= best:
+                break
+            if trigger(video):
+                best = index
+                break
+
+        if best < len(self.behaviours):
+            return best
+        return None
+
+    def __call__(self, video: Video) -> Behaviour:
+        index = self.find(video)
+        if index is None:
+            return Behaviour()
+        return self.behaviours[index]
+
+
+class RuleList(list):
+    """A list of rules, that keeps a compiled form of itself up to date"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._version = 0
+        self._compiled: Tuple[int, CompiledRules] = None
+        # guards the rules and their version, so a compiled form is never stored under a version it does not match
+        self._lock = RLock()
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+    def compiled(self) -> CompiledRules:
+        compiled = self._compiled
+        if compiled is not None and compiled[0] == self._version:
+            return compiled[1]
+        with self._lock:
+            version = self._version
+            rules = list(self)
+        # the rules are compiled without the lock, a compiled form that is stored late only causes another compilation
+        compiled = (version, CompiledRules(rules))
+        self._compiled = compiled
+        return compiled[1]
+
+
+def _invalidating(name):
+    method = getattr(list, name)
+
+    def ret(self, *args, **kwargs):
+        with self._lock:
+            # the version changes only once the rules did
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._version += 1
+
+    ret.__name__ = name
+    ret.__doc__ = method.__doc__
+    return ret
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__',
+              'append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(RuleList, _name, _invalidating(_name))
@@ -0,0 +1,33 @@
+from typing import Iterable, NamedTuple, Tuple, Set
+
+import hashlib
+
+
+def digest_ids(ids: Iterable[str]) -> str:
+    """a digest of an ordered list of video ids"""
+    h = hashlib.sha1()
+    for id_ in ids:
+        h.update(id_.encode('utf-8', 'surrogatepass'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+class SyncSnapshot(NamedTuple):
+    """the state of the playlist at the end of the last sync"""
+    ids: Tuple[str, ...]  # the ids of the playlist's videos, in order
+    digest: str  # the digest of ids
+    pending: Tuple[str, ...]  # ids of videos whose suggestions were not resolved during the sync
+
+    @classmethod
+    def of(cls, ids: Iterable[str], pending: Iterable[str] = ()) -> 'SyncSnapshot':
+        ids = tuple(ids)
+        return cls(ids, digest_ids(ids), tuple(pending))
+
+    def changed_ids(self, ids: Tuple[str, ...]) -> Set[str]:
+        """get the ids that were added to or removed from the playlist since the snapshot, along with pending ids"""
+        ret = set(self.pending)
+        if digest_ids(ids) != self.digest:
+            previous = set(self.ids)
+            current = set(ids)
+            ret.update(previous.symmetric_difference(current))
+        return ret
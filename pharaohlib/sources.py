@@ -0,0 +1,185 @@
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from abc import ABC, abstractmethod
+import json
+from pathlib import Path
+
+
+def _pafy():
+    # pafy imports youtube-dl, which takes longer than everything else pharaoh imports, so it is only imported once a
+    #  playlist or a video is actually fetched
+    import pafy
+    return pafy
+
+
+# the packages whose errors mean that a playlist or a video could not be fetched
+_backend_packages = ('pafy', 'youtube_dl', 'yt_dlp')
+
+
+def _fetching(what: str, func: Callable, *args):
+    """
+    call a function of a remote backend, turning the errors it raises when it cannot fetch into OSError, so callers
+     can tell them apart from bugs and fall back to cached data
+    """
+    try:
+        return func(*args)
+    except OSError:
+        raise
+    except Exception as e:
+        # pafy raises ValueError for missing and unavailable playlists and videos
+        if not isinstance(e, ValueError) and type(e).__module__.partition('.')[0] not in _backend_packages:
+            raise
+        raise OSError(f'could not fetch {what}: {e}') from e
+
+
+class PlaylistEntry(NamedTuple):
+    """a lightweight record of a playlist entry, as listed by a flat source"""
+    videoid: str
+    title: str
+
+
+class Source(ABC):
+    """
+    A backend that playlists and videos are fetched from.
+    Listing a playlist only needs the ids and titles of its entries, the full data of a video (its streams) is only
+     loaded to download it.
+    """
+    # whether the entries listed by the source already hold their titles, rather than fetching them once accessed, so
+    #  the listing needs no resolving, see Phar._resolve_all
+    flat = False
+
+    @abstractmethod
+    def list_playlist(self, playlist_id: str) -> Iterable:
+        """
+        list the entries of a playlist, in order, every entry has a videoid and a title
+        :raises OSError: if the playlist could not be fetched
+        """
+        pass
+
+    @abstractmethod
+    def load_video(self, videoid: str):
+        """
+        load the full data of a video, to download it: an object with the streams, getbest and videoid of a pafy
+         object
+        :raises OSError: if the video could not be loaded
+        """
+        pass
+
+
+class PafySource(Source):
+    """
+    fetches playlists with pafy, the titles of the entries are fetched once they are accessed, and are fetched
+     concurrently by the project
+    """
+
+    def list_playlist(self, playlist_id: str) -> Iterable:
+        # the playlist is listed page by page as it is iterated, only the titles are fetched lazily
+        return _fetching(f'playlist {playlist_id}', lambda: list(_pafy().get_playlist2(playlist_id)))
+
+    def load_video(self, videoid: str):
+        return _fetching(f'video {videoid}', _pafy().new, videoid)
+
+
+class YoutubeDLSource(Source):
+    """
+    lists playlists with youtube-dl's flat extraction, that lists the ids and titles of a whole playlist in a few
+     paged requests, instead of a request for every entry.
+    Videos are loaded with pafy.
+    """
+    flat = True
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        """
+        :param options: additional options for youtube-dl
+        """
+        self.options = options or {}
+
+    def list_playlist(self, playlist_id: str) -> List[PlaylistEntry]:
+        # youtube-dl is installed along with pafy, and takes as long to import
+        import youtube_dl
+        options = {'extract_flat': 'in_playlist', 'quiet': True, 'skip_download': True, **self.options}
+        url = f'https://www.youtube.com/playlist?list={playlist_id}'
+        with youtube_dl.YoutubeDL(options) as ydl:
+            info = _fetching(f'playlist {playlist_id}', ydl.extract_info, url, False)
+        # an empty title still marks the video as an entry of the playlist, like those of private videos
+        return [PlaylistEntry(entry['id'], entry.get('title') or '') for entry in info.get('entries') or ()]
+
+    def load_video(self, videoid: str):
+        return _fetching(f'video {videoid}', _pafy().new, videoid)
+
+
+class MemorySource(Source):
+    """
+    a source of playlists that are held in memory, for working offline, testing and benchmarking
+    """
+    flat = True
+
+    def __init__(self, playlists: Dict[str, Sequence[Tuple[str, str]]],
+                 video_loader: Optional[Callable[[str], Any]] = None):
+        """
+        :param playlists: the ids and titles of the entries of every playlist, by the playlists' ids
+        :param video_loader: a callable that accepts a video id and returns its full data, or None if the video is not
+         available, if not set, videos cannot be downloaded
+        """
+        self.playlists = playlists
+        self.video_loader = video_loader
+
+    def list_playlist(self, playlist_id: str) -> List[PlaylistEntry]:
+        try:
+            entries = self.playlists[playlist_id]
+        except KeyError:
+            raise OSError(f'playlist {playlist_id} is not in the source') from None
+        return [PlaylistEntry(videoid, title) for videoid, title in entries]
+
+    def load_video(self, videoid: str):
+        if self.video_loader is None:
+            raise OSError(f'video {videoid} cannot be downloaded from this source')
+        ret = self.video_loader(videoid)
+        if ret is None:
+            raise OSError(f'video {videoid} is not available from this source')
+        return ret
+
+
+class JsonSource(MemorySource):
+    """
+    a source of playlists that are stored in a local json file, of the form
+     {"playlists": {playlist id: [[video id, title], ...]}}
+    The file is read again whenever a playlist is listed, so it can be edited while a project is loaded.
+    """
+
+    def __init__(self, path: Path, video_loader: Optional[Callable[[str], Any]] = None):
+        super().__init__({}, video_loader)
+        self.path = Path(path)
+
+    def list_playlist(self, playlist_id: str) -> List[PlaylistEntry]:
+        try:
+            with open(self.path, encoding='utf-8') as r:
+                self.playlists = json.load(r)['playlists']
+        except (KeyError, TypeError, ValueError) as e:
+            raise OSError(f'{self.path} is not a playlist file') from e
+        return super().list_playlist(playlist_id)
+
+    @staticmethod
+    def dump(path: Path, playlists: Dict[str, Iterable]):
+        """
+        write playlists to a json file
+        :param playlists: the entries of every playlist, like those listed by any source, by the playlists' ids
+        """
+        inner = {'playlists': {
+            playlist_id: [[entry.videoid, entry.title] for entry in entries]
+            for playlist_id, entries in playlists.items()
+        }}
+        with open(path, 'w', encoding='utf-8') as w:
+            json.dump(inner, w, ensure_ascii=False)
+
+
+# the sources that can be chosen by name, see source_named
+SOURCES = ('pafy', 'youtube-dl')
+
+
+def source_named(name: str) -> Source:
+    if name == 'pafy':
+        return PafySource()
+    if name == 'youtube-dl':
+        return YoutubeDLSource()
+    raise ValueError(f'source must be one of {", ".join(SOURCES)}')
@@ -1,21 +1,39 @@
-from typing import Optional, Union
-
-from pathlib import Path
-from dataclasses import dataclass
-
-from pafy import pafy
+from typing import Optional
 
 from pharaohlib._utility import safe_filename
 
 
-@dataclass
 class Video:
-    paf: Union[pafy.Pafy, str]
-    file_name: Optional[str] = None
+    """
+    A video of a project, either an entry of the playlist, or a video that was removed from the playlist after it
+     was downloaded.
+    Only the data pharaoh uses is kept in memory, the video's full pafy object is only loaded to download it, see
+     Phar.load_paf
+    """
+    __slots__ = ('videoid', 'title', 'file_name')
+
+    def __init__(self, videoid: str, title: Optional[str] = None, file_name: Optional[str] = None):
+        """
+        :param videoid: the id of the video
+        :param title: the title of the video, None if the video is not in the playlist
+        :param file_name: the name of the video's file in the destination, if it has one
+        """
+        self.videoid = videoid
+        self.title = title
+        self.file_name = file_name
+
+    @classmethod
+    def from_entry(cls, entry, file_name: Optional[str] = None) -> 'Video':
+        """create a video from a (resolved) entry of the playlist"""
+        # an empty title still marks the video as an entry of the playlist
+        return cls(entry.videoid, entry.title or '', file_name)
 
     @property
     def exists_in_source(self):
-        return not isinstance(self.paf, str)
+        return self.title is not None
 
     def suggest_fname(self):
-        return safe_filename(self.paf.title)
+        return safe_filename(self.title)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.videoid!r}, {self.title!r}, {self.file_name!r})'
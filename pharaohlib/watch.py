@@ -0,0 +1,120 @@
+from typing import Callable, Dict, Iterable, Optional
+
+import os
+import select
+import warnings
+from threading import Thread
+
+# inotify flags, see inotify(7)
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+# the changes that can change the listing of a directory, or the size of a file in it
+_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF \
+        | _IN_ONLYDIR
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        # ctypes is only imported by projects that watch their destinations
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        # raises AttributeError where inotify is not available
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+        libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        _libc = libc
+    return _libc
+
+
+class InotifyWatcher:
+    """
+    Watches directories for changes with linux's inotify, and calls a function from a background thread whenever any
+     of them changes.
+    The watcher does not tell what changed, the destination index finds that out by itself when it is refreshed.
+    """
+
+    @staticmethod
+    def available() -> bool:
+        try:
+            _load_libc()
+        except (OSError, AttributeError):
+            return False
+        return True
+
+    def __init__(self, on_change: Callable[[], None]):
+        libc = _load_libc()
+        self.on_change = on_change
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            import ctypes
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches: Dict[str, int] = {}  # watch descriptors by the paths of the directories
+        self._full = False  # whether the watch limit was reached
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = Thread(target=self._run, name='pharaoh-watch', daemon=True)
+        self._thread.start()
+
+    def update(self, dirs: Iterable[str]):
+        """watch exactly the given directories, directories that were watched before and are not given are dropped"""
+        libc = _load_libc()
+        dirs = set(dirs)
+        for path in list(self._watches):
+            if path not in dirs:
+                # the kernel already dropped the watches of removed directories, which makes this fail harmlessly
+                libc.inotify_rm_watch(self._fd, self._watches.pop(path))
+        for path in dirs:
+            if path in self._watches:
+                continue
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(path), _MASK)
+            if wd >= 0:
+                self._watches[path] = wd
+            elif not self._full:
+                # most likely the limit of watches (fs.inotify.max_user_watches), the changes of the rest of the
+                #  directories are only found by polling
+                self._full = True
+                warnings.warn(f'could not watch {path}, some directories are only polled for changes')
+
+    def _run(self):
+        while True:
+            readable, _, _ = select.select([self._fd, self._wake_r], [], [])
+            if self._wake_r in readable:
+                return
+            changed = False
+            while True:
+                try:
+                    data = os.read(self._fd, 1 << 16)
+                except BlockingIOError:
+                    break
+                if not data:
+                    break
+                changed = True
+            if changed:
+                self.on_change()
+
+    def close(self):
+        os.write(self._wake_w, b'\0')
+        self._thread.join()
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            os.close(fd)
+
+
+def make_watcher(on_change: Callable[[], None]) -> Optional[InotifyWatcher]:
+    """create a watcher if the platform supports it, otherwise, changes can only be found by polling"""
+    if not InotifyWatcher.available():
+        return None
+    try:
+        return InotifyWatcher(on_change)
+    except OSError:
+        return None
@@ -0,0 +1,32 @@
+from typing import Dict, Optional, Sequence, Tuple
+
+import os
+from pathlib import Path
+
+from pharaohlib import Phar
+from pharaohlib.fakes import FakeStream, FakeVideo
+from pharaohlib.sources import MemorySource
+
+
+def make_videos(tmp_path: Path, titles: Sequence[Tuple[str, str]], size: int = 1000) -> Dict[str, FakeVideo]:
+    """create a fake video with a single stream for every id and title, the streams' data is size bytes long"""
+    ret = {}
+    for videoid, title in titles:
+        blob = tmp_path / f'{videoid}.blob'
+        blob.write_bytes(os.urandom(size))
+        ret[videoid] = FakeVideo(videoid, title, [FakeStream(blob)])
+    return ret
+
+
+def make_phar(destination: Path, titles: Sequence[Tuple[str, str]], videos: Optional[Dict[str, FakeVideo]] = None,
+              playlist_id: str = 'playlist') -> Phar:
+    """create a project whose playlist and videos come from memory"""
+    ret = Phar()
+    ret.source_playlist_id = playlist_id
+    ret.destination_roots = [destination]
+    ret.rules = []
+    ret.id_fname_assoc = {}
+    ret.source = MemorySource({playlist_id: list(titles)}, None if videos is None else videos.get)
+    # the temporary directories of the tests can be on small volumes
+    ret.min_free_space = 0
+    return ret
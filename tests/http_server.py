@@ -0,0 +1,67 @@
+from typing import List, Optional
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangedServer:
+    """
+    a local http server of a single file that supports range requests, and can misbehave like a real server:
+     ignore ranges, or drop the connection in the middle of a transfer
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ignore_ranges = False
+        # if set, only this many bytes of every response are sent before the connection is dropped
+        self.cut_after: Optional[int] = None
+        self.ranges: List[Optional[str]] = []  # the range header of every request
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/video'
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = server.data
+                requested = self.headers.get('Range')
+                server.ranges.append(requested)
+                match = re.fullmatch(r'bytes=(\d+)-', requested or '')
+                if match and not server.ignore_ranges:
+                    start = int(match.group(1))
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(data)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+                    body = data[start:]
+                else:
+                    self.send_response(200)
+                    body = data
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if server.cut_after is not None:
+                    body = body[:server.cut_after]
+                    self.close_connection = True
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
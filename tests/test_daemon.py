@@ -0,0 +1,27 @@
+import re
+
+from pharaohlib.daemon import Daemon
+from pharaohlib.rules import Behaviour, FilenameTrigger, IdTrigger
+
+from tests.fakes import make_phar
+
+_titles = [('aaaaaaaaaaa', 'one'), ('bbbbbbbbbbb', 'two'), ('ccccccccccc', 'three')]
+
+
+def test_cycles_do_not_repeat_rules(tmp_path):
+    (tmp_path / 'one.mp4').write_bytes(b'1')
+    (tmp_path / 'old.mp4').write_bytes(b'old')
+    phar = make_phar(tmp_path, _titles)
+    phar.id_fname_assoc = {'zzzzzzzzzzz': 'old.mp4'}
+    phar.add_rule(IdTrigger('ccccccccccc'), Behaviour.black)
+    phar.add_rule(FilenameTrigger(re.escape('old.mp4')), Behaviour.white)
+    messages = []
+    daemon = Daemon(phar, lambda suggestion: None, watch=False, on_message=messages.append)
+    for _ in range(2):
+        daemon._cycle(fetch=True, full=True)
+    assert daemon.last_error is None and daemon.cycles == 2
+    assert len(phar.rules) == 2
+    assert messages.count('download three [automatically rejected]') == 2
+    assert (tmp_path / 'old.mp4').exists()
+    # only the video without a rule is left for the user
+    assert daemon.pending_suggestions() == ['download two']
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from pharaohlib.dest_index import DestinationIndex
+
+
+def _tree(root, count):
+    for i in range(count):
+        sub = root / f'sub {i % 10}'
+        sub.mkdir(exist_ok=True)
+        (sub / f'song {i}.mp4').write_bytes(b'')
+
+
+def test_queries_while_files_are_added_and_removed(tmp_path):
+    _tree(tmp_path, 2000)
+    index = DestinationIndex(tmp_path)
+    index.refresh()
+    errors = []
+    stop = threading.Event()
+
+    def mutate():
+        # like the downloads and removals of accepted suggestions, that run while the sync goes on
+        try:
+            i = 0
+            while not stop.is_set():
+                path = tmp_path / f'sub {i % 10}' / f'new {i % 50}.mp4'
+                if path.exists():
+                    path.unlink()
+                    index.discard(path)
+                else:
+                    path.write_bytes(b'')
+                    index.add(path)
+                i += 1
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=mutate)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            index.refresh()
+            assert index.find('song 5.mp4') == tmp_path / 'sub 5' / 'song 5.mp4'
+            assert index.find_stem_names(['song 7', 'missing']) == ['song 7.mp4', None]
+            assert sum(1 for _ in index.files()) >= 2000
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors
+
+
+def _found(index):
+    """the names and stems that are found in an index"""
+    index.find('')
+    return set(index._by_name), set(index._by_stem)
+
+
+def test_discard_keeps_lookups(tmp_path, monkeypatch):
+    _tree(tmp_path, 100)
+    index = DestinationIndex(tmp_path)
+    index.refresh()
+    index.find('song 0.mp4')
+    builds = []
+    build = DestinationIndex._build_lookups
+    monkeypatch.setattr(DestinationIndex, '_build_lookups', lambda self: builds.append(1) or build(self))
+    for i in range(50):
+        path = tmp_path / f'sub {i % 10}' / f'song {i}.mp4'
+        path.unlink()
+        index.discard(path)
+        assert index.find(path.name) is None
+        assert index.find_stem(f'song {i}') is None
+    # no removal required rebuilding the lookups
+    assert not builds
+    assert index.find('song 50.mp4') == tmp_path / 'sub 0' / 'song 50.mp4'
+
+
+def test_discard_finds_files_that_take_the_place(tmp_path):
+    for sub in ('a', 'b'):
+        (tmp_path / sub).mkdir()
+        (tmp_path / sub / 'song.mp4').write_bytes(b'')
+    (tmp_path / 'a' / 'song.part.webm').write_bytes(b'')
+    (tmp_path / 'b' / 'other.mp4').write_bytes(b'')
+    index = DestinationIndex(tmp_path)
+    index.refresh()
+    first = index.find('song.mp4')
+    first.unlink()
+    index.discard(first)
+    # the file of the same name in the other directory takes the place of the removed file
+    assert index.find('song.mp4') == tmp_path / ('b' if first.parent.name == 'a' else 'a') / 'song.mp4'
+    assert index.find_stem('song') is not None
+
+    for path in sorted(index.files()):
+        path.unlink()
+        index.discard(path)
+        fresh = DestinationIndex(tmp_path)
+        fresh.refresh()
+        assert _found(index) == _found(fresh)
+    assert _found(index) == (set(), set())
@@ -0,0 +1,327 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from pharaohlib import AddSuggestion
+from pharaohlib.downloads import DownloadScheduler, PartialDownload, RateWindow, TokenBucket, fetch_resumable, \
+    partial_path
+from pharaohlib.fakes import FakeStream, FakeVideo
+
+from tests.fakes import make_phar, make_videos
+from tests.http_server import RangedServer
+
+
+class _Tracker:
+    """a fake download that sleeps, and records how many downloads ran at the same time"""
+
+    def __init__(self, duration: float = 0.05):
+        self.duration = duration
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, label, success=True):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.duration)
+        with self._lock:
+            self.running -= 1
+        if success is None:
+            raise OSError('the download failed')
+        return success
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_scheduler_runs_at_most_workers(workers):
+    tracker = _Tracker()
+    with DownloadScheduler(workers) as scheduler:
+        for i in range(8):
+            scheduler.submit(str(i), tracker, i)
+        results = scheduler.join()
+    assert tracker.peak == workers
+    assert len(results) == 8
+    assert all(r.success for r in results)
+
+
+def test_scheduler_is_concurrent():
+    tracker = _Tracker(duration=0.1)
+    start = time.monotonic()
+    with DownloadScheduler(4) as scheduler:
+        for i in range(8):
+            scheduler.submit(str(i), tracker, i)
+        scheduler.join()
+    # two rounds of four downloads, rather than eight downloads one after the other
+    assert time.monotonic() - start < 0.6
+
+
+def test_scheduler_records_failures():
+    tracker = _Tracker(duration=0)
+    with DownloadScheduler(2) as scheduler:
+        futures = [scheduler.submit('ok', tracker, 0), scheduler.submit('false', tracker, 1, False),
+                   scheduler.submit('raises', tracker, 2, None)]
+        results = scheduler.join()
+    assert futures[0].result() is True
+    assert futures[1].result() is False
+    assert isinstance(futures[2].exception(), OSError)
+    assert sorted((r.label, r.success) for r in results) == [('false', False), ('ok', True), ('raises', False)]
+    assert 'downloaded 1/3 videos' in scheduler.summary()
+
+
+def test_scheduler_queue_is_bounded():
+    release = threading.Event()
+    with DownloadScheduler(1, queue_size=1) as scheduler:
+        scheduler.submit('running', release.wait)
+        scheduler.submit('waiting', release.wait)
+        submitted = threading.Event()
+        thread = threading.Thread(target=lambda: (scheduler.submit('blocked', release.wait), submitted.set()))
+        thread.start()
+        # the third download waits until there is room in the queue
+        assert not submitted.wait(0.2)
+        release.set()
+        assert submitted.wait(5)
+        thread.join()
+        assert len(scheduler.join()) == 3
+
+
+def test_child_scheduler_shares_workers():
+    tracker = _Tracker()
+    with DownloadScheduler(2) as parent:
+        children = [parent.child(), parent.child()]
+        for i, child in enumerate(children):
+            for j in range(3):
+                child.submit(f'{i}.{j}', tracker, j)
+        child_results = [child.join() for child in children]
+        assert tracker.peak == 2
+        assert [len(results) for results in child_results] == [3, 3]
+        assert len(parent.join()) == 6
+
+
+def test_accepted_suggestions_download_in_background(tmp_path):
+    titles = [(f'video{i:06d}', f'title {i}') for i in range(4)]
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    phar = make_phar(destination, titles, make_videos(tmp_path, titles))
+    with DownloadScheduler(2) as scheduler:
+        phar.download_scheduler = scheduler
+        futures = [s.accept() for s in phar.suggest_edits() if isinstance(s, AddSuggestion)]
+        assert len(futures) == 4
+        assert all(f.result() for f in futures)
+    assert sorted(p.name for p in destination.iterdir()) == [f'title {i}.mp4' for i in range(4)]
+    assert phar.id_fname_assoc == {videoid: f'{title}.mp4' for videoid, title in titles}
+    assert not phar._downloading
+
+
+@pytest.fixture
+def server():
+    ret = RangedServer(os.urandom(200_000))
+    yield ret
+    ret.close()
+
+
+def test_fetch_resumable_downloads(tmp_path, server):
+    path = tmp_path / 'video.mp4'
+    assert fetch_resumable(server.url, path) == len(server.data)
+    assert path.read_bytes() == server.data
+    assert not partial_path(path).exists()
+    assert server.ranges == [None]
+
+
+def test_fetch_resumable_resumes_partial_file(tmp_path, server):
+    path = tmp_path / 'video.mp4'
+    partial_path(path).write_bytes(server.data[:1234])
+    assert fetch_resumable(server.url, path) == len(server.data) - 1234
+    assert path.read_bytes() == server.data
+    assert not partial_path(path).exists()
+    assert server.ranges == ['bytes=1234-']
+
+
+def test_fetch_resumable_starts_over_if_range_ignored(tmp_path, server):
+    server.ignore_ranges = True
+    path = tmp_path / 'video.mp4'
+    partial_path(path).write_bytes(b'garbage')
+    assert fetch_resumable(server.url, path) == len(server.data)
+    assert path.read_bytes() == server.data
+
+
+def test_fetch_resumable_completes_finished_partial_file(tmp_path, server):
+    # the transfer finished but the file was not moved into place, the server answers the range with 416
+    path = tmp_path / 'video.mp4'
+    partial_path(path).write_bytes(server.data)
+    assert fetch_resumable(server.url, path) == 0
+    assert path.read_bytes() == server.data
+    assert not partial_path(path).exists()
+    assert server.ranges == [f'bytes={len(server.data)}-']
+
+
+def test_fetch_resumable_keeps_interrupted_transfer(tmp_path, server):
+    path = tmp_path / 'video.mp4'
+    server.cut_after = 50_000
+    with pytest.raises(OSError):
+        fetch_resumable(server.url, path)
+    assert not path.exists()
+    assert partial_path(path).read_bytes() == server.data[:50_000]
+    server.cut_after = None
+    assert fetch_resumable(server.url, path) == len(server.data) - 50_000
+    assert path.read_bytes() == server.data
+
+
+class _RemoteStream(FakeStream):
+    def __init__(self, url: str, itag: str):
+        super().__init__(None, itag)
+        self._url = url
+
+    @property
+    def url(self):
+        return self._url
+
+    def get_filesize(self):
+        return None
+
+
+def test_phar_resumes_recorded_partial_download(tmp_path, server):
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    video = FakeVideo('video000000', 'title', [_RemoteStream(server.url, '22'), _RemoteStream(server.url, '18')])
+    phar = make_phar(destination, [(video.videoid, video.title)], {video.videoid: video})
+    # an earlier download of the second stream was interrupted
+    phar.partial_downloads[video.videoid] = PartialDownload('title.webm', '18')
+    partial_path(destination / 'title.webm').write_bytes(server.data[:1000])
+    assert phar.download_video(phar.get_video(video.videoid), 'title.*')
+    assert (destination / 'title.webm').read_bytes() == server.data
+    assert server.ranges == ['bytes=1000-']
+    assert not phar.partial_downloads
+    assert phar.id_fname_assoc == {video.videoid: 'title.webm'}
+
+
+class _FakeTime:
+    """a clock that only advances when slept on"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+def test_token_bucket_limits_rate():
+    fake = _FakeTime()
+    bucket = TokenBucket(1000, clock=fake.clock, sleep=fake.sleep)
+    for _ in range(100):
+        bucket.consume(100)
+    # the first chunk is taken on credit, every other byte waits for its share of the rate
+    assert fake.slept == pytest.approx(9.9)
+
+
+def test_token_bucket_refills_up_to_burst():
+    fake = _FakeTime()
+    bucket = TokenBucket(1000, burst=500, clock=fake.clock, sleep=fake.sleep)
+    fake.now = 100
+    bucket.consume(500)
+    bucket.consume(500)
+    # idle time only refills the bucket up to its capacity, the second transfer went into debt
+    assert fake.slept == 0
+    bucket.consume(1)
+    assert fake.slept == pytest.approx(0.5)
+
+
+def test_token_bucket_windows():
+    fake = _FakeTime()
+    day = datetime(2020, 1, 1, 12, 0)
+    bucket = TokenBucket(1000, [RateWindow.parse('11:00-13:00=2K'), RateWindow.parse('13:00-14:00')],
+                         clock=fake.clock, sleep=fake.sleep, now=lambda: day)
+    assert bucket.current_rate() == 2048
+    day = datetime(2020, 1, 1, 13, 30)
+    assert bucket.current_rate() is None
+    bucket.consume(10 ** 9)
+    assert fake.slept == 0
+    day = datetime(2020, 1, 1, 20, 0)
+    assert bucket.current_rate() == 1000
+
+
+def test_token_bucket_pauses_at_zero_rate():
+    fake = _FakeTime()
+    paused = [True]
+    bucket = TokenBucket(0, clock=fake.clock, sleep=lambda s: (fake.sleep(s), paused.pop()))
+    bucket.windows = [RateWindow.parse('00:00-23:59=1K')]
+    bucket._now = lambda: datetime(2020, 1, 1, 23, 59, 30) if paused else datetime(2020, 1, 1, 12)
+    bucket.consume(1)
+    assert fake.slept == TokenBucket.pause_interval
+
+
+@pytest.mark.parametrize('size', [10, 200_000])
+def test_throttle_is_charged_transferred_bytes(tmp_path, size):
+    server = RangedServer(os.urandom(size))
+    try:
+        charged = []
+        fetch_resumable(server.url, tmp_path / 'video.mp4', throttle=charged.append)
+    finally:
+        server.close()
+    assert sum(charged) == size
+    assert all(charged)
+
+
+def _sized_videos(tmp_path, sizes):
+    titles = [(f'video{i:06d}', f'title {i}') for i in range(len(sizes))]
+    videos = {}
+    for i, ((videoid, title), size) in enumerate(zip(titles, sizes)):
+        blob = tmp_path / f'{videoid}.blob'
+        blob.write_bytes(bytes(size))
+        videos[videoid] = FakeVideo(videoid, title, [FakeStream(blob)], published=f'2020-01-{i + 1:02d} 00:00:00')
+    return titles, videos
+
+
+@pytest.mark.parametrize('order, expected', [
+    ('submission', [0, 1, 2, 3]),
+    ('position', [0, 1, 2, 3]),
+    ('smallest', [2, 0, 3, 1]),
+    ('newest', [3, 2, 1, 0]),
+])
+def test_scheduler_order(tmp_path, order, expected):
+    titles, videos = _sized_videos(tmp_path, [300, 900, 100, 500])
+    phar = make_phar(tmp_path, titles, videos)
+    started = []
+    phar.download_callback = lambda paf, filename: started.append(int(paf.videoid[-1])) or True
+    release = threading.Event()
+    with DownloadScheduler(1, queue_size=len(titles) + 1, order=order) as scheduler:
+        phar.download_scheduler = scheduler
+        # the only worker is busy until all the downloads are waiting
+        scheduler.submit('blocker', release.wait)
+        # submitted in reverse, so the order of the playlist is not the order of submission
+        suggestions = [s for s in phar.suggest_edits() if isinstance(s, AddSuggestion)]
+        if order != 'submission':
+            suggestions.reverse()
+        for suggestion in suggestions:
+            suggestion.accept()
+        time.sleep(0.3)
+        release.set()
+        scheduler.join()
+    assert started == expected
+
+
+def test_choose_stream_budgets(tmp_path):
+    streams = []
+    for size in (1000, 500, 100):
+        blob = tmp_path / f'{size}.blob'
+        blob.write_bytes(bytes(size))
+        streams.append(FakeStream(blob, itag=str(size)))
+    video = FakeVideo('video000000', 'title', streams, length=10)
+    phar = make_phar(tmp_path, ())
+    assert phar.choose_stream(video) is streams[0]
+    phar.max_download_size = 600
+    assert phar.choose_stream(video) is streams[1]
+    phar.max_download_size = 50
+    # no stream is within the budget, the smallest is the closest
+    assert phar.choose_stream(video) is streams[2]
+    phar.max_download_size = None
+    # estimated from the size and the length, 500 bytes in 10 seconds are 400 bits per second
+    phar.max_bitrate = 400
+    assert phar.choose_stream(video) is streams[1]
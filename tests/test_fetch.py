@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pharaohlib.fakes import FakeVideo
+from pharaohlib.sources import Source
+
+from tests.fakes import make_phar
+
+
+class _LazySource(Source):
+    """a source whose entries take time to resolve their titles, like pafy's"""
+
+    def __init__(self, titles, latency: float):
+        self.titles = titles
+        self.latency = latency
+        self.listed = 0
+
+    def list_playlist(self, playlist_id):
+        self.listed += 1
+        return [FakeVideo(videoid, title, latency=self.latency) for videoid, title in self.titles]
+
+    def load_video(self, videoid):
+        raise OSError('offline')
+
+
+_titles = [(f'video{i:06d}', f'title {i}') for i in range(40)]
+
+
+def test_entries_resolve_concurrently(tmp_path):
+    phar = make_phar(tmp_path, ())
+    phar.source = _LazySource(_titles, latency=0.05)
+    phar.fetch_workers = 8
+    start = time.monotonic()
+    videos = phar.videos
+    elapsed = time.monotonic() - start
+    # 40 entries one after the other would take 2 seconds
+    assert elapsed < 1
+    # the playlist's order is kept
+    assert [(v.videoid, v.title) for v in videos] == _titles
+
+
+def test_entries_resolve_in_shared_executor(tmp_path):
+    phar = make_phar(tmp_path, ())
+    phar.source = _LazySource(_titles, latency=0.01)
+    with ThreadPoolExecutor(4) as executor:
+        phar.fetch_executor = executor
+        assert [v.title for v in phar.videos] == [title for _, title in _titles]
+
+
+def test_flat_sources_need_no_resolving(tmp_path):
+    phar = make_phar(tmp_path, _titles)
+    assert phar.source.flat
+    assert [(v.videoid, v.title) for v in phar.videos] == _titles
+
+
+def test_fetch_is_lazy(tmp_path):
+    phar = make_phar(tmp_path, ())
+    source = phar.source = _LazySource(_titles, latency=0)
+    assert not phar.fetched
+    assert source.listed == 0
+    _ = phar.videos, phar.videos
+    assert phar.fetched
+    assert source.listed == 1
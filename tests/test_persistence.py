@@ -0,0 +1,107 @@
+import re
+
+from pharaohlib import Phar
+from pharaohlib.downloads import PartialDownload
+from pharaohlib.journal import Journal, digest
+from pharaohlib.rules import Behaviour, FilenameTrigger, IdTrigger
+from pharaohlib.snapshot import SyncSnapshot
+
+from tests.fakes import make_phar
+
+
+def _state(phar: Phar):
+    """everything a project stores, in a comparable form"""
+    index = phar.destination_index
+    return (
+        phar.source_playlist_id,
+        [str(root) for root in phar.destination_roots],
+        list(phar.rules),
+        dict(phar.id_fname_assoc),
+        dict(phar.partial_downloads),
+        phar.sync_snapshot,
+        None if index is None else sorted(str(path) for path in index.files()),
+        None if index is None else [(str(i.root), {rel: (r.files, r.subdirs) for rel, r in i.dirs.items()})
+                                    for i in index.indexes],
+    )
+
+
+def _project(tmp_path) -> Phar:
+    roots = [tmp_path / 'first', tmp_path / 'second']
+    for root in roots:
+        (root / 'sub').mkdir(parents=True)
+    (roots[0] / 'one.mp4').write_bytes(b'1')
+    (roots[0] / 'sub' / 'two.webm').write_bytes(b'22')
+    (roots[1] / 'שלוש.mp4').write_bytes(b'333')
+    ret = make_phar(roots[0], [('aaaaaaaaaaa', 'one'), ('bbbbbbbbbbb', 'two')])
+    ret.destination_roots = roots
+    ret.id_fname_assoc = {'aaaaaaaaaaa': 'one.mp4', 'bbbbbbbbbbb': 'two.webm', 'ccccccccccc': 'שלוש.mp4'}
+    ret.add_rule(IdTrigger('ddddddddddd'), Behaviour.black)
+    ret.add_rule(FilenameTrigger(re.escape('one.mp4')), Behaviour.white)
+    ret.add_rule(FilenameTrigger(r'.*\.webm'), Behaviour(add=True, remove=False))
+    ret.partial_downloads = {'eeeeeeeeeee': PartialDownload('five.mp4', '18')}
+    ret.sync_snapshot = SyncSnapshot.of(['aaaaaaaaaaa', 'bbbbbbbbbbb'], ['bbbbbbbbbbb'])
+    ret.scan_destination()
+    return ret
+
+
+def test_pickle_binary_round_trip(tmp_path):
+    phar = _project(tmp_path)
+    expected = _state(phar)
+    pickled = Phar.read(phar.write(protocol=1))
+    assert _state(pickled) == expected
+    binary = Phar.read(pickled.write(protocol=2))
+    assert _state(binary) == expected
+    # the binary format is stable
+    assert binary.write(protocol=2) == pickled.write(protocol=2)
+
+
+def test_journal_replay(tmp_path):
+    path = tmp_path / 'project.phr'
+    _project(tmp_path).save(path)
+
+    phar = Phar.load(path)
+    phar.add_rule(IdTrigger('fffffffffff'), Behaviour.black)
+    phar._set_assoc('ggggggggggg', 'seven.mp4')
+    phar.set_destination_roots(list(reversed(phar.destination_roots)))
+    phar._set_partial('hhhhhhhhhhh', PartialDownload('eight.webm', '43'))
+    phar._set_snapshot(SyncSnapshot.of(['aaaaaaaaaaa'], []))
+    expected = _state(phar)
+    phar.close()
+    # the mutations were only journaled, the project's file was not rewritten
+    assert len(Journal.read_records(Journal.path_for(path), digest(path.read_bytes()))) == 5
+
+    assert _state(Phar.load(path)) == expected
+    # compacting the journal keeps the state
+    loaded = Phar.load(path)
+    loaded.save()
+    loaded.close()
+    assert not Journal.read_records(Journal.path_for(path), digest(path.read_bytes()))
+    assert _state(Phar.load(path)) == expected
+
+
+def test_journal_ignores_record_cut_off_by_crash(tmp_path):
+    path = tmp_path / 'project.phr'
+    _project(tmp_path).save(path)
+    phar = Phar.load(path)
+    phar._set_assoc('ggggggggggg', 'seven.mp4')
+    phar.close()
+    with open(Journal.path_for(path), 'a', encoding='utf-8') as w:
+        w.write('["assoc","hhhhhh')
+    loaded = Phar.load(path)
+    assert loaded.id_fname_assoc['ggggggggggg'] == 'seven.mp4'
+    assert 'hhhhhh' not in loaded.id_fname_assoc
+    # records appended after the cut off record are read
+    loaded._set_assoc('iiiiiiiiiii', 'nine.mp4')
+    loaded.close()
+    assert Phar.load(path).id_fname_assoc['iiiiiiiiiii'] == 'nine.mp4'
+
+
+def test_close_stores_refreshed_index(tmp_path):
+    path = tmp_path / 'project.phr'
+    phar = _project(tmp_path)
+    phar.destination_index = None
+    phar.save(path)
+    phar = Phar.load(path)
+    phar.scan_destination()
+    phar.close()
+    assert Phar.load(path).destination_index is not None
@@ -0,0 +1,95 @@
+import random
+import re
+
+import pytest
+
+from pharaohlib.rules import Behaviour, CompiledRules, FilenameTrigger, IdTrigger, RuleList
+from pharaohlib.video import Video
+
+
+def _first_match(rules, video) -> Behaviour:
+    """the behaviour of the first rule that is triggered, evaluating the rules one by one"""
+    for trigger, behaviour in rules:
+        if trigger(video):
+            return behaviour
+    return Behaviour()
+
+
+_ids = [f'id{i:09d}' for i in range(20)]
+_names = [f'song {i}.{ext}' for i in range(20) for ext in ('mp4', 'webm')] + ['song (1).mp4', 'a.b.c']
+_patterns = [
+    r'.*\.webm', r'song 1\d\.mp4', r'song (1|2)\.mp4', r'(?i)SONG 3\.MP4', r'.*', r'song \d\.mp4', r'song [',
+    r'(?P<x>song) 4\.mp4', r'a\.b\.c', r'song \(1\)\.mp4', r'[a-z]+ 5\..*',
+]
+_behaviours = [Behaviour.black, Behaviour.white, Behaviour(add=True), Behaviour(add=False, remove=False)]
+
+
+def _random_rules(rng: random.Random, count: int):
+    ret = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.3:
+            trigger = IdTrigger(rng.choice(_ids))
+        elif kind < 0.6:
+            trigger = FilenameTrigger(re.escape(rng.choice(_names)))
+        else:
+            pattern = rng.choice(_patterns)
+            try:
+                re.compile(pattern)
+            except re.error:
+                continue
+            trigger = FilenameTrigger(pattern)
+        ret.append((trigger, rng.choice(_behaviours)))
+    return ret
+
+
+def _videos():
+    yield Video(_ids[0])
+    for i, videoid in enumerate(_ids):
+        yield Video(videoid, 'title', _names[i % len(_names)])
+        yield Video(videoid, 'title', None)
+    for name in _names + ['unrelated.txt', '']:
+        yield Video('other', None, name)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_compiled_rules_match_first_rule(seed):
+    rng = random.Random(seed)
+    rules = _random_rules(rng, rng.randrange(1, 40))
+    compiled = CompiledRules(rules)
+    for video in _videos():
+        assert compiled(video) is _first_match(rules, video), (video, rules)
+
+
+def test_compiled_rules_prefer_earlier_rules():
+    rules = [
+        (FilenameTrigger(r'.*\.mp4'), Behaviour.white),
+        (FilenameTrigger(re.escape('song.mp4')), Behaviour.black),
+        (IdTrigger('abc'), Behaviour.black),
+    ]
+    compiled = CompiledRules(rules)
+    assert compiled(Video('abc', 'song', 'song.mp4')) is Behaviour.white
+    assert compiled(Video('abc', 'song', 'song.webm')) is Behaviour.black
+    assert compiled(Video('xyz', 'song', None)) == Behaviour()
+
+
+def test_rule_list_recompiles_when_changed():
+    rules = RuleList([(IdTrigger('abc'), Behaviour.black)])
+    video = Video('xyz', 'title', 'song.mp4')
+    assert rules.compiled()(video) == Behaviour()
+    rules.insert(0, (FilenameTrigger(r'song\..*'), Behaviour.white))
+    assert rules.compiled()(video) is Behaviour.white
+    del rules[0]
+    assert rules.compiled()(video) == Behaviour()
+
+
+def test_rule_list_compiled_during_change():
+    rules = RuleList([(IdTrigger('abc'), Behaviour.black)])
+
+    def new_rules():
+        # compiling while the list is being changed, like another thread that reads the rules in the middle of a change
+        rules.compiled()
+        yield FilenameTrigger(r'song\..*'), Behaviour.white
+
+    rules.extend(new_rules())
+    assert rules.compiled()(Video('xyz', 'title', 'song.mp4')) is Behaviour.white
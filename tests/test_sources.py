@@ -0,0 +1,151 @@
+import warnings
+
+import pytest
+
+from pharaohlib import pipeline
+from pharaohlib.downloads import DownloadScheduler
+from pharaohlib.metadata_cache import MetadataCache
+from pharaohlib.plan import Plan, PlanError, apply_plan, make_plan
+from pharaohlib.sources import JsonSource, MemorySource, PlaylistEntry, _fetching
+from pharaohlib import Phar
+
+from tests.fakes import make_phar, make_videos
+
+_titles = [('aaaaaaaaaaa', 'one'), ('bbbbbbbbbbb', 'two'), ('ccccccccccc', 'three')]
+
+
+def test_json_source(tmp_path):
+    path = tmp_path / 'playlists.json'
+    JsonSource.dump(path, {'playlist': [PlaylistEntry(*t) for t in _titles]})
+    source = JsonSource(path)
+    assert source.flat
+    assert source.list_playlist('playlist') == [PlaylistEntry(*t) for t in _titles]
+    # the file is read again on every listing
+    JsonSource.dump(path, {'playlist': [PlaylistEntry(*_titles[0])]})
+    assert [e.videoid for e in source.list_playlist('playlist')] == ['aaaaaaaaaaa']
+    with pytest.raises(OSError):
+        source.list_playlist('missing')
+    with pytest.raises(OSError):
+        source.load_video('aaaaaaaaaaa')
+    path.write_text('not json')
+    with pytest.raises(OSError):
+        source.list_playlist('playlist')
+
+
+def test_backend_errors_become_os_errors():
+    def not_found():
+        raise ValueError('Playlist not found')
+
+    with pytest.raises(OSError):
+        _fetching('playlist', not_found)
+
+    def bug():
+        raise TypeError('a bug')
+
+    # errors that do not come from the backend are not hidden
+    with pytest.raises(TypeError):
+        _fetching('playlist', bug)
+
+
+def test_cache_fallback_when_source_is_unreachable(tmp_path):
+    cache = MetadataCache(None)
+    phar = make_phar(tmp_path, _titles)
+    phar.metadata_cache = cache
+    assert [v.title for v in phar.videos] == ['one', 'two', 'three']
+
+    offline = make_phar(tmp_path, ())
+    offline.source = MemorySource({})
+    offline.metadata_cache = cache
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        assert [(v.videoid, v.title) for v in offline.videos] == _titles
+    assert any('cached playlist' in str(w.message) for w in caught)
+
+
+def _accept_all(phar: Phar):
+    pipeline.sync(phar, lambda suggestion: True, lambda message: None, full=True)
+
+
+def _files(root):
+    return sorted(p.name for p in root.iterdir())
+
+
+def test_plan_apply_round_trip(tmp_path):
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    (destination / 'three.mp4').write_bytes(b'3')
+    (destination / 'old.mp4').write_bytes(b'old')
+    videos = make_videos(tmp_path, _titles)
+    path = tmp_path / 'project.phr'
+    phar = make_phar(destination, _titles, videos)
+    phar.id_fname_assoc = {'zzzzzzzzzzz': 'old.mp4'}
+    phar.save(path)
+    phar.close()
+    base = path.read_bytes()
+
+    def load():
+        ret = Phar.load(path, journal=False)
+        ret.source = MemorySource({'playlist': _titles}, videos.get)
+        ret.min_free_space = 0
+        return ret
+
+    planned = load()
+    plan = make_plan(planned, lambda: _accept_all(planned))
+    plan_path = tmp_path / 'plan.json'
+    plan.dump(plan_path)
+    # planning changes nothing
+    assert path.read_bytes() == base
+    assert _files(destination) == ['old.mp4', 'three.mp4']
+
+    plan = Plan.load(plan_path)
+    assert sorted(d.videoid for d in plan.downloads) == ['aaaaaaaaaaa', 'bbbbbbbbbbb']
+    assert plan.removals == [str(destination / 'old.mp4')]
+    assert plan.associations == {'ccccccccccc': 'three.mp4'}
+
+    phar = load()
+    with DownloadScheduler(2) as scheduler:
+        phar.download_scheduler = scheduler
+        report = apply_plan(phar, plan, scheduler)
+    phar.close()
+    assert (report.removed, report.downloaded, report.failed) == (1, 2, [])
+    assert _files(destination) == ['one.mp4', 'three.mp4', 'two.mp4']
+
+    applied = Phar.load(path)
+    assert applied.id_fname_assoc == {
+        'aaaaaaaaaaa': 'one.mp4', 'bbbbbbbbbbb': 'two.mp4', 'ccccccccccc': 'three.mp4', 'zzzzzzzzzzz': 'old.mp4'
+    }
+    assert applied.sync_snapshot.ids == tuple(videoid for videoid, _ in _titles)
+    assert not applied.sync_snapshot.pending
+
+
+def test_apply_keeps_failed_downloads_pending(tmp_path):
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    phar = make_phar(destination, _titles)
+    plan = make_plan(phar, lambda: _accept_all(phar))
+    # only the first video can be downloaded from the source of the project
+    videos = make_videos(tmp_path, _titles[:1])
+    phar = make_phar(destination, _titles, videos)
+    report = apply_plan(phar, plan)
+    assert report.downloaded == 1
+    assert len(report.failed) == 2
+    assert phar.sync_snapshot.ids == tuple(videoid for videoid, _ in _titles)
+    assert sorted(phar.sync_snapshot.pending) == ['bbbbbbbbbbb', 'ccccccccccc']
+    # the next sync suggests the failed downloads again
+    assert sorted(v.videoid for v in phar._changed_videos()) == ['bbbbbbbbbbb', 'ccccccccccc']
+
+
+def test_apply_refuses_foreign_plans(tmp_path):
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    outside = tmp_path / 'outside.txt'
+    outside.write_text('keep me')
+    phar = make_phar(destination, _titles)
+    plan = Plan(phar.source_playlist_id, [str(destination)])
+    plan.removals.append(str(outside))
+    report = apply_plan(phar, plan)
+    assert outside.exists()
+    assert report.removed == 0 and len(report.failed) == 1
+
+    with pytest.raises(PlanError):
+        apply_plan(phar, Plan('another playlist', [str(destination)]))
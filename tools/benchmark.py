@@ -0,0 +1,405 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import gc
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+import pharaohlib
+from pharaohlib import Phar
+from pharaohlib._utility import safe_filename
+from pharaohlib.downloads import DownloadScheduler, TokenBucket
+from pharaohlib.fakes import FakeStream, FakeVideo
+from pharaohlib.instrumentation import Profiler
+from pharaohlib.rules import Behaviour, FilenameTrigger, IdTrigger
+from pharaohlib.snapshot import SyncSnapshot
+from pharaohlib.sources import MemorySource, Source
+
+import list_unmanaged
+
+parser = ArgumentParser(description='time the hot paths of pharaoh against a synthetic playlist and destination tree, '
+                                    'and print the results as json')
+
+parser.add_argument('--videos', type=int, default=5000, help='the number of videos in the playlist')
+parser.add_argument('--latency', type=float, default=0,
+                    help='the seconds it takes to resolve a playlist entry or a stream')
+parser.add_argument('--rules', type=int, default=2000, help='the number of rules in the project')
+parser.add_argument('--matched', type=float, default=0.5,
+                    help='the fraction of the videos that already have a file in the destination')
+parser.add_argument('--removed', type=float, default=0.05,
+                    help='the fraction of the managed files whose video is no longer in the playlist')
+parser.add_argument('--files', type=int, default=5000, help='the number of unmanaged files in the destination')
+parser.add_argument('--depth', type=int, default=2, help='the depth of the destination tree')
+parser.add_argument('--roots', type=int, default=1, help='the number of destinations the files are spread between')
+parser.add_argument('--fanout', type=int, default=4, help='the number of subdirectories in every directory')
+parser.add_argument('--downloads', type=int, default=20, help='the number of videos to download')
+parser.add_argument('--stream-size', type=int, default=1 << 20, help='the size of every stream, in bytes')
+parser.add_argument('--workers', type=int, default=4, help='the number of downloads to run at the same time')
+parser.add_argument('--limit', type=int, default=8 << 20,
+                    help='the bandwidth limit of the limited downloads benchmark, in bytes per second')
+parser.add_argument('--repeat', type=int, default=3, help='the number of times to run every benchmark')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--only', action='append', help='only run the benchmarks with this name, can be repeated')
+parser.add_argument('-o', '--output', help='write the results to this file instead of the standard output')
+
+_words = ('live', 'remix', 'official', 'acoustic', 'cover', 'lyrics', 'שיר', 'ballad', '(HD)', 'feat. someone')
+
+
+def _published(videoid: str) -> str:
+    # newer videos have higher ids
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(videoid, 16) * 60))
+
+
+class FakeSource(Source):
+    """a source that makes up a playlist of the same videos every time, whose titles are resolved lazily, like pafy's"""
+
+    def __init__(self, titles, latency: float, blob: Path):
+        self.titles = titles
+        self._titles_by_id = dict(titles)
+        self.latency = latency
+        self.blob = blob
+
+    def _video(self, videoid: str, title: str) -> FakeVideo:
+        streams = [FakeStream(self.blob, '18', 'mp4', self.latency), FakeStream(self.blob, '43', 'webm', self.latency)]
+        return FakeVideo(videoid, title, streams, _published(videoid), latency=self.latency)
+
+    def list_playlist(self, playlist_id):
+        return [self._video(videoid, title) for videoid, title in self.titles]
+
+    def load_video(self, videoid):
+        return self._video(videoid, self._titles_by_id.get(videoid, videoid))
+
+
+def make_titles(count: int, rng: random.Random):
+    ret = []
+    for i in range(count):
+        videoid = f'{i:011x}'
+        ret.append((videoid, f'Artist {i % 97} - Song #{i} {rng.choice(_words)}'))
+    return ret
+
+
+def make_tree(root: Path, names, depth: int, fanout: int, rng: random.Random):
+    """
+    create a destination tree of empty files
+    :param names: the names of the files to create, they are spread out between the directories of the tree
+    :return: the paths of the files, relative to root
+    """
+    dirs = [Path()]
+    level = [Path()]
+    for _ in range(depth):
+        level = [parent / f'dir {i}' for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    ret = []
+    for name in names:
+        rel = rng.choice(dirs) / name
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+        ret.append(rel)
+    return ret
+
+
+def make_rules(count: int, titles, rng: random.Random):
+    """
+    a mix of blacklisted ids, whitelisted file names and a few whitelisted patterns, like the rules a long-used project
+     collects from rejected suggestions
+    """
+    ret = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            ret.append((IdTrigger(f'x{i:010x}'), Behaviour.black))
+        elif kind < 0.98:
+            ret.append((FilenameTrigger(re.escape(f'unrelated file {i}.mp4')), Behaviour.white))
+        else:
+            ret.append((FilenameTrigger(rf'.*\b{i} [a-z]+\.webm'), Behaviour.white))
+    # a few rules that videos actually trigger
+    for videoid, _ in rng.sample(titles, min(len(titles), count // 100)):
+        ret.append((IdTrigger(videoid), Behaviour.black))
+    rng.shuffle(ret)
+    return ret
+
+
+def measure(func, setup=None, repeat=3):
+    """
+    run a function several times
+    :param setup: a function that is run before every run without being timed, its result is passed to func
+    :return: the timings of the runs, and the result of the last run
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        result = func(arg) if setup is not None else func()
+        times.append(time.perf_counter() - start)
+    return {'best': min(times), 'mean': statistics.mean(times), 'runs': len(times)}, result
+
+
+class Bench:
+    def __init__(self, args, workdir: Path):
+        self.args = args
+        self.workdir = workdir
+        rng = random.Random(args.seed)
+        self.titles = make_titles(args.videos, rng)
+        self.blob = workdir / 'stream.bin'
+        with open(self.blob, 'wb') as w:
+            w.write(bytes(args.stream_size))
+        self.source = FakeSource(self.titles, args.latency, self.blob)
+
+        # the destinations hold some of the playlist's videos, some videos that were removed from it, and noise
+        self.roots = [workdir / f'destination {i}' for i in range(args.roots)]
+        for root in self.roots:
+            root.mkdir(exist_ok=True)
+        matched = rng.sample(self.titles, int(len(self.titles) * args.matched))
+        self.assoc = {videoid: safe_filename(title) + '.mp4' for videoid, title in matched}
+        removed = [f'r{i:010x}' for i in range(int(len(self.assoc) * args.removed))]
+        self.assoc.update((videoid, f'removed video {videoid}.mp4') for videoid in removed)
+        noise = [f'unmanaged {i}.{rng.choice(("mp4", "txt", "jpg"))}' for i in range(args.files)]
+        names = list(self.assoc.values()) + noise
+        for i, root in enumerate(self.roots):
+            make_tree(root, names[i::len(self.roots)], args.depth, args.fanout, rng)
+        self.rules = make_rules(args.rules, self.titles, rng)
+
+    def new_phar(self, assoc=True) -> Phar:
+        ret = Phar()
+        ret.source_playlist_id = 'benchmark'
+        ret.destination_roots = list(self.roots)
+        ret.rules = self.rules
+        ret.id_fname_assoc = dict(self.assoc) if assoc else {}
+        ret.source = self.source
+        return ret
+
+    def fetched_phar(self, assoc=True) -> Phar:
+        ret = self.new_phar(assoc)
+        ret._fetch()
+        return ret
+
+    def bench_fetch(self):
+        timing, phar = measure(lambda p: (p._fetch(), p)[1], self.new_phar, self.args.repeat)
+        timing['videos'] = len(phar.videos)
+        return timing
+
+    def bench_fetch_flat(self):
+        # the whole playlist is listed at once, along with its titles
+        flat = MemorySource({'benchmark': self.titles}, self.source.load_video)
+
+        def setup():
+            ret = self.new_phar()
+            ret.source = flat
+            return ret
+        timing, phar = measure(lambda p: (p._fetch(), p)[1], setup, self.args.repeat)
+        timing['videos'] = len(phar.videos)
+        return timing
+
+    def bench_fetch_memory(self):
+        # the memory that a fetched playlist keeps, including the strings of its ids and titles, which are decoded
+        #  from a listing, like a real source's
+        listing = json.dumps(self.titles)
+        phar = self.new_phar()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            phar.source = MemorySource({'benchmark': json.loads(listing)})
+            phar._fetch()
+            phar.source = None
+            gc.collect()
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        videos = len(phar.videos)
+        return {'videos': videos, 'bytes': retained, 'peak': peak, 'bytes_per_video': retained / videos}
+
+    def _suggest(self, phar: Phar, full=True):
+        return sum(1 for _ in phar.suggest_edits(full=full))
+
+    def bench_suggest_edits_cold(self):
+        # the files of the destination are not indexed yet
+        timing, suggestions = measure(self._suggest, self.fetched_phar, self.args.repeat)
+        timing['suggestions'] = suggestions
+        return timing
+
+    def bench_suggest_edits_warm(self):
+        def setup():
+            ret = self.fetched_phar()
+            ret.scan_destination()
+            return ret
+        timing, suggestions = measure(self._suggest, setup, self.args.repeat)
+        timing['suggestions'] = suggestions
+        return timing
+
+    def bench_suggest_edits_matching(self):
+        # no file is associated with a video yet, so every video is matched against the destination by its name
+        def setup():
+            ret = self.fetched_phar(assoc=False)
+            ret.scan_destination()
+            return ret
+        timing, suggestions = measure(self._suggest, setup, self.args.repeat)
+        timing['suggestions'] = suggestions
+        return timing
+
+    def bench_suggest_edits_incremental(self):
+        # nothing changed since the last sync
+        def setup():
+            ret = self.fetched_phar()
+            ret.scan_destination()
+            ret.sync_snapshot = SyncSnapshot.of(v.videoid for v in ret.videos if v.exists_in_source)
+            return ret
+        timing, suggestions = measure(lambda p: self._suggest(p, full=False), setup, self.args.repeat)
+        timing['suggestions'] = suggestions
+        return timing
+
+    def bench_get_behaviour(self, profiler=None):
+        def run(phar: Phar):
+            # the rules are compiled on the first call
+            return sum(phar.get_behaviour(v).add is False for v in phar.videos)
+        phar = self.fetched_phar()
+
+        def setup():
+            phar.rules = self.rules
+            if profiler is not None:
+                phar.profiler = profiler
+            return phar
+        timing, hits = measure(run, setup, self.args.repeat)
+        timing['compile'], _ = measure(lambda p: p.rules.compiled(), setup, self.args.repeat)
+        timing['rules'] = len(self.rules)
+        timing['evaluations'] = len(phar.videos)
+        timing['blacklisted'] = hits
+        return timing
+
+    def bench_get_behaviour_profiled(self):
+        # the overhead of instrumentation, compared to get_behaviour
+        return self.bench_get_behaviour(Profiler())
+
+    def _full_phar(self):
+        ret = self.fetched_phar()
+        ret.scan_destination()
+        ret.mark_synced()
+        return ret
+
+    def _bench_roundtrip(self, protocol):
+        phar = self._full_phar()
+        write, data = measure(lambda: phar.write(protocol=protocol), repeat=self.args.repeat)
+        read, _ = measure(lambda: Phar.read(data), repeat=self.args.repeat)
+        return {'write': write, 'read': read, 'bytes': len(data)}
+
+    def bench_roundtrip_pickle(self):
+        return self._bench_roundtrip(1)
+
+    def bench_roundtrip_binary(self):
+        return self._bench_roundtrip(2)
+
+    def _list_unmanaged(self, path):
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            list_unmanaged.main([str(path)])
+
+    def bench_list_unmanaged_cold(self):
+        path = self.workdir / 'cold.phr'
+
+        def setup():
+            # the project does not store an index of the destination yet
+            phar = self.new_phar()
+            phar.save(path)
+            return path
+        timing, _ = measure(self._list_unmanaged, setup, self.args.repeat)
+        return timing
+
+    def bench_list_unmanaged_warm(self):
+        path = self.workdir / 'warm.phr'
+        self._full_phar().save(path)
+        self._list_unmanaged(path)
+        timing, _ = measure(lambda: self._list_unmanaged(path), repeat=self.args.repeat)
+        return timing
+
+    def bench_downloads(self):
+        count = min(self.args.downloads, len(self.titles))
+
+        def setup():
+            root = Path(self.workdir / f'downloads {time.monotonic_ns()}')
+            root.mkdir()
+            phar = self.new_phar(assoc=False)
+            phar.destination_root = root
+            return phar
+
+        def run(phar: Phar):
+            entries = self.source.list_playlist(phar.source_playlist_id)[:count]
+            with DownloadScheduler(self.args.workers) as scheduler:
+                for paf in entries:
+                    scheduler.submit(paf.videoid, phar.download_callback, paf, safe_filename(paf.title))
+                return scheduler.join()
+        timing, results = measure(run, setup, self.args.repeat)
+        timing['downloads'] = count
+        timing['succeeded'] = sum(r.success for r in results)
+        timing['bytes_per_second'] = count * self.args.stream_size / timing['best']
+        return timing
+
+    def names(self):
+        return [name[len('bench_'):] for name in dir(self) if name.startswith('bench_')]
+
+    def bench_downloads_limited(self):
+        count = min(self.args.downloads, len(self.titles))
+
+        def setup():
+            root = Path(self.workdir / f'limited downloads {time.monotonic_ns()}')
+            root.mkdir()
+            phar = self.new_phar(assoc=False)
+            phar.destination_root = root
+            return phar
+
+        def run(phar: Phar):
+            entries = self.source.list_playlist(phar.source_playlist_id)[:count]
+            with DownloadScheduler(self.args.workers, bandwidth=TokenBucket(self.args.limit)) as scheduler:
+                phar.download_scheduler = scheduler
+                for paf in entries:
+                    scheduler.submit(paf.videoid, phar.download_callback, paf, safe_filename(paf.title))
+                return scheduler.join()
+        timing, results = measure(run, setup, self.args.repeat)
+        timing['downloads'] = count
+        timing['succeeded'] = sum(r.success for r in results)
+        timing['limit'] = self.args.limit
+        timing['bytes_per_second'] = count * self.args.stream_size / timing['best']
+        return timing
+
+    def run(self, only=None):
+        ret = {}
+        for name in self.names():
+            if only and name not in only:
+                continue
+            print(f'running {name}', file=sys.stderr)
+            ret[name] = getattr(self, 'bench_' + name)()
+        return ret
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    with TemporaryDirectory(prefix='pharaoh-benchmark-') as workdir:
+        bench = Bench(args, Path(workdir))
+        unknown = set(args.only or ()) - set(bench.names())
+        if unknown:
+            parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+        results = bench.run(args.only)
+    report = {
+        'pharaoh': pharaohlib.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('only', 'output')},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as w:
+            w.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
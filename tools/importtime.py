@@ -0,0 +1,112 @@
+from argparse import ArgumentParser
+from typing import Dict, List, Tuple
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+import pharaohlib
+
+parser = ArgumentParser(description='time the imports of pharaoh\'s entry points with "python -X importtime", and '
+                                    'check that they do not import the heavy modules that only fetching needs')
+
+parser.add_argument('--module', action='append', dest='modules',
+                    help='a module to time, can be repeated, defaults to the library and the CLI')
+parser.add_argument('--forbid', action='append',
+                    help='a module that must not be imported by the entry points, can be repeated, defaults to the '
+                         'remote backend and the modules only fetching and syncing need')
+parser.add_argument('--repeat', type=int, default=5, help='the number of times to import every module')
+parser.add_argument('--max-ms', type=float, default=None, dest='max_ms',
+                    help='fail if the best import time of any module is longer than this')
+parser.add_argument('--top', type=int, default=10, help='the number of slowest imported modules to report')
+parser.add_argument('-o', '--output', help='write the results to this file instead of the standard output')
+
+_default_modules = ('pharaohlib', 'pharaohCLI.run')
+_default_forbidden = ('pafy', 'youtube_dl', 'yt_dlp', 'urllib.request', 'asyncio')
+
+
+def _env():
+    # the bytecode must be cached before the measured runs, like in an installed package
+    ret = dict(os.environ)
+    ret.pop('PYTHONDONTWRITEBYTECODE', None)
+    return ret
+
+
+def import_times(code: str) -> List[Tuple[str, int]]:
+    """
+    run code in a new interpreter
+    :return: the name and self time (in microseconds) of every module it imported, in the order they were imported
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    ret = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            # the header
+            continue
+        ret.append((name.strip(), int(self_us)))
+    return ret
+
+
+def measure(module: str, startup: frozenset, repeat: int, top: int) -> dict:
+    # the first import writes the bytecode cache
+    import_times(f'import {module}')
+    totals = []
+    best: Dict[str, int] = None
+    for _ in range(repeat):
+        times = {name: us for name, us in import_times(f'import {module}') if name not in startup}
+        total = sum(times.values())
+        if not totals or total < min(totals):
+            best = times
+        totals.append(total)
+    return {
+        'best_ms': min(totals) / 1000,
+        'mean_ms': statistics.mean(totals) / 1000,
+        'runs': len(totals),
+        'modules': len(best),
+        'slowest': {name: us / 1000 for name, us in sorted(best.items(), key=lambda i: -i[1])[:top]},
+        'imported': sorted(best),
+    }
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    modules = args.modules or _default_modules
+    forbidden = args.forbid or _default_forbidden
+    # the modules every interpreter imports on startup are not part of the entry points' cost
+    startup = frozenset(name for name, _ in import_times('pass'))
+    results = {}
+    failures = []
+    for module in modules:
+        print(f'timing {module}', file=sys.stderr)
+        result = results[module] = measure(module, startup, args.repeat, args.top)
+        imported = result.pop('imported')
+        result['forbidden'] = [name for name in forbidden if name in imported]
+        if result['forbidden']:
+            failures.append(f'{module} imports {", ".join(result["forbidden"])}')
+        if args.max_ms is not None and result['best_ms'] > args.max_ms:
+            failures.append(f'{module} takes {result["best_ms"]:.1f}ms to import')
+    report = {
+        'pharaoh': pharaohlib.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {k: v for k, v in vars(args).items() if k != 'output'},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as w:
+            w.write(text + '\n')
+    else:
+        print(text)
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,33 @@
 from argparse import ArgumentParser
+from pathlib import Path
 
 from pharaohlib import Phar
+from pharaohlib.downloads import partial_path
 
 parser = ArgumentParser()
 
 parser.add_argument('phar_path')
-parser.add_argument('-del', action='set_true', default=False, dest='del_')
+parser.add_argument('-del', action='store_true', default=False, dest='del_')
 
 
 def main(args=None):
     args = parser.parse_args(args)
-    phar = Phar.read(open(args.phar_path, 'rb'))
-    managed = frozenset(v.file_name for v in phar.videos)
-    for path in phar.destination_root.rglob('**/*.*'):
-        if path.name in managed:
+    phar = Phar.load(args.phar_path)
+    # scanning also follows managed files that were renamed
+    index = phar.scan_destination()
+    # all the managed file names are in the project, no need to fetch the playlist
+    managed = frozenset(phar.id_fname_assoc.values())
+    partials = frozenset(partial_path(Path(p.file_name)).name for p in phar.partial_downloads.values())
+    for path in list(index.files()):
+        if '.' not in path.name or path.name in managed or path.name in partials:
             continue
         if args.del_:
             path.unlink()
+            index.discard(path)
         print(path)
+    # store the refreshed index, so the next scan only lists the directories that changed
+    phar.save()
+    phar.close()
 
 
 if __name__ == '__main__':